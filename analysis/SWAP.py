@@ -9,7 +9,7 @@ import cPickle
 
 # ======================================================================
 
-def SWAP(argv):
+def SWAP(argv,resident=None):
     """
     NAME
         SWAP.py
@@ -45,16 +45,38 @@ def SWAP(argv):
         in in its entirety, because a classifier can reappear any time
         to  have their agent update its confusion matrix.
 
+        SWAPSHOP.py runs SWAP batch after batch in one process, passing
+        in a dictionary of resident state. After the first batch, it
+        holds the configuration, bureau, sample and database (and the
+        event log and retired subject index), which are then used as
+        they are instead of being read in again. The state is only
+        saved (see save_state(), below) if resident['checkpoint'] is
+        True; everything needed to save it later is left in the
+        dictionary. SWAPD.py also puts a 'tail' list in it, to which
+        the subject ID and key (see swap.Record) of each classification
+        processed are appended, with the subject's state and status
+        before it was updated.
+
     FLAGS
         -h            Print this message
 
     INPUTS
         configfile    Plain text file containing SW experiment configuration
 
+    OPTIONAL INPUTS
+        resident      Dictionary of state to keep between batches (see above)
+
     OUTPUTS
         stdout
         *_bureau.pickle
         *_collection.pickle
+          (or *_bureau.snapshot and *_collection.snapshot directories,
+          if state_format is 'snapshot')
+        trajectory_store directory of subjects' probability ensembles
+          (if trajectory is 'full' and trajectory_store is set)
+        *_retirement_feed.txt  ZooIDs of the subjects retired since the
+          state was last saved, in the output directory, whenever it is
+          saved
 
     EXAMPLE
 
@@ -101,23 +123,52 @@ def SWAP(argv):
         print SWAP.__doc__
         return
 
+    # Are we carrying on from the last batch, in the same process?
+    carry_on = (resident is not None and 'tonights' in resident)
+
     # ------------------------------------------------------------------
     # Read in run configuration:
 
-    tonights = swap.Configuration(configfile)
+    if carry_on:
+        tonights = resident['tonights']
+        print "SWAP: carrying on from the last batch, from "+tonights.parameters['start']
 
-    # Read the pickled random state file
-    random_file = open(tonights.parameters['random_file'],"r");
-    random_state = cPickle.load(random_file);
-    random_file.close();
-    np.random.set_state(random_state);
+    else:
+        tonights = swap.Configuration(configfile)
+
+        # If we are keeping checkpoints, carry on from the latest one
+        # (which is where update.config should point, unless we died
+        # before writing it):
+        try: checkpoints = tonights.parameters['checkpoints']
+        except: checkpoints = None
+        if checkpoints is not None and tonights.parameters['start'] != 'the_beginning':
+            manifest = swap.Checkpoints(checkpoints).resume(tonights.parameters)
+            if manifest is not None:
+                print "SWAP: carrying on from checkpoint",manifest['generation'],"in "+checkpoints
+
+        # Read the pickled random state file
+        random_file = open(tonights.parameters['random_file'],"r");
+        random_state = cPickle.load(random_file);
+        random_file.close();
+        np.random.set_state(random_state);
 
     practise = (tonights.parameters['dbspecies'] == 'Toy')
+    replay = (tonights.parameters['dbspecies'] == 'Log')
     if practise:
         print "SWAP: doing a dry run using a Toy database"
+    elif replay:
+        print "SWAP: replaying classifications from the event log"
     else:
         print "SWAP: data will be read from the current live Mongo database"
 
+    # Shall we log every classification we digest, so that we can replay
+    # them later? (Or, which log are we replaying?)
+    try: eventlog = tonights.parameters['eventlog']
+    except: eventlog = None
+    if replay and eventlog is None:
+        print "SWAP: no event log to replay! Set eventlog in the config file"
+        return
+
     stage = str(int(tonights.parameters['stage']))
     survey = tonights.parameters['survey']
     print "SWAP: looks like we are on Stage "+stage+" of the ",survey," survey project"
@@ -179,6 +230,20 @@ def SWAP(argv):
         t1 = datetime.datetime.strptime(tonights.parameters['start'], '%Y-%m-%d_%H:%M:%S')
     print "SWAP: updating all subjects classified between "+tonights.parameters['start']
 
+    # Exactly where in the database did the last batch get to? We carry
+    # on from the classification after that one - unless start has been
+    # changed since (by hand, say):
+    try: start_key = tonights.parameters['start_key']
+    except: start_key = None
+    after = None
+    if start_key is not None and tonights.parameters['start'] != 'the_beginning':
+        after = swap.read_key(start_key)
+        if after[0].replace(microsecond=0) == t1:
+            print "SWAP: (carrying on from the classification after "+start_key+")"
+        else:
+            print "SWAP: start_key "+start_key+" is not at the start time, ignoring it"
+            after,start_key = None,None
+
     # When will we stop considering classifications?
     if tonights.parameters['end'] == 'the_end_of_time':
         t2 = datetime.datetime(2100, 1, 1, 12, 0, 0, 0)
@@ -204,6 +269,99 @@ def SWAP(argv):
     try: offline = tonights.parameters['offline']
     except: offline = False
     print "SWAP: should we do offline analysis? ",offline
+    try: n_workers = int(tonights.parameters['n_workers'])
+    except: n_workers = 1
+    if offline and n_workers > 1:
+        print "SWAP: offline analysis will use",n_workers,"processes"
+    # How long should EM run for, and should it be accelerated
+    # ('none', 'squarem' or 'aitken')?
+    try: N_min = int(tonights.parameters['N_min'])
+    except: N_min = 40   # min number of EM steps required
+    try: N_max = int(tonights.parameters['N_max'])
+    except: N_max = 100  # max number of EM steps allowed
+    # TODO: make the epsilons be in logit terms?
+    try: epsilon_min = float(tonights.parameters['epsilon_min'])
+    except: epsilon_min = 1e-6  # average change in probabilities before we claim convergence
+    try: EM_acceleration = tonights.parameters['EM_acceleration']
+    except: EM_acceleration = 'none'
+    if offline:
+        print "SWAP: offline EM will take",N_min,"to",N_max,"steps, with acceleration:",EM_acceleration
+    # Should offline EM start from where the last batch's left off?
+    # (Only supervised EM can - see swap.warm_start().)
+    try: incremental = tonights.parameters['incremental']
+    except: incremental = False
+    try: offlinefile = tonights.parameters['offlinefile']
+    except: offlinefile = None
+    if offline and incremental and (supervised_and_unsupervised or not supervised):
+        print "SWAP: offline EM can only be warm-started when supervised: starting from scratch"
+        incremental = False
+    if offline and incremental:
+        print "SWAP: offline EM will be warm-started from ",offlinefile
+
+    # Will we update agents and subjects one classification at a time,
+    # or a chunk at a time with the vectorised batch engine - or, still
+    # experimental, split up by subject across several processes?
+    try: engine = tonights.parameters['engine']
+    except: engine = 'sequential'
+    try: N_per_chunk = int(tonights.parameters['N_per_chunk'])
+    except: N_per_chunk = 10000
+    if engine == 'batch':
+        print "SWAP: updating in chunks of ",N_per_chunk," classifications"
+    elif engine == 'sharded':
+        try: N_shards = int(tonights.parameters['N_shards'])
+        except: N_shards = 1
+        try: N_per_sync = int(tonights.parameters['N_per_sync'])
+        except: N_per_sync = 1000
+        print "SWAP: updating in chunks of ",N_per_chunk," classifications, sharded by subject over",N_shards,"processes"
+        print "SWAP: agents will be reconciled every",N_per_sync,"classifications"
+        shards = swap.ShardWorkers(N_shards)
+    else:
+        engine = 'sequential'
+        print "SWAP: updating one classification at a time"
+
+    # Draw the agents' confusion matrix realizations from the global
+    # random stream, or from a stream of their own for each
+    # classification, keyed on this seed and the subject?
+    try: random_seed = tonights.parameters['random_seed']
+    except: random_seed = None
+    if random_seed is not None:
+        random_seed = int(random_seed)
+        print "SWAP: drawing each classification's confusion matrix realizations from its own stream, with seed",random_seed
+    elif engine != 'sequential':
+        # The engines can only agree if the draws don't depend on the
+        # order in which the updates are made:
+        print "SWAP: WARNING: with no random_seed, the",engine,"engine's confusion matrix realizations are not those the sequential engine would draw, so nor are its probabilities - set random_seed to make them the same"
+
+    # How much of each subject's trajectory will we record: nothing
+    # ('off'), the median and 16th/84th percentiles ('summary'), or the
+    # whole probability ensembles too ('full')? And will the ensembles be
+    # kept in the sample, or moved out into a store whenever it is saved?
+    try: trajectory = tonights.parameters['trajectory']
+    except: trajectory = 'full'
+    if trajectory not in swap.trajectory_modes:
+        raise Exception("SWAP: unrecognised trajectory mode: "+str(trajectory))
+    try: trajectory_store = tonights.parameters['trajectory_store']
+    except: trajectory_store = None
+    print "SWAP: recording subjects' trajectories:",trajectory
+    if trajectory == 'full' and trajectory_store is not None:
+        print "SWAP: and keeping their probability ensembles in "+trajectory_store
+
+    # Where will we save checkpoints of the state? (None = just save the
+    # pickles in the $cwd, one by one.)
+    try: checkpoints = tonights.parameters['checkpoints']
+    except: checkpoints = None
+    if checkpoints is not None:
+        print "SWAP: saving checkpoints in "+checkpoints
+
+    # Will the bureau keep its agents as objects, or in arrays?
+    try: bureau_backend = tonights.parameters['bureau_backend']
+    except: bureau_backend = 'objects'
+    print "SWAP: bureau will store its agents as ",bureau_backend
+
+    # And will the sample keep its subjects as objects, or in arrays?
+    try: collection_backend = tonights.parameters['collection_backend']
+    except: collection_backend = 'objects'
+    print "SWAP: sample will store its subjects as ",collection_backend
 
     # How will we make decisions based on probability?
     thresholds = {}
@@ -214,17 +372,39 @@ def SWAP(argv):
     # Read in, or create, a bureau of agents who will represent the
     # volunteers:
 
-    bureau = swap.read_pickle(tonights.parameters['bureaufile'],'bureau')
+    if carry_on:
+        bureau = resident['bureau']
+    else:
+        bureau = swap.read_pickle(tonights.parameters['bureaufile'],'bureau')
+
+    if bureau_backend == 'arrays' and not isinstance(bureau,swap.ArrayBureau):
+        bureau = swap.ArrayBureau(bureau)
+        print "SWAP: moved the agents into an",bureau.__class__.__name__
 
     # ------------------------------------------------------------------
     # Read in, or create, an object representing the candidate list:
 
-    sample = swap.read_pickle(tonights.parameters['samplefile'],'collection')
+    if carry_on:
+        sample = resident['sample']
+    else:
+        sample = swap.read_pickle(tonights.parameters['samplefile'],'collection')
+
+    if collection_backend == 'arrays' and not isinstance(sample,swap.ArrayCollection):
+        sample = swap.ArrayCollection(sample)
+        print "SWAP: moved the subjects into an",sample.__class__.__name__
 
     # ------------------------------------------------------------------
     # Open up database:
 
-    if practise:
+    # How many classifications to fetch (and digest) at a time:
+    try: N_per_query = int(tonights.parameters['N_per_query'])
+    except: N_per_query = 1000
+
+    if carry_on:
+
+        db = resident['db']
+
+    elif practise:
 
         db = swap.read_pickle(tonights.parameters['dbfile'],'database')
 
@@ -237,16 +417,65 @@ def SWAP(argv):
         print "SWAP: made by ",db.population," Toy classifiers"
         print "SWAP: where each classifier makes ",db.enthusiasm," classifications, on average"
 
+        # Make the classifications as time goes on, like a live database?
+        try: toy_rate = tonights.parameters['toy_rate']
+        except: toy_rate = None
+        if toy_rate is not None and not isinstance(db,swap.ToyStream):
+            db = swap.ToyStream(db,rate=toy_rate)
+            print "SWAP: streaming them, as a",db
+
+    elif replay:
+
+        db = swap.EventLog(eventlog)
+        print "SWAP: replaying",db,"from "+eventlog
+
     else:
 
-        db = swap.MongoDB()
+        # Keep the subjects' metadata from one batch to the next:
+        try: subject_cache = tonights.parameters['subject_cache']
+        except: subject_cache = swap.get_new_filename(tonights.parameters,'subject_cache')
+        db = swap.MongoDB(cachefile=subject_cache,batch_size=N_per_query)
+
+    # Digest classifications on several processes, while this one does the
+    # updates? (Only worth it for the Mongo.)
+    try: N_digest_workers = int(tonights.parameters['N_digest_workers'])
+    except: N_digest_workers = 1
+    if N_digest_workers > 1 and not (practise or replay):
+        print "SWAP: digesting classifications on",N_digest_workers,"processes"
+
+    # Record what we digest, unless it is coming from the log already:
+    if carry_on:
+        log = resident['log']
+    elif eventlog is not None and not replay:
+        log = swap.EventLog(eventlog)
+        # Anything logged after the state we are carrying on from was
+        # saved is about to be done (and logged) again:
+        try: eventlog_size = int(tonights.parameters['eventlog_size'])
+        except: eventlog_size = None
+        if eventlog_size is not None and log.size() > eventlog_size:
+            print "SWAP: cutting the event log back to the",eventlog_size,"classifications logged when the state was saved"
+            log.truncate(eventlog_size)
+        print "SWAP: logging classifications to",log,"in "+eventlog
+    else:
+        log = None
+
+    # In a hasty run, classifications of retired subjects change nothing,
+    # so drop them before they are even digested - unless they are being
+    # logged, when they have to be digested anyway:
+    if carry_on:
+        retired = resident['retired']
+    elif waste and log is None:
+        retired = swap.RetiredSubjects(sample)
+        print "SWAP: skipping classifications of the",retired.size(),"retired subjects, and any that retire"
+    else:
+        retired = None
 
     # Read in a batch of classifications, made since the aforementioned
-    # start time:
+    # start time (swap.digested asks the db for them, below):
 
-    batch = db.find('since',t1)
+    query = ('since',t1,after)
 
-    # Actually, batch is a cursor, now set to the first classification
+    # Actually, what we get is a cursor, set to the first classification
     # after time t1. Maybe this could be a Kafka cursor instead? And then
     # all of this could be in an infinite loop? Hmm - we'd still want to
     # produce some output periodically - but this should be done by querying
@@ -259,43 +488,60 @@ def SWAP(argv):
     if one_by_one: print "SWAP: ...one by one - hit return for the next one..."
 
     count = 0
-    for classification in batch:
+    chunk = []
+    # (SWAPD.py wants to know which subjects were classified, and when.)
+    if resident is not None and 'tail' in resident:
+        tail = resident['tail']
+    else:
+        tail = None
+    # (If there is nothing to do, we start from the same place next time.)
+    tstring = tonights.parameters['start']
+    key = None
+    digests = swap.digested(db,query,survey,method=use_marker_positions,N_workers=N_digest_workers,N_per_chunk=N_per_query,retired=retired)
+    for record in digests:
 
         if one_by_one: next = raw_input()
 
         # Get the vitals for this classification:
-        items = db.digest(classification,survey,method=use_marker_positions)
-        if vb: print "#"+str(count+1)+". items = ",items
-        if items is None:
+        if vb: print "#"+str(count+1)+". record = ",record
+        if record is None:
             continue # Tutorial subjects fail, as do stage/project mismatches!
-        # t,Name,ID,ZooID,category,kind,X,Y,location,thisstage,P = items
         # X, Y: result,truth (LENS,NOT,UNKNOWN)
         # CPD 31.5.14: added annotation_x, annotation_y : locations of clicks
         # PJM 20014-08-21: added "flavor" of subject, 'lensing cluster', len
-        tstring,Name,ID,ZooID,category,kind,flavor,X,Y,location,classification_stage,at_x,at_y = items
+        # The record is already typed (see swap.Record), but the agents and
+        # subjects want the names of the category, kind, result and truth,
+        # and the time as a string:
+        t,Name,ID,ZooID,flavor,location = record.t,record.Name,record.ID,record.ZooID,record.flavor,record.location
+        category,kind,X,Y = record.category_name,record.kind_name,record.result_name,record.truth_name
+        at_x = record.at_x.tolist()
+        at_y = record.at_y.tolist()
+
+        # Break out if we've reached the time limit, leaving this
+        # classification for next time:
+        if t > t2:
+            break
 
-        # this is probably bad form:
-        at_x = eval(at_x)
-        at_y = eval(at_y)
+        # Only now do we carry on from here next time:
+        tstring = record.tstring
+        key = record.key
 
-        t = datetime.datetime.strptime(tstring, '%Y-%m-%d_%H:%M:%S')
+        # Log everything up to the time limit, whatever its stage:
+        if log is not None:
+            log.append(record)
 
         # If the stage of this classification does not match the stage we are
         # on, skip to the next one!
-        if classification_stage != stage:
+        if record.stage != int(stage):
             if vb:
-                print "Found classification from different stage: ",classification_stage," cf. ",stage,", items = ",items
+                print "Found classification from different stage: ",record.stage," cf. ",stage,", record = ",record
                 print " "
             continue
         else:
             if vb:
-                print "Found classification from this stage: ",items
+                print "Found classification from this stage: ",record
                 print " "
 
-        # Break out if we've reached the time limit:
-        if t > t2:
-            break
-
         # Register new volunteers, and create an agent for each one:
         # Old, slow code: if Name not in bureau.list():
         try: test = bureau.member[Name]
@@ -304,37 +550,63 @@ def SWAP(argv):
         # Register newly-classified subjects:
         # Old, slow code: if ID not in sample.list():
         try: test = sample.member[ID]
-        except: sample.member[ID] = swap.Subject(ID,ZooID,category,kind,flavor,Y,thresholds,location,prior=prior)
-
-        # Update the subject's lens probability using input from the
-        # classifier. We send that classifier's agent to the subject
-        # to do this.
-        sample.member[ID].was_described(by=bureau.member[Name],as_being=X,at_time=tstring,while_ignoring=a_few_at_the_start,haste=waste,at_x=at_x,at_y=at_y)
-
-        # Update the agent's confusion matrix, based on what it heard:
-
-        P = sample.member[ID].mean_probability
-
+        except: sample.member[ID] = swap.Subject(ID,ZooID,category,kind,flavor,Y,thresholds,location,prior=prior,trajectory=trajectory)
+
+        # Note the subject's state and status before this classification:
+        if tail is not None:
+            subject = sample.member[ID]
+            tail.append((ID,key,subject.state,subject.status))
+
+        if engine != 'sequential':
+
+            # Batch (or sharded) engine: save up the classification, and
+            # only update the agents and subjects when we have a whole
+            # chunk of them. (P is then only up to date as of the last
+            # chunk.)
+            chunk.append(record)
+            if len(chunk) == N_per_chunk:
+                if engine == 'sharded':
+                    swap.sharded_update(bureau,sample,swap.make_chunk(chunk),shards,N_per_sync=N_per_sync,while_ignoring=a_few_at_the_start,haste=waste,supervised=supervised,supervised_and_unsupervised=supervised_and_unsupervised,agents_willing_to_learn=agents_willing_to_learn,seed=random_seed,trajectory=trajectory)
+                else:
+                    swap.batch_update(bureau,sample,swap.make_chunk(chunk),while_ignoring=a_few_at_the_start,haste=waste,supervised=supervised,supervised_and_unsupervised=supervised_and_unsupervised,agents_willing_to_learn=agents_willing_to_learn,seed=random_seed,trajectory=trajectory)
+                if retired is not None:
+                    for this in set([r.ID for r in chunk]):
+                        if sample.member[this].state == 'inactive': retired.add(this)
+                chunk = []
+            P = sample.member[ID].mean_probability
 
-        if supervised_and_unsupervised:
-            # use both training and test images
-            if agents_willing_to_learn * ((category == 'test') + (category == 'training')):
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=False,ID=ID,at_time=tstring)
-            elif ((category == 'test') + (category == 'training')):
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=True,ID=ID,at_time=tstring)
-        elif supervised:
-            # Only use training images!
-            if category == 'training' and agents_willing_to_learn:
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=False,ID=ID,at_time=tstring)
-            elif category == 'training':
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=True,ID=ID,at_time=tstring)
         else:
-            # Unsupervised: ignore all the training images...
-            if category == 'test' and agents_willing_to_learn:
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=False,ID=ID,at_time=tstring)
-            elif category == 'test':
-                bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=True,ID=ID,at_time=tstring)
 
+            # Update the subject's lens probability using input from the
+            # classifier. We send that classifier's agent to the subject
+            # to do this.
+            sample.member[ID].was_described(by=bureau.member[Name],as_being=X,at_time=tstring,while_ignoring=a_few_at_the_start,haste=waste,at_x=at_x,at_y=at_y,seed=random_seed,trajectory=trajectory)
+            if retired is not None and sample.member[ID].state == 'inactive':
+                retired.add(ID)
+
+            # Update the agent's confusion matrix, based on what it heard:
+
+            P = sample.member[ID].mean_probability
+
+
+            if supervised_and_unsupervised:
+                # use both training and test images
+                if agents_willing_to_learn * ((category == 'test') + (category == 'training')):
+                    bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=False,ID=ID,at_time=tstring)
+                elif ((category == 'test') + (category == 'training')):
+                    bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=True,ID=ID,at_time=tstring)
+            elif supervised:
+                # Only use training images!
+                if category == 'training' and agents_willing_to_learn:
+                    bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=False,ID=ID,at_time=tstring)
+                elif category == 'training':
+                    bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=True,ID=ID,at_time=tstring)
+            else:
+                # Unsupervised: ignore all the training images...
+                if category == 'test' and agents_willing_to_learn:
+                    bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=False,ID=ID,at_time=tstring)
+                elif category == 'test':
+                    bureau.member[Name].heard(it_was=X,actually_it_was=Y,with_probability=P,ignore=True,ID=ID,at_time=tstring)
 
         # Brag about it:
         count += 1
@@ -362,9 +634,29 @@ def SWAP(argv):
         elif count == count_max:
             break
 
+    # Stop reading (and digesting) classifications - whatever processes
+    # were doing that are shut down now, rather than whenever the
+    # generator is garbage collected:
+    digests.close()
+
+    # Apply whatever is left of the last chunk:
+    if engine == 'batch':
+        swap.batch_update(bureau,sample,swap.make_chunk(chunk),while_ignoring=a_few_at_the_start,haste=waste,supervised=supervised,supervised_and_unsupervised=supervised_and_unsupervised,agents_willing_to_learn=agents_willing_to_learn,seed=random_seed,trajectory=trajectory)
+        chunk = []
+    elif engine == 'sharded':
+        swap.sharded_update(bureau,sample,swap.make_chunk(chunk),shards,N_per_sync=N_per_sync,while_ignoring=a_few_at_the_start,haste=waste,supervised=supervised,supervised_and_unsupervised=supervised_and_unsupervised,agents_willing_to_learn=agents_willing_to_learn,seed=random_seed,trajectory=trajectory)
+        chunk = []
+        shards.close()
+
+    if log is not None:
+        log.flush()
+        tonights.parameters['eventlog_size'] = log.size()
+
     sys.stdout.write('\n')
     if vb: print swap.dashedline
     print "SWAP: total no. of classifications processed: ",count
+    if retired is not None:
+        print "SWAP: classifications of retired subjects skipped: ",retired.skipped
 
     #-------------------------------------------------------------------------
 
@@ -375,99 +667,41 @@ def SWAP(argv):
         # will also need to set probabilities to prior_probability and such
         # before the algorithm is run
 
-        # some settings that I guess you could configure but these work fine enough
         initialPL = tonights.parameters['initialPL']
         initialPD = tonights.parameters['initialPD']
-        N_min = 40   # min number of EM steps required
-        N_max = 100  # max number of EM steps allowed
-        # TODO: make the epsilons be in logit terms?
-        epsilon_min = 1e-6  # average change in probabilities before we claim convergence
-        epsilon_taus = 10  # initial value
-        N_try = 0  # initial value
-        epsilon_list = []
-
-        print "SWAP: offline: resetting prior probability to ",prior
-        for ID in sample.list():
-            sample.member[ID].probability = prior
-            sample.member[ID].update_state()
-        print "SWAP: offline: resetting PL and PDs to ",initialPL,initialPD
-        for ID in bureau.list():
-            bureau.member[ID].PD = initialPD
-            bureau.member[ID].PL = initialPL
 
-        print "SWAP: offline: running EM"
-        while (epsilon_taus > epsilon_min) * (N_try < N_max) + (N_try < N_min):
-
-            # do E step
-            epsilon_taus = 0
-            num_taus = 0
+        # EM can only pick up where it left off if nothing else has
+        # changed:
+        EM_settings = {'supervised':supervised,'supervised_and_unsupervised':supervised_and_unsupervised,
+                       'initialPL':initialPL,'initialPD':initialPD,'prior':prior}
+
+        active = None
+        if incremental:
+            # (SWAPSHOP.py keeps the last batch's in memory.)
+            if carry_on:
+                last_state = resident['offline_state']
+            else:
+                last_state = swap.read_pickle(offlinefile,'offline')
+            active = swap.warm_start(bureau,sample,last_state,EM_settings)
+            if active is None:
+                print "SWAP: offline: no previous EM state with these settings, starting from scratch"
+            else:
+                print "SWAP: offline: warm start, with",len(active[0]),"agents and",len(active[1]),"subjects to converge again"
+
+        if active is None:
+            print "SWAP: offline: resetting prior probability to ",prior
             for ID in sample.list():
-                annotationhistory = sample.member[ID].annotationhistory
-                names = annotationhistory['Name']
-                classifications = annotationhistory['ItWas']
-                if len(names) > 0:
-                    old_probability = sample.member[ID].mean_probability
-                    if supervised_and_unsupervised:
-                        laplace_smoothing = 0
-                    elif supervised:
-                        laplace_smoothing = 0
-                    else:
-                        laplace_smoothing = 0
-
-                    sample.member[ID].was_described_many_times(bureau, names, classifications, realize_confusion=False, laplace_smoothing=laplace_smoothing)  # not doing the binomial realization
-                    epsilon_taus += (sample.member[ID].mean_probability - old_probability) ** 2
-                    num_taus += 1
-
-            # divide epsilon_taus by the number of taus
-            epsilon_taus = np.sqrt(epsilon_taus) * 1. / num_taus
-
-            # do M step
-            # I am PRETTY sure this is inefficient!
+                sample.member[ID].probability = prior
+                sample.member[ID].update_state()
+            print "SWAP: offline: resetting PL and PDs to ",initialPL,initialPD
             for ID in bureau.list():
-                agent = bureau.member[ID]
-                if supervised_and_unsupervised:
-                    # supervised learning AND unsupervised
-                    # use perfect training in M step
-                    # use test info in M step
-                    classifications_train = agent.traininghistory['ItWas']
-                    probabilities_train = []
-                    for Subj_ID in agent.traininghistory['ID']:
-                        if sample.member[Subj_ID].kind == 'test':
-                            probabilities_train.append(sample.member[Subj_ID].mean_probability)
-                        elif sample.member[Subj_ID].kind == 'sim':
-                            probabilities_train.append(1.0)
-                        elif sample.member[Subj_ID].kind == 'dud':
-                            probabilities_train.append(0)
-                    probabilities_train = np.array(probabilities_train)
-
-                    classifications_test = agent.testhistory['ItWas']
-                    probabilities_test = []
-                    for Subj_ID in agent.testhistory['ID']:
-                        probabilities_test.append(sample.member[Subj_ID].mean_probability)
-                    probabilities_test = np.array(probabilities_test)
-
-                    probabilities = np.append(probabilities_train, probabilities_test)
-                    classifications = np.append(classifications_train, classifications_test)
-                elif supervised:
-                    # supervised learning
-                    # use perfect training in M step
-                    # DONT use test info in M step
-                    probabilities = agent.traininghistory['ActuallyItWas']
-                    classifications = agent.traininghistory['ItWas']
+                bureau.member[ID].PD = initialPD
+                bureau.member[ID].PL = initialPL
 
-                else:
-                    # totally unsupervised
-                    # DONT use perfect training in M step
-                    # use test info in M step
-                    classifications = agent.testhistory['ItWas']
-                    probabilities = []
-                    for Subj_ID in agent.testhistory['ID']:
-                        probabilities.append(sample.member[Subj_ID].mean_probability)
-                    probabilities = np.array(probabilities)
-
-                bureau.member[ID].heard_many_times(probabilities, classifications)
-            # done with the EM steps! add one to the tally of tries
-            N_try += 1
+        print "SWAP: offline: running EM"
+        EM_trace = swap.offline_em(bureau,sample,supervised=supervised,supervised_and_unsupervised=supervised_and_unsupervised,N_min=N_min,N_max=N_max,epsilon_min=epsilon_min,n_workers=n_workers,acceleration=EM_acceleration,prior=prior,active=active)
+        if len(EM_trace) > 0:
+            print "SWAP: offline: done after",EM_trace[-1][1],"EM steps, in",len(EM_trace),"iterations"
 
         # done with EM! collect probabilities in the bureau
         bureau.collect_probabilities()
@@ -476,6 +710,13 @@ def SWAP(argv):
         for kind in ['sim', 'dud', 'test']:
             sample.collect_probabilities(kind)
 
+        # EM can bring retired subjects back, and retire others: the
+        # index kept for the next batch has to be built again.
+        if retired is not None:
+            skipped = retired.skipped
+            retired = swap.RetiredSubjects(sample)
+            retired.skipped = skipped
+
 
     # All good things come to an end:
     if count == 0:
@@ -497,8 +738,12 @@ def SWAP(argv):
     # classification timestamp!
     tonights.parameters['finish'] = t1.strftime('%Y-%m-%d_%H:%M:%S')
 
-    # Let's also update the start parameter, ready for next time:
+    # Let's also update the start parameter, ready for next time - and
+    # exactly where we got to in the database:
     tonights.parameters['start'] = tstring
+    if key is not None:
+        start_key = swap.key_string(key)
+    tonights.parameters['start_key'] = start_key
 
     # Use the following directory for output lists and plots:
     tonights.parameters['trunk'] = \
@@ -509,30 +754,29 @@ def SWAP(argv):
         os.makedirs(tonights.parameters['dir'])
 
     # ------------------------------------------------------------------
-    # Pickle the bureau, sample, and database, if required. If we do
-    # this, its because we want to pick up from where we left off
-    # (ie with SWAPSHOP) - so save the pickles in the $cwd. This is
-    # taken care of in io.py. Note that we update the parameters as
-    # we go - this will be useful later when we write update.config.
-
-    if tonights.parameters['repickle'] and count > 0:
-
-        new_bureaufile = swap.get_new_filename(tonights.parameters,'bureau')
-        print "SWAP: saving agents to "+new_bureaufile
-        swap.write_pickle(bureau,new_bureaufile)
-        tonights.parameters['bureaufile'] = new_bureaufile
+    # Pickle the bureau, sample, and database, if required, and write
+    # update.config, so that we (ie SWAPSHOP) can pick up from where we
+    # left off - unless SWAPSHOP.py is keeping them in memory, and has
+    # not asked for a checkpoint. See save_state(), below.
+
+    if offline and incremental and tonights.parameters['repickle']:
+        # The converged EM state, to warm-start the next batch's EM from:
+        offline_state = swap.em_state(bureau,sample,EM_settings)
+    else:
+        offline_state = None
 
-        new_samplefile = swap.get_new_filename(tonights.parameters,'collection')
-        print "SWAP: saving subjects to "+new_samplefile
-        swap.write_pickle(sample,new_samplefile)
-        tonights.parameters['samplefile'] = new_samplefile
+    if trajectory != 'full':
+        trajectory_store = None
 
-        if practise:
-            new_dbfile = swap.get_new_filename(tonights.parameters,'database')
-            print "SWAP: saving database to "+new_dbfile
-            swap.write_pickle(db,new_dbfile)
-            tonights.parameters['dbfile'] = new_dbfile
+    # (The batches since the last save in this process need saving, even
+    # if there was nothing new in this one.)
+    changed = (count > 0 or (carry_on and not resident['saved']))
 
+    if resident is None or resident.get('checkpoint',True):
+        save_state(tonights,bureau,sample,db,pickles=changed,offline_state=offline_state,trajectory_store=trajectory_store,checkpoints=checkpoints)
+        saved = True
+    else:
+        saved = False
 
     # ------------------------------------------------------------------
 
@@ -540,7 +784,8 @@ def SWAP(argv):
 
         # Output list of subjects to retire, based on this batch of
         # classifications. Note that what is needed here is the ZooID,
-        # not the subject ID:
+        # not the subject ID. (This is all of them: just the ones
+        # retired since the last save are in the retirement feed.)
 
         new_retirementfile = swap.get_new_filename(tonights.parameters,'retire_these')
         print "SWAP: saving retiree subject Zooniverse IDs..."
@@ -592,6 +837,16 @@ def SWAP(argv):
         print "SWAP: "+str(Nduds)+" dud 'candidates' (with P > rejection) written to "+catalog
 
 
+    # ------------------------------------------------------------------
+    # Record how the offline EM converged:
+
+    if offline:
+
+        tracefile = swap.get_new_filename(tonights.parameters,'EM_trace')
+        print "SWAP: saving EM convergence trace..."
+        N = swap.write_em_trace(EM_trace,tracefile)
+        print "SWAP: "+str(N)+" lines written to "+tracefile
+
     # ------------------------------------------------------------------
     # Now, if there is more to do, over-write the update.config file so
     # that we can carry on where we left off. Note that the pars are
@@ -602,17 +857,6 @@ def SWAP(argv):
         swap.set_cookie(False)
     # SWAPSHOP will read this cookie and act accordingly.
 
-    configfile = 'update.config'
-
-    # Random_file needs updating, else we always start from the same random
-    # state when update.config is reread!
-    random_file = open(tonights.parameters['random_file'],"w");
-    random_state = np.random.get_state();
-    cPickle.dump(random_state,random_file);
-    random_file.close();
-
-    swap.write_config(configfile, tonights.parameters)
-
 
     # ------------------------------------------------------------------
 
@@ -699,10 +943,111 @@ def SWAP(argv):
         swap.write_report(tonights.parameters,bureau,sample)
 
     # ------------------------------------------------------------------
+    # Leave everything in memory for the next batch:
+
+    if resident is not None:
+        resident.update({'tonights':tonights, 'bureau':bureau, 'sample':sample,
+                         'db':db, 'log':log, 'retired':retired,
+                         'count':count, 'more_to_do':more_to_do, 'saved':saved,
+                         'offline_state':offline_state, 'trajectory_store':trajectory_store,
+                         'checkpoints':checkpoints})
 
     print swap.doubledashedline
     return
 
+# ======================================================================
+# Write out the subjects retired since the last save, and then save
+# everything needed to pick up from where we left off: the bureau,
+# sample, offline EM state and Toy database, as pickles (if repickle is
+# set, and there is anything new in them), the subject cache, the random
+# state, and update.config. Note that we update the parameters as we go
+# - update.config has to point at the new pickles.
+#
+# The pickles go in the $cwd, each written to a temporary file and then
+# renamed - or, if there is a checkpoints directory, they go in a new
+# checkpoint, along with the random state and a copy of update.config,
+# which only becomes the one to carry on from once it is all written
+# (see swap.Checkpoints).
+
+def save_state(tonights,bureau,sample,db,pickles=True,offline_state=None,trajectory_store=None,checkpoints=None):
+
+    pars = tonights.parameters
+
+    if checkpoints is None:
+        checkpoint = None
+        write_to = saved_as = lambda filename: filename
+    else:
+        checkpoint = swap.Checkpoints(checkpoints)
+        checkpoint.begin()
+        write_to,saved_as = checkpoint.path,checkpoint.final_path
+        # Files from the last checkpoint are in this one too:
+        for key in swap.checkpoint_files:
+            if checkpoint.carried(pars.get(key)):
+                pars[key] = saved_as(pars[key])
+
+    # Just the subjects retired since the last save, for SWITCH (the
+    # log of them is cleared before the sample is saved):
+    new_feedfile = swap.get_new_filename(pars,'retirement_feed')
+    changes = swap.write_retirement_feed(sample,new_feedfile)
+    print "SWAP: "+str(len(changes['retired']))+" subjects retired (and "+str(len(changes['detected']))+" detected) since the last save: ZooIDs written to "+new_feedfile
+    pars['retirement_feed'] = new_feedfile
+
+    if pars['repickle'] and pickles:
+
+        new_bureaufile = swap.get_new_filename(pars,'bureau')
+        print "SWAP: saving agents to "+saved_as(new_bureaufile)
+        swap.write_pickle(bureau,write_to(new_bureaufile))
+        pars['bureaufile'] = saved_as(new_bureaufile)
+
+        # Move the subjects' new probability ensembles out into their
+        # store first, so that the sample only keeps their summaries.
+        # The store only uses what the saved sample says has been moved
+        # out of it, so if we die before the sample is saved, the next
+        # run just flushes the same ensembles again:
+        if trajectory_store is not None:
+            store = swap.TrajectoryStore(trajectory_store)
+            Nflushed = store.flush(sample)
+            print "SWAP: moved the trajectories of",Nflushed,"subjects to the",store
+
+        new_samplefile = swap.get_new_filename(pars,'collection')
+        print "SWAP: saving subjects to "+saved_as(new_samplefile)
+        swap.write_pickle(sample,write_to(new_samplefile))
+        pars['samplefile'] = saved_as(new_samplefile)
+
+        if offline_state is not None:
+            new_offlinefile = swap.get_new_filename(pars,'offline')
+            print "SWAP: saving offline EM state to "+saved_as(new_offlinefile)
+            swap.write_pickle(offline_state,write_to(new_offlinefile))
+            pars['offlinefile'] = saved_as(new_offlinefile)
+
+        if isinstance(db,swap.ToyDB):
+            new_dbfile = swap.get_new_filename(pars,'database')
+            print "SWAP: saving database to "+saved_as(new_dbfile)
+            swap.write_pickle(db,write_to(new_dbfile))
+            pars['dbfile'] = saved_as(new_dbfile)
+
+    if isinstance(db,swap.MongoDB):
+        db.save_subject_cache()
+
+    # Random_file needs updating, else we always start from the same random
+    # state when update.config is reread!
+    new_random_file = pars['random_file']
+    random_file = open(write_to(new_random_file)+'.tmp',"w");
+    random_state = np.random.get_state();
+    cPickle.dump(random_state,random_file);
+    random_file.close();
+    os.rename(write_to(new_random_file)+'.tmp',write_to(new_random_file))
+    pars['random_file'] = saved_as(new_random_file)
+
+    if checkpoint is not None:
+        swap.write_config(write_to('update.config'), pars)
+        checkpoint.commit(dict([(key,pars.get(key)) for key in swap.checkpoint_parameters]))
+        print "SWAP: saved",checkpoint
+
+    swap.write_config('update.config', pars)
+
+    return
+
 # ======================================================================
 
 if __name__ == '__main__':
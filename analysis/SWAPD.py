@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# ======================================================================
+
+import swap
+
+import sys,getopt,os,time,signal,datetime
+import numpy as np
+
+from SWAP import SWAP, save_state
+from SWAPSHOP import start_afresh, postpone_reports
+
+# ======================================================================
+
+def SWAPD(argv):
+    """
+    NAME
+        SWAPD.py
+
+    PURPOSE
+        Run SWAP as a daemon: tail the database for new classifications,
+        apply them within seconds of their being made, and publish
+        newly retired and newly detected subjects as they happen.
+
+    COMMENTS
+        SWAP's online analysis could always have been done in real
+        time, but it has only ever been run in batches (by SWAPSHOP),
+        so that subjects were only retired, and candidates only listed,
+        when a batch was done. SWAPD.py keeps the bureau, collection
+        and database in memory, as SWAPSHOP.py does, and every few
+        seconds runs SWAP on whatever classifications have come in
+        since the last pass, carrying on from exactly where that pass
+        got to (see swap.Record). A pass that stops at N_per_batch is
+        followed by the next one straight away.
+
+        After each pass, the subjects that were classified in it are
+        checked, and the test subjects that have just been retired
+        (gone inactive) or detected (status now 'detected') are
+        appended to the feeds, one line each, which are flushed at
+        once:
+
+          SURVEY_retirement_feed.txt     ZooID  ID  P  published
+          SURVEY_detection_feed.txt      ZooID  ID  P  published
+
+        The ZooID comes first, so that SWITCH.py can read the
+        retirement feed as it is.
+
+        The latency of a classification is the time from its
+        updated_at to when the pass it was in has published its
+        subjects. The percentiles are reported every so often, for the
+        classifications since the last report, and for all of them when
+        the daemon stops.
+
+        The state is saved every so often (in a checkpoint, if
+        checkpoints is set in the config file), and when the daemon is
+        stopped, with SIGTERM or SIGINT (^C) - the pass that is running
+        is finished first. SWAP's own output goes to the log file, and
+        the daemon's to stdout. Reports and plots are switched off: run
+        SWAP.py on update.config for those.
+
+        To try it out, set dbspecies to 'Toy' and toy_rate in the config
+        file, and the Toy database will make its classifications as
+        time goes on (see swap.ToyStream). The daemon stops when they
+        have all been made, and analysed.
+
+    FLAGS
+        -h --help          Print this message
+        -f --startup       Start afresh. Def = continue from update.config
+        -s --survey name   Survey name (used in prefix of everything)
+        -c --config file   Start afresh from this config file
+        -2 --stage2        Run in Stage 2 mode
+        -p --poll S        Seconds between polls (def = 5)
+        -k --checkpoint S  Save the state every S seconds (def = 600)
+        -r --report S      Report latencies every S seconds (def = 60)
+        -l --log file      SWAP's output (def = SURVEY_SWAPD.log)
+        -t --test N        Stop after N passes
+        --seed N           Random number seed, for a fresh start (def = 7623)
+
+    INPUTS
+        update.config, or swap/startup.config (or the --config file) if
+        starting afresh.
+
+    OUTPUTS
+        stdout
+        SURVEY_retirement_feed.txt
+        SURVEY_detection_feed.txt
+        SURVEY_SWAPD.log
+        As SWAP.py, whenever the state is saved.
+
+    EXAMPLE
+
+        cd workspace
+        SWAPD.py -f -p 2 > CFHTLS-daemon.log &
+
+    BUGS
+        - Subjects are published at least once: those retired or
+          detected since the last save are published again after a
+          crash, when their classifications are done again.
+        - The latencies are only as good as the agreement between this
+          machine's clock and the database's.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+    # ------------------------------------------------------------------
+
+    try:
+       opts, args = getopt.getopt(argv,"hfs:c:2p:k:r:l:t:",["help","startup","survey=","config=","stage2","poll=","checkpoint=","report=","log=","test=","seed="])
+    except getopt.GetoptError, err:
+       print str(err) # will print something like "option -a not recognized"
+       print SWAPD.__doc__  # will print the big comment above.
+       return
+
+    survey = 'CFHTLS'
+    startup = False
+    configfile = None
+    stage = 1
+    poll = 5.0
+    K = 600.0
+    R = 60.0
+    logfile = None
+    N = None
+    seed = 7623
+
+    for o,a in opts:
+       if o in ("-h", "--help"):
+          print SWAPD.__doc__
+          return
+       elif o in ("-f", "--startup"):
+          startup = True
+       elif o in ("-s", "--survey"):
+          survey = a
+       elif o in ("-c", "--config"):
+          configfile = a
+          startup = True
+       elif o in ("-2", "--stage2"):
+          stage = 2
+       elif o in ("-p", "--poll"):
+          poll = float(a)
+       elif o in ("-k", "--checkpoint"):
+          K = float(a)
+       elif o in ("-r", "--report"):
+          R = float(a)
+       elif o in ("-l", "--log"):
+          logfile = a
+       elif o in ("-t", "--test"):
+          N = int(a)
+       elif o == "--seed":
+          seed = int(a)
+       else:
+          assert False, "unhandled option"
+
+    print swap.doubledashedline
+    print "SWAPD: Space Warps Analysis Daemon"
+    print swap.doubledashedline
+
+    if startup:
+        configfile = start_afresh(survey,stage,seed,configfile=configfile)
+    else:
+        configfile = 'update.config'
+        if not os.path.exists(configfile):
+            print "SWAPD: ERROR: no update.config file to start from."
+            return
+        print "SWAPD: continuing using configuration stored in "+configfile
+
+    # No reports or plots: they would take longer than the passes.
+    postpone_reports(configfile)
+
+    if logfile is None:
+        logfile = survey+'_SWAPD.log'
+    log = open(logfile,'a')
+    print "SWAPD: SWAP's output is going to "+logfile
+
+    feeds = {'retired': open(survey+'_retirement_feed.txt','a'),
+             'detected': open(survey+'_detection_feed.txt','a')}
+    for feed in feeds.values():
+        print "SWAPD: publishing to "+feed.name
+
+    # Stop cleanly, after the pass that is running, when asked to:
+    stop = []
+    def stopping(signum,frame):
+        stop.append(signum)
+    signal.signal(signal.SIGTERM,stopping)
+    signal.signal(signal.SIGINT,stopping)
+
+    # ------------------------------------------------------------------
+    # Tail the database:
+
+    resident = {}
+    latencies,recent = [],[]
+    published = {'retired': 0, 'detected': 0}
+    k = 0
+    last_saved = last_report = time.time()
+    stdout = sys.stdout
+
+    while len(stop) == 0 and k != N:
+
+        resident['tail'] = []
+        resident['checkpoint'] = (time.time() - last_saved >= K)
+
+        sys.stdout = log
+        try:
+            SWAP([configfile],resident=resident)
+        finally:
+            sys.stdout = stdout
+            log.flush()
+        if 'tonights' not in resident:
+            print "SWAPD: ERROR: SWAP failed, see "+logfile
+            break
+        k += 1
+        if resident['saved']:
+            last_saved = time.time()
+            print "SWAPD: state saved after pass",k
+
+        # Publish, and see how long it took:
+        news = publish(resident['sample'],resident['tail'],feeds)
+        now = datetime.datetime.utcnow()
+        for ID,key,state,status in resident['tail']:
+            if key is not None:
+                recent.append((now - key[0]).total_seconds())
+        for which in news:
+            published[which] += news[which]
+
+        pars = resident['tonights'].parameters
+        if resident['count'] > 0:
+            print "SWAPD: pass",k,"analysed",resident['count'],"classifications, up to "+pars['start']+": retired",news['retired'],"and detected",news['detected'],"subjects"
+        # (Nothing is written in the pass's output directory unless the
+        # state was saved.)
+        try: os.rmdir(pars['dir'])
+        except OSError: pass
+
+        if time.time() - last_report >= R and len(recent) > 0:
+            print "SWAPD: latency of the last",len(recent),"classifications: "+percentiles(recent)
+            latencies += recent
+            recent = []
+            last_report = time.time()
+
+        # A Toy stream stops when it has run dry:
+        db = resident['db']
+        if isinstance(db,swap.ToyStream) and db.backlog() == 0 and resident['count'] == 0:
+            print "SWAPD: the",db,"has run dry"
+            break
+
+        # Carry straight on if we only did part of what was there, or
+        # wait for more:
+        if not resident['more_to_do']:
+            wake = time.time() + poll
+            while len(stop) == 0 and time.time() < wake:
+                time.sleep(min(0.1,poll))
+
+    if len(stop) > 0:
+        print "SWAPD: stopping, on signal",stop[0]
+
+    # Save whatever has not been saved yet:
+    if 'tonights' in resident and not resident['saved']:
+        print "SWAPD: saving the state after pass",k
+        sys.stdout = log
+        try:
+            save_state(resident['tonights'],resident['bureau'],resident['sample'],resident['db'],offline_state=resident['offline_state'],trajectory_store=resident['trajectory_store'],checkpoints=resident['checkpoints'])
+        finally:
+            sys.stdout = stdout
+
+    for feed in feeds.values():
+        feed.close()
+    log.close()
+
+    latencies += recent
+    print "SWAPD: published",published['retired'],"retirements and",published['detected'],"detections in",k,"passes"
+    if len(latencies) > 0:
+        print "SWAPD: latency of all",len(latencies),"classifications: "+percentiles(latencies)
+    print "SWAPD: all done."
+    print swap.doubledashedline
+
+    return
+
+# ======================================================================
+# Publish the test subjects that were retired or detected in the last
+# pass, given its tail - the subjects classified in it, with their
+# state and status before each classification - and return how many of
+# each there were:
+
+def publish(sample,tail,feeds):
+
+    before = {}
+    for ID,key,state,status in tail:
+        if ID not in before:
+            before[ID] = (state,status)
+
+    news = {'retired': 0, 'detected': 0}
+    now = datetime.datetime.utcnow().strftime('%Y-%m-%d_%H:%M:%S')
+    for ID,(state,status) in before.items():
+        subject = sample.member[ID]
+        if subject.kind != 'test':
+            continue
+        for which,new in [('retired', subject.state == 'inactive' and state != 'inactive'),
+                          ('detected', subject.status == 'detected' and status != 'detected')]:
+            if new:
+                feeds[which].write('%s %s %.6g %s\n' % (subject.ZooID,ID,subject.mean_probability,now))
+                news[which] += 1
+
+    for feed in feeds.values():
+        feed.flush()
+
+    return news
+
+# ----------------------------------------------------------------------
+# The usual percentiles of a list of latencies, in seconds:
+
+def percentiles(latencies):
+
+    p50,p90,p99 = np.percentile(latencies,[50,90,99])
+
+    return '50%% %.2fs, 90%% %.2fs, 99%% %.2fs, max %.2fs' % (p50,p90,p99,np.max(latencies))
+
+# ======================================================================
+
+if __name__ == '__main__':
+    SWAPD(sys.argv[1:])
+
+# ======================================================================
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+# ======================================================================
+
+import swap
+
+import sys,getopt,os,glob,cPickle
+import numpy as np
+
+from SWAP import SWAP, save_state
+
+# ======================================================================
+
+def SWAPSHOP(argv):
+    """
+    NAME
+        SWAPSHOP.py
+
+    PURPOSE
+        Run SWAP on a database, batch after batch, until all
+        classifications are in - and then collate the retirement list
+        and report, like SWAPSHOP.csh, but in one process.
+
+    COMMENTS
+        SWAPSHOP.csh runs SWAP.py as a new process for each batch of
+        N_per_batch classifications, so that every batch has to read in
+        the bureau and collection pickles, connect to the database, and
+        then pickle everything again, and write update.config, for the
+        next batch to read back in. SWAPSHOP.py keeps the bureau,
+        collection and database (and the event log) in memory, and
+        hands them from one batch to the next: the state is only saved
+        (pickles, random state and update.config, as SWAP.py would save
+        them) every K batches, and when we stop - so after a crash, we
+        carry on from the last checkpoint, with SWAPSHOP.py or
+        SWAPSHOP.csh.
+
+        Everything else is as SWAPSHOP.csh does it: each batch still
+        gets its own output directory, with a copy of the config it was
+        run with, SWAP still writes .swap.cookie, and we carry on for as
+        long as it says 'running'.
+
+        The retirement list is collated from the retirement feeds that
+        SWAP writes whenever the state is saved - just the subjects
+        retired since the last save (see swap.Transitions) - rather than
+        from the whole list of retired subjects in the last report.
+
+        For animations and image downloads, run SWAPSHOP.csh
+        --no-analysis afterwards.
+
+    FLAGS
+        -h --help          Print this message
+        -f --startup       Start afresh. Def = continue from update.config
+        -s --survey name   Survey name (used in prefix of everything)
+        -t --test N        Only run N batches
+        -k --checkpoint K  Save the state every K batches (def = 10), as
+                             well as when we stop
+        -2 --stage2        Run in Stage 2 mode (NB. no retirement)
+        -c --config file   Start afresh from this config file
+        --fast             Only report at the end
+        --seed N           Random number seed, for a fresh start (def = 7623)
+
+    INPUTS
+        update.config, or swap/startup.config (or the --config file) if
+        starting afresh.
+
+    OUTPUTS
+        stdout
+        As SWAP.py, for every batch, in SURVEY_<first classification
+        time> directories, and then:
+        SURVEY_<here>_retire_these.txt        Subjects newly retired
+        SURVEY_<here>_previously_retired.txt  Subjects retired before
+        SURVEY_<here>_report.pdf              The final report
+
+    EXAMPLE
+
+        cd workspace
+        SWAPSHOP.py -f -k 20 > CFHTLS-beta.log
+
+    BUGS
+        - The state is only as safe as the last checkpoint: the batches
+          since then have to be run again after a crash. (Nothing is
+          saved if SWAP fails part way through a batch.) Set
+          checkpoints in the config file to make each save all or
+          nothing - see swap/checkpoint.py.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+    # ------------------------------------------------------------------
+
+    try:
+       opts, args = getopt.getopt(argv,"hfs:t:k:2c:",["help","startup","survey=","test=","checkpoint=","stage2","config=","fast","seed="])
+    except getopt.GetoptError, err:
+       print str(err) # will print something like "option -a not recognized"
+       print SWAPSHOP.__doc__  # will print the big comment above.
+       return
+
+    survey = 'CFHTLS'
+    N = None
+    K = 10
+    startup = False
+    stage = 1
+    configfile = None
+    fast = False
+    seed = 7623
+
+    for o,a in opts:
+       if o in ("-h", "--help"):
+          print SWAPSHOP.__doc__
+          return
+       elif o in ("-f", "--startup"):
+          startup = True
+       elif o in ("-s", "--survey"):
+          survey = a
+       elif o in ("-t", "--test"):
+          N = int(a)
+       elif o in ("-k", "--checkpoint"):
+          K = max(int(a),1)
+       elif o in ("-2", "--stage2"):
+          stage = 2
+       elif o in ("-c", "--config"):
+          configfile = a
+          startup = True
+       elif o == "--fast":
+          fast = True
+       elif o == "--seed":
+          seed = int(a)
+       else:
+          assert False, "unhandled option"
+
+    print swap.doubledashedline
+    print "SWAPSHOP: Space Warps Analysis Blitz"
+    print swap.doubledashedline
+
+    print "SWAPSHOP: running SWAP over and over again until all"
+    print "SWAPSHOP: classifications in survey '"+survey+"' are analysed"
+
+    # ------------------------------------------------------------------
+    # First write a startup.config file based on the standard one in
+    # swap, and a random state from the seed - or carry on from
+    # update.config:
+
+    if startup:
+        configfile = start_afresh(survey,stage,seed,configfile=configfile)
+
+    else:
+        configfile = 'update.config'
+        if not os.path.exists(configfile):
+            print "SWAPSHOP: ERROR: no update.config file to start from."
+            return
+        print "SWAPSHOP: continuing using configuration stored in "+configfile
+
+    # Save time by only reporting at the end:
+    if fast:
+        postpone_reports(configfile)
+
+    # ------------------------------------------------------------------
+    # Where did we get to? The usual state of the directory is that
+    # the retirees file shows what was just retired, while the
+    # previous retirees file is the total retired so far, not
+    # including the latest batch: so, concatenate them first.
+
+    here = os.path.basename(os.getcwd())
+    retirees = survey+'_'+here+'_retire_these.txt'
+    previousretirees = survey+'_'+here+'_previously_retired.txt'
+
+    retired = read_retirees(previousretirees)
+    if os.path.exists(retirees):
+        retired |= read_retirees(retirees)
+    write_retirees(retired,previousretirees)
+
+    print "SWAPSHOP: so far we have retired",len(retired),"subjects. Let's do some more!"
+
+    # ------------------------------------------------------------------
+    # Get going on the new db, keeping everything in memory from one
+    # batch to the next:
+
+    resident = {}
+    more_to_do = True
+    k = 0
+
+    # Each time the state is saved, SWAP writes out the subjects retired
+    # since the last time: collect them as we go.
+    new = set()
+    def collect(resident):
+        if resident['saved']:
+            new.update(read_retirees(resident['tonights'].parameters['retirement_feed']))
+
+    while more_to_do:
+
+        # Stop early if we are just testing:
+        if k == N:
+            swap.set_cookie(False)
+            break
+
+        print "SWAPSHOP: starting batch number",k+1
+
+        resident['checkpoint'] = ((k+1) % K == 0)
+        SWAP([configfile],resident=resident)
+        if 'tonights' not in resident:
+            break
+
+        # Keep a record of the config we used in this batch, with its
+        # actual start time, in its output directory:
+        pars = resident['tonights'].parameters
+        record_config(pars,pars['dir']+'/update.config')
+        if resident['saved']:
+            print "SWAPSHOP: checkpoint saved after batch number",k+1
+        collect(resident)
+
+        k += 1
+
+        # See if we should keep going:
+        F = open('.swap.cookie','r')
+        more_to_do = ('running' in F.read())
+        F.close()
+
+    # Save whatever has not been saved yet:
+    if 'tonights' in resident and not resident['saved']:
+        print "SWAPSHOP: saving the state after batch number",k
+        save_state(resident['tonights'],resident['bureau'],resident['sample'],resident['db'],offline_state=resident['offline_state'],trajectory_store=resident['trajectory_store'],checkpoints=resident['checkpoints'])
+        resident['saved'] = True
+        collect(resident)
+
+    # OK, run SWAP one more time (on nothing new), and write the report:
+    if fast and 'tonights' in resident:
+        resident['tonights'].parameters['report'] = True
+        resident['checkpoint'] = True
+        print "SWAPSHOP: starting plotting run"
+        SWAP([configfile],resident=resident)
+        collect(resident)
+
+    # ------------------------------------------------------------------
+    # Collate outputs. 1) Retirement plan: the subjects retired in this
+    # run, less any that were retired before, go to SWITCH. Once a
+    # subject is retired, it stays retired.
+
+    latest = latest_batch(survey)
+    if latest is None:
+        print "SWAPSHOP: no batches were run."
+        return
+
+    already = len(new & retired)
+    new -= retired
+    write_retirees(new,retirees)
+
+    print "SWAPSHOP: previous run brought total retirements to",len(retired)
+    print "SWAPSHOP: current run has suggested another",len(new)
+    print "SWAPSHOP:",already,"subjects were already retired and can be ignored"
+    if len(new) > 0:
+        print "SWAPSHOP: if you want, you can go ahead and retire",len(new),"subjects with"
+        print " "
+        print "          SWITCH.py "+retirees+" > retirement.log &"
+        print " "
+    else:
+        print "SWAPSHOP: no subjects to retire"
+
+    # 2) Final report:
+
+    for filename in glob.glob(latest+'/*report.pdf'):
+        report = survey+'_'+here+'_report.pdf'
+        F = open(filename,'rb')
+        G = open(report,'wb')
+        G.write(F.read())
+        G.close()
+        F.close()
+        print "SWAPSHOP: final report: "+report
+
+    print "SWAPSHOP: all done."
+    print swap.doubledashedline
+
+    return
+
+# ======================================================================
+# Start afresh: write a startup.config file based on the standard one in
+# swap (unless we are given one), and a random state from the seed.
+# Returns the config file name:
+
+def start_afresh(survey,stage,seed,configfile=None):
+
+    if configfile is None:
+        configfile = 'startup.config'
+        F = open(os.path.join(os.path.dirname(swap.__file__),'startup.config'),'r')
+        config = F.read().replace('SURVEY',survey).replace('STAGE',str(stage))
+        F.close()
+        F = open(configfile,'w')
+        F.write(config)
+        F.close()
+    print "SWAPSHOP: start-up configuration stored in "+configfile
+
+    random_file = swap.Configuration(configfile).parameters['random_file']
+    np.random.seed(seed)
+    F = open(random_file,'w')
+    cPickle.dump(np.random.get_state(),F)
+    F.close()
+    print "SWAPSHOP: random seed state stored in "+random_file
+
+    return configfile
+
+# ----------------------------------------------------------------------
+# Switch off the report in a config file:
+
+def postpone_reports(configfile):
+
+    F = open(configfile,'r')
+    config = F.read().replace('report: True','report: False')
+    F.close()
+    F = open(configfile,'w')
+    F.write(config)
+    F.close()
+
+    return
+
+# ----------------------------------------------------------------------
+# Write out the config a batch was run with: the parameters as they are
+# now, but with the start time that batch was given (which SWAP used
+# to name its output directory).
+
+def record_config(pars,filename):
+
+    pars = pars.copy()
+    pars['start'] = pars['finish']
+    swap.write_config(filename,pars)
+
+    return
+
+# ----------------------------------------------------------------------
+# The latest batch's output directory:
+
+def latest_batch(survey):
+
+    batches = glob.glob(survey+'_????-??-??_??:??:??')
+    if len(batches) == 0:
+        return None
+
+    return max(batches,key=os.path.getmtime)
+
+# ----------------------------------------------------------------------
+# Read and write lists of retired subjects' ZooIDs, one per line:
+
+def read_retirees(filename):
+
+    retired = set()
+    if os.path.exists(filename):
+        F = open(filename,'r')
+        for line in F:
+            words = line.split()
+            if len(words) > 0 and 'ASW' in words[0]:
+                retired.add(words[0])
+        F.close()
+
+    return retired
+
+def write_retirees(retired,filename):
+
+    F = open(filename,'w')
+    for ZooID in sorted(retired):
+        F.write(ZooID+'\n')
+    F.close()
+
+    return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    SWAPSHOP(sys.argv[1:])
+
+# ======================================================================
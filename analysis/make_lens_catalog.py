@@ -486,7 +486,7 @@ def convert_swap_collection_to_dataframe(collection, stage,
             if category == 'stage':
                 catalog_i.append(stage)
             else:
-                catalog_i.append(subject.__dict__[category])
+                catalog_i.append(getattr(subject,category))
         for category in annotation_categories:
             catalog_i.append(list(annotationhistory[category]))
 
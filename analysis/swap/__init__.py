@@ -1,10 +1,22 @@
 from logging import *
 from config import *
 from io import *
+from history import *
+from trajectories import *
 from bureau import *
 from agent import *
 from collection import *
 from subject import *
+from record import *
+from streams import *
 from toydb import *
 from mongodb import *
+from eventlog import *
+from pipeline import *
+from retired import *
 from shannon import *
+from batch import *
+from sharded import *
+from offline import *
+from snapshot import *
+from checkpoint import *
@@ -5,8 +5,17 @@ import swap
 import numpy as np
 import pylab as plt
 
+from history import History
+
 actually_it_was_dictionary = {'LENS': 1, 'NOT': 0, 'UNKNOWN': -1}
 
+# The fields of each agent's training and test histories:
+traininghistory_fields = [('ID',object), ('Skill',float), ('PL',float),
+                          ('PD',float), ('ItWas',int), ('ActuallyItWas',int),
+                          ('At_Time',object)]
+testhistory_fields = [('ID',object), ('I',float), ('Skill',float),
+                      ('ItWas',int), ('At_Time',object)]
+
 # ======================================================================
 
 class Agent(object):
@@ -103,21 +112,23 @@ class Agent(object):
         self.NT = 0
         # back-compatibility:
         self.contribution = 0.0*self.update_skill() # This call also sets self.skill, internally
-        self.traininghistory = {'ID':np.array([]),
-                                'Skill':np.array([self.skill]),
-                                'PL':np.array([self.PL]),
-                                'PD':np.array([self.PD]),
-                                'ItWas':np.array([], dtype=int),
-                                'ActuallyItWas':np.array([], dtype=int),
-                                'At_Time': np.array([])}
-        self.testhistory = {'ID':[],
-                            'I':np.array([]),
-                            'Skill':np.array([]),
-                            'ItWas':np.array([], dtype=int),
-                            'At_Time': np.array([])}
+        self.traininghistory = History(traininghistory_fields,
+                                       values={'Skill':[self.skill],
+                                               'PL':[self.PL],
+                                               'PD':[self.PD]})
+        self.testhistory = History(testhistory_fields)
 
         return None
 
+# ----------------------------------------------------------------------
+# Agents in old pickles have dictionaries for histories:
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.traininghistory = History.migrate(self.traininghistory,traininghistory_fields)
+        self.testhistory = History.migrate(self.testhistory,testhistory_fields)
+        return
+
 # ----------------------------------------------------------------------
 
     def __str__(self):
@@ -208,17 +219,16 @@ class Agent(object):
                 raise Exception("Apparently, the subject was actually a "+str(actually_it_was))
 
             if record:
-                # Always log on what are we trained, even if not learning:
-                self.traininghistory['ID'] = np.append(self.traininghistory['ID'],ID)
-                # Always log progress, even if not learning:
-                self.traininghistory['Skill'] = np.append(self.traininghistory['Skill'],self.update_skill())
-                # NB. self.skill is now up to date.
-                self.traininghistory['PL'] = np.append(self.traininghistory['PL'],self.PL)
-                self.traininghistory['PD'] = np.append(self.traininghistory['PD'],self.PD)
-
-                self.traininghistory['ItWas'] = np.append(self.traininghistory['ItWas'], actually_it_was_dictionary[it_was])
-                self.traininghistory['ActuallyItWas'] = np.append(self.traininghistory['ActuallyItWas'], actually_it_was_dictionary[actually_it_was])
-                self.traininghistory['At_Time'] = np.append(self.traininghistory['At_Time'], at_time)
+                # Always log on what are we trained, even if not learning,
+                # and always log progress (NB. this brings self.skill up
+                # to date):
+                self.traininghistory.append(ID=ID,
+                                            Skill=self.update_skill(),
+                                            PL=self.PL,
+                                            PD=self.PD,
+                                            ItWas=actually_it_was_dictionary[it_was],
+                                            ActuallyItWas=actually_it_was_dictionary[actually_it_was],
+                                            At_Time=at_time)
 
         return
 
@@ -254,31 +264,123 @@ class Agent(object):
         return
 
 # ----------------------------------------------------------------------
-# Get a realization for agent's PL distribution
+# Get a realization for agent's PL distribution, from the global np.random
+# stream or the given (keyed) one:
 
-    def get_PL_realization(self,Ntrajectory):
+    def get_PL_realization(self,Ntrajectory,stream=None):
+        if stream is None: stream = np.random
         NL_correct=self.PL*self.NL;
-        NL_correct_realize=np.random.binomial(self.NL,self.PL,size=Ntrajectory);
+        NL_correct_realize=stream.binomial(self.NL,self.PL,size=Ntrajectory);
         PL_realize=(NL_correct_realize*1.0)/(self.NL);
-        idx=np.where(PL_realize>swap.PLmax);
-        PL_realize[idx]=swap.PLmax;
-        idx=np.where(PL_realize<swap.PLmin);
-        PL_realize[idx]=swap.PLmin;
+        PL_realize=np.maximum(np.minimum(PL_realize,swap.PLmax),swap.PLmin);
         #print NL_correct,NL_correct_realize,PL_realize
         return PL_realize;
 
 # ----------------------------------------------------------------------
-# Get a realization for agent's PD distribution
+# Get a realization for agent's PD distribution, from the global np.random
+# stream or the given (keyed) one:
 
-    def get_PD_realization(self,Ntrajectory):
+    def get_PD_realization(self,Ntrajectory,stream=None):
+        if stream is None: stream = np.random
         ND_correct=self.PD*self.ND;
-        ND_correct_realize=np.random.binomial(self.ND,self.PD,size=Ntrajectory);
+        ND_correct_realize=stream.binomial(self.ND,self.PD,size=Ntrajectory);
         PD_realize=(ND_correct_realize*1.0)/(self.ND);
-        idx=np.where(PD_realize>swap.PDmax);
-        PD_realize[idx]=swap.PDmax;
-        idx=np.where(PD_realize<swap.PDmin);
-        PD_realize[idx]=swap.PDmin;
+        PD_realize=np.maximum(np.minimum(PD_realize,swap.PDmax),swap.PDmin);
         #print  ND_correct,ND_correct_realize,PD_realize
         return PD_realize;
 
 # ======================================================================
+
+# Kinds of agent, in the order they are coded in an ArrayBureau:
+agent_kinds = ['normal', 'super', 'banned']
+
+# ----------------------------------------------------------------------
+# Make a property that reads and writes one element of a bureau column:
+
+def bureau_column(key):
+
+    def get(self):
+        return self.bureau.columns[key][self.index]
+
+    def set(self,value):
+        self.bureau.columns[key][self.index] = value
+
+    return property(get,set)
+
+# ======================================================================
+
+class AgentView(Agent):
+    """
+    NAME
+        AgentView
+
+    PURPOSE
+        An Agent whose state is stored in the columns of an ArrayBureau.
+
+    COMMENTS
+        An AgentView behaves just like an Agent - it can hear, plot its
+        history and so on - but its confusion matrix, experience, skill
+        and kind live in row `index` of its bureau's column arrays, and
+        its training and test histories are kept in the bureau's lists.
+        Views are made on the fly by ArrayBureau.member[Name], so they
+        are cheap to make and never need to be pickled.
+
+    INITIALISATION
+        bureau, index
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,bureau,index):
+        self.bureau = bureau
+        self.index = index
+        return None
+
+    PL = bureau_column('PL')
+    PD = bureau_column('PD')
+    NL = bureau_column('NL')
+    ND = bureau_column('ND')
+    N = bureau_column('N')
+    NT = bureau_column('NT')
+    skill = bureau_column('skill')
+    contribution = bureau_column('contribution')
+
+    @property
+    def name(self):
+        return self.bureau.names[self.index]
+
+    @property
+    def kind(self):
+        return agent_kinds[self.bureau.columns['kind'][self.index]]
+
+    @kind.setter
+    def kind(self,value):
+        self.bureau.columns['kind'][self.index] = agent_kinds.index(value)
+
+    @property
+    def traininghistory(self):
+        return self.bureau.traininghistories[self.index]
+
+    @traininghistory.setter
+    def traininghistory(self,value):
+        self.bureau.traininghistories[self.index] = value
+
+    @property
+    def testhistory(self):
+        return self.bureau.testhistories[self.index]
+
+    @testhistory.setter
+    def testhistory(self,value):
+        self.bureau.testhistories[self.index] = value
+
+# ======================================================================
@@ -0,0 +1,563 @@
+# ======================================================================
+
+import swap
+
+import numpy as np
+from subject import Ntrajectory
+from record import category_codes
+
+# ======================================================================
+
+"""
+    NAME
+        batch
+
+    PURPOSE
+        Apply a whole chunk of classifications to a bureau of agents and
+        a collection of subjects at once, using numpy array operations
+        instead of one Subject.was_described() and one Agent.heard()
+        call per classification.
+
+    COMMENTS
+        The online analysis is order dependent: each classification
+        updates its subject using the agent's confusion matrix *before*
+        the agent hears about it, and (when learning from test subjects)
+        each agent update uses the subject's probability *after* it has
+        been updated. Two classifications only interact if they share an
+        agent or a subject though. So, we schedule the chunk into
+        "levels", such that no agent or subject appears twice in any one
+        level, and every classification sits in a later level than the
+        previous classification made by its agent, and the previous
+        classification of its subject. Each level is then one vectorised
+        update, and the posteriors come out the same as if we had
+        stepped through the chunk one classification at a time.
+
+        With realize_confusion=True, the binomial realizations of the
+        agents' confusion matrices are drawn from the global np.random
+        stream one level at a time, in a single call (see realize()),
+        rather than two calls per classification. Within a level, the
+        draws come out in the same order, and so with the same values,
+        as the sequential code would make them: a chunk scheduled one
+        classification per level reproduces it exactly. Otherwise the
+        levels change the order of the draws, so trajectories agree
+        with the sequential code in distribution, but not draw for
+        draw. Either way, the same random_file state and the same input
+        (in the same chunks) give the same trajectories.
+
+        Given a seed, each classification's draws come from its own
+        stream instead, keyed on the seed, its subject and the subject's
+        exposure (see swap.streams), which is the same whatever the
+        order of the updates: then any chunking reproduces the
+        sequential code exactly.
+
+        A chunk is a dictionary of arrays, one element per
+        classification, in time order - see make_chunk().
+
+    FUNCTIONS
+        make_chunk(records):
+
+        schedule(agents,subjects):
+
+        realize(NL,PL,ND,PD,seed=None,IDs=None,exposure=None):
+
+        batch_update(bureau,sample,chunk,...):
+
+        update_states(chunk,agents,subjects,IDs,crowd_state,sample_state,...):
+
+        append_histories(chunk,agents,subjects,crowd,members,results,trajectory='full'):
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+"""
+
+#=========================================================================
+# Turn a list of Records, as digested in SWAP.py, into a chunk of arrays.
+# Results and truths are already coded as the histories want them:
+
+def make_chunk(records):
+
+    chunk = {}
+    if len(records) == 0:
+        chunk['Name'] = np.array([],dtype=object)
+        return chunk
+
+    t,Name,ID,ZooID,category,kind,flavor,result,truth,location,stage,at_x,at_y,key = zip(*records)
+
+    chunk['Name'] = np.array(Name,dtype=object)
+    chunk['ID'] = np.array(ID,dtype=object)
+    chunk['ItWas'] = np.array(result,dtype=int)
+    chunk['ActuallyItWas'] = np.array(truth,dtype=int)
+    chunk['Training'] = (np.array(category,dtype=int) == category_codes['training'])
+    chunk['At_Time'] = np.array([record.tstring for record in records],dtype=object)
+    chunk['At_X'] = [x.tolist() for x in at_x]
+    chunk['At_Y'] = [y.tolist() for y in at_y]
+
+    return chunk
+
+# ----------------------------------------------------------------------------
+# For each element of an array of integer keys, find the index of the
+# previous and next element with the same key (or len(keys) if there
+# isn't one):
+
+def neighbours(keys):
+
+    M = len(keys)
+    order = np.argsort(keys,kind='mergesort')
+    same = keys[order[1:]] == keys[order[:-1]]
+
+    previous = np.zeros(M,dtype=int) + M
+    following = np.zeros(M,dtype=int) + M
+    previous[order[1:][same]] = order[:-1][same]
+    following[order[:-1][same]] = order[1:][same]
+
+    return previous,following
+
+# ----------------------------------------------------------------------------
+# Assign each classification to a level, given integer codes for the
+# agents and subjects involved. Level k contains all the classifications
+# whose previous agent and subject classifications are in levels < k.
+# This is a topological sort, done a whole frontier at a time: only the
+# successors of the last level can become ready for the next one.
+
+def schedule(agents,subjects):
+
+    M = len(agents)
+    level = np.zeros(M,dtype=int) - 1
+    if M == 0: return level
+
+    previous_by_agent,next_by_agent = neighbours(agents)
+    previous_by_subject,next_by_subject = neighbours(subjects)
+
+    # Element M is a sentinel, standing for "no previous classification":
+    done = np.zeros(M+1,dtype=bool)
+    done[M] = True
+
+    frontier = np.where((previous_by_agent == M) & (previous_by_subject == M))[0]
+    k = 0
+    while len(frontier) > 0:
+        level[frontier] = k
+        done[frontier] = True
+        candidates = np.unique(np.concatenate([next_by_agent[frontier],next_by_subject[frontier]]))
+        candidates = candidates[candidates < M]
+        ready = done[previous_by_agent[candidates]] & done[previous_by_subject[candidates]]
+        frontier = candidates[ready]
+        k += 1
+
+    return level
+
+# ----------------------------------------------------------------------------
+# Yield (key, indices) pairs, grouping the given indices by key but
+# keeping them in their original (time) order within each group:
+
+def groups(keys,indices):
+
+    if len(indices) == 0: return
+
+    order = indices[np.argsort(keys[indices],kind='mergesort')]
+    sorted_keys = keys[order]
+    breaks = np.where(sorted_keys[1:] != sorted_keys[:-1])[0] + 1
+    for these in np.split(order,breaks):
+        yield keys[these[0]],these
+
+    return
+
+# ----------------------------------------------------------------------------
+# Binomial realizations of many agents' confusion matrices at once, one
+# row of Ntrajectory samples of PL and of PD per classification - see
+# Agent.get_PL_realization() and Agent.get_PD_realization(). Both are
+# drawn in a single call, row by row, PL before PD: this is exactly the
+# stream of draws the sequential code would make for the same
+# classifications, one after another. Given a seed, each row is instead
+# drawn from the keyed stream of its subject ID and (prior) exposure,
+# again PL before PD. Like np.random.binomial with a scalar N, we
+# truncate N to an integer for the draws (it can be fractional when
+# agents learn from test subjects):
+
+def realize(NL,PL,ND,PD,seed=None,IDs=None,exposure=None):
+
+    N = np.array([NL,ND]).T[:,:,np.newaxis]
+    P = np.array([PL,PD]).T[:,:,np.newaxis]
+    if seed is None:
+        draws = np.random.binomial(N.astype(int),P,size=(len(NL),2,Ntrajectory))
+    else:
+        draws = np.zeros([len(NL),2,Ntrajectory],dtype=int)
+        for i in range(len(NL)):
+            stream = swap.keyed_stream(seed,IDs[i],exposure[i])
+            draws[i] = stream.binomial(N[i].astype(int),P[i],size=(2,Ntrajectory))
+    realization = (draws*1.0)/N
+
+    PL_realization = np.maximum(np.minimum(realization[:,0],swap.PLmax),swap.PLmin)
+    PD_realization = np.maximum(np.minimum(realization[:,1],swap.PDmax),swap.PDmin)
+
+    return PL_realization,PD_realization
+
+# ----------------------------------------------------------------------------
+# Copy the state of the named agents into a dictionary of arrays. An
+# ArrayBureau already stores its agents this way, so we just index its
+# columns; otherwise, we have to visit each Agent in turn.
+
+def gather_agents(bureau,names):
+
+    state = {}
+
+    if isinstance(bureau,swap.ArrayBureau):
+        ids = bureau.indices(names)
+        crowd = [bureau.view(i) for i in ids]
+        for key in ['PL','PD','NL','ND','N','NT','skill','contribution']:
+            state[key] = bureau.columns[key][ids]
+        state['banned'] = (bureau.columns['kind'][ids] == swap.agent_kinds.index('banned'))
+
+    else:
+        crowd = [bureau.member[Name] for Name in names]
+        for key,kind in [('PL',float),('PD',float),('NL',float),('ND',float),('N',int),('NT',int),('skill',float),('contribution',float)]:
+            state[key] = np.array([getattr(agent,key) for agent in crowd],dtype=kind)
+        state['banned'] = np.array([agent.kind == 'banned' for agent in crowd],dtype=bool)
+
+    return crowd,state
+
+# ----------------------------------------------------------------------------
+# Copy the agents' updated state back into the bureau:
+
+def scatter_agents(bureau,crowd,state):
+
+    if isinstance(bureau,swap.ArrayBureau):
+        ids = np.array([agent.index for agent in crowd],dtype=int)
+        for key in ['PL','PD','NL','ND','N','NT','skill','contribution']:
+            bureau.columns[key][ids] = state[key]
+
+    else:
+        for j,agent in enumerate(crowd):
+            agent.PL = state['PL'][j]
+            agent.PD = state['PD'][j]
+            agent.NL = state['NL'][j]
+            agent.ND = state['ND'][j]
+            agent.N = int(state['N'][j])
+            agent.NT = int(state['NT'][j])
+            agent.skill = state['skill'][j]
+            agent.contribution = state['contribution'][j]
+
+    return
+
+# ----------------------------------------------------------------------------
+# Copy the state of the given subjects into a dictionary of arrays. Status
+# and state are decoded into arrays of strings, in either case.
+
+def gather_subjects(sample,IDs):
+
+    state = {}
+
+    if isinstance(sample,swap.ArrayCollection):
+        ids = sample.indices(IDs)
+        members = [sample.view(i) for i in ids]
+        for key in ['probability','mean_probability','median_probability','exposure','detection_threshold','rejection_threshold','retirement_age']:
+            state[key] = sample.columns[key][ids]
+        state['test'] = (sample.columns['kind'][ids] == swap.subject_codes['kind'].index('test'))
+        for key in ['status','state']:
+            state[key] = np.array(swap.subject_codes[key],dtype=object)[sample.columns[key][ids]]
+        state['retirement_time'] = np.array([sample.lists['retirement_time'][i] for i in ids],dtype=object)
+
+    else:
+        members = [sample.member[ID] for ID in IDs]
+        state['probability'] = np.array([np.zeros(Ntrajectory)+subject.probability for subject in members])
+        for key,kind in [('mean_probability',float),('median_probability',float),('exposure',int),('detection_threshold',float),('rejection_threshold',float),('retirement_age',float),('status',object),('state',object),('retirement_time',object)]:
+            state[key] = np.array([getattr(subject,key) for subject in members],dtype=kind)
+        state['test'] = np.array([subject.kind == 'test' for subject in members],dtype=bool)
+
+    return members,state
+
+# ----------------------------------------------------------------------------
+# Copy the subjects' updated state back into the sample, noting any
+# changes of state and status in its log (see swap.Transitions):
+
+def scatter_subjects(sample,members,state):
+
+    if isinstance(sample,swap.ArrayCollection):
+        ids = np.array([subject.index for subject in members],dtype=int)
+        for key in ['probability','mean_probability','median_probability','exposure','retirement_age']:
+            sample.columns[key][ids] = state[key]
+        codes = {}
+        for key in ['status','state']:
+            codes[key] = sample.columns[key][ids]
+            for code,value in enumerate(swap.subject_codes[key]):
+                codes[key][state[key] == value] = code
+        changed = np.where((codes['status'] != sample.columns['status'][ids]) | (codes['state'] != sample.columns['state'][ids]))[0]
+        for j in changed:
+            subject = members[j]
+            sample.transitions.note(subject.ID,subject.state,subject.status)
+        for key in ['status','state']:
+            sample.columns[key][ids] = codes[key]
+        for j,i in enumerate(ids):
+            sample.lists['retirement_time'][i] = state['retirement_time'][j]
+
+    else:
+        for j,subject in enumerate(members):
+            if (subject.state,subject.status) != (state['state'][j],state['status'][j]):
+                sample.transitions.note(subject.ID,subject.state,subject.status)
+            subject.probability = state['probability'][j]
+            subject.mean_probability = state['mean_probability'][j]
+            subject.median_probability = state['median_probability'][j]
+            subject.exposure = int(state['exposure'][j])
+            subject.status = state['status'][j]
+            subject.state = state['state'][j]
+            subject.retirement_time = state['retirement_time'][j]
+            subject.retirement_age = state['retirement_age'][j]
+
+    return
+
+# ----------------------------------------------------------------------------
+# Apply a chunk of classifications to the bureau and the sample. All the
+# agents and subjects involved must already be members. The keyword
+# arguments mirror those of Subject.was_described and Agent.heard, and
+# the supervision flags are interpreted as in SWAP.py. Returns the number
+# of classifications processed.
+
+def batch_update(bureau,sample,chunk,while_ignoring=0,haste=False,supervised=False,supervised_and_unsupervised=False,agents_willing_to_learn=False,realize_confusion=True,laplace_smoothing=0,record=True,seed=None,trajectory='full'):
+
+    M = len(chunk['Name'])
+    if M == 0: return 0
+
+    # Gather the agents' and subjects' state into arrays:
+    names,agents = np.unique(chunk['Name'],return_inverse=True)
+    crowd,crowd_state = gather_agents(bureau,names)
+    IDs,subjects = np.unique(chunk['ID'],return_inverse=True)
+    members,sample_state = gather_subjects(sample,IDs)
+
+    results = update_states(chunk,agents,subjects,IDs,crowd_state,sample_state,while_ignoring=while_ignoring,haste=haste,supervised=supervised,supervised_and_unsupervised=supervised_and_unsupervised,agents_willing_to_learn=agents_willing_to_learn,realize_confusion=realize_confusion,laplace_smoothing=laplace_smoothing,record=record,seed=seed)
+
+    # Scatter the agents' state back into the bureau:
+    scatter_agents(bureau,crowd,crowd_state)
+
+    # And the subjects' back into the sample:
+    scatter_subjects(sample,members,sample_state)
+
+    if record: append_histories(chunk,agents,subjects,crowd,members,results,trajectory=trajectory)
+
+    return M
+
+# ----------------------------------------------------------------------------
+# The arithmetic of batch_update(), on the gathered state alone: agents
+# and subjects are the classifications' indices into crowd_state and
+# sample_state (and IDs), which are updated in place. Returns the
+# per-classification results that go into the histories.
+
+def update_states(chunk,agents,subjects,IDs,crowd_state,sample_state,while_ignoring=0,haste=False,supervised=False,supervised_and_unsupervised=False,agents_willing_to_learn=False,realize_confusion=True,laplace_smoothing=0,record=True,seed=None):
+
+    M = len(chunk['Name'])
+
+    ItWas = chunk['ItWas']
+    ActuallyItWas = chunk['ActuallyItWas']
+    at_time = chunk['At_Time']
+
+    # Which classifications will the agents hear about?
+    if supervised_and_unsupervised:
+        heard = np.ones(M,dtype=bool)
+    elif supervised:
+        heard = chunk['Training']
+    else:
+        heard = ~chunk['Training']
+    ignore = not agents_willing_to_learn
+
+    PL,PD,NL,ND = crowd_state['PL'],crowd_state['PD'],crowd_state['NL'],crowd_state['ND']
+    N,NT = crowd_state['N'],crowd_state['NT']
+    skill,contribution = crowd_state['skill'],crowd_state['contribution']
+    banned = crowd_state['banned']
+
+    probability = sample_state['probability']
+    mean_probability = sample_state['mean_probability']
+    median_probability = sample_state['median_probability']
+    exposure = sample_state['exposure']
+    test = sample_state['test']
+    detection = sample_state['detection_threshold']
+    rejection = sample_state['rejection_threshold']
+    status,state = sample_state['status'],sample_state['state']
+    retirement_time = sample_state['retirement_time']
+    retirement_age = sample_state['retirement_age']
+
+    # Per-classification results, needed for the histories:
+    annotated = np.zeros(M,dtype=bool)
+    annotated_PL = np.zeros(M)
+    annotated_PD = np.zeros(M)
+    updated = np.zeros(M,dtype=bool)
+    posterior = np.zeros([M,Ntrajectory])
+    tested = np.zeros(M,dtype=bool)
+    tested_I = np.zeros(M)
+    tested_skill = np.zeros(M)
+    trained_PL = np.zeros(M)
+    trained_PD = np.zeros(M)
+    trained_skill = np.zeros(M)
+
+    level = schedule(agents,subjects)
+    order = np.argsort(level,kind='mergesort')
+    edges = np.searchsorted(level[order],np.arange(level.max()+2))
+
+    for k in range(len(edges)-1):
+
+        rows = order[edges[k]:edges[k+1]]
+        a = agents[rows]
+        s = subjects[rows]
+
+        # First, the subjects are described by the agents:
+        N[a] += 1
+
+        live = ~banned[a]
+        if haste:
+            live &= (state[s] != 'inactive') & (status[s] != 'detected') & (status[s] != 'rejected')
+        r,ra,rs = rows[live],a[live],s[live]
+
+        if record:
+            annotated[r] = True
+            annotated_PL[r] = PL[ra]
+            annotated_PD[r] = PD[ra]
+
+        # Exposure advances even if the agent is still ignoring its volunteer:
+        exposure[rs] += 1
+
+        use = NT[ra] > while_ignoring
+        r,ra,rs = r[use],ra[use],rs[use]
+
+        if len(r) > 0:
+
+            if realize_confusion:
+                PL_realization,PD_realization = realize(NL[ra],PL[ra],ND[ra],PD[ra],seed,IDs[rs],exposure[rs]-1)
+            else:
+                PL_realization = np.ones([len(r),Ntrajectory]) * PL[ra][:,np.newaxis]
+                PD_realization = np.ones([len(r),Ntrajectory]) * PD[ra][:,np.newaxis]
+
+            lens = (ItWas[r] == 1)[:,np.newaxis]
+            M_cl = np.where(lens,PL_realization,1-PL_realization)
+            M_cn = np.where(lens,1-PD_realization,PD_realization)
+
+            p = probability[rs]
+            likelihood = M_cl + laplace_smoothing
+            likelihood /= (M_cl*p + M_cn*(1-p) + 2 * laplace_smoothing)
+            p = likelihood*p
+            p[p < swap.pmin] = swap.pmin
+
+            probability[rs] = p
+            updated[r] = True
+            posterior[r] = p
+
+            mean_probability[rs] = 10.0 ** np.mean(np.log10(p),axis=1)
+            median_probability[rs] = np.median(p,axis=1)
+
+            # Update status and state - see Subject.update_state():
+            P = mean_probability[rs]
+            rejected = P < rejection[rs]
+            detected = (~rejected) & (P > detection[rs])
+            undecided = (~rejected) & (~detected)
+
+            status[rs[rejected]] = 'rejected'
+            retired = rejected & test[rs]
+            state[rs[retired]] = 'inactive'
+            retirement_time[rs[retired]] = at_time[r[retired]]
+            retirement_age[rs[retired]] = exposure[rs[retired]]
+
+            status[rs[detected]] = 'detected'
+
+            status[rs[undecided]] = 'undecided'
+            revived = rs[undecided & test[rs]]
+            state[revived] = 'active'
+            retirement_time[revived] = 'not yet'
+            retirement_age[revived] = 0.0
+
+            # Test subjects contribute to the agents' test histories:
+            if record:
+                t = test[rs]
+                tested[r[t]] = True
+                tested_I[r[t]] = swap.informationGain(P[t],PL[ra[t]],PD[ra[t]],True)
+                tested_skill[r[t]] = skill[ra[t]]
+                contribution[ra[t]] += skill[ra[t]]
+
+        # Now the agents hear about what happened - see Agent.heard():
+        h = heard[rows]
+        r,ra,rs = rows[h],a[h],s[h]
+        X = ItWas[r]
+        Y = ActuallyItWas[r]
+
+        # Training subjects:
+        for truth,PX,NX,PXmin,PXmax in [(1,PL,NL,swap.PLmin,swap.PLmax),(0,PD,ND,swap.PDmin,swap.PDmax)]:
+            these = (Y == truth)
+            j = ra[these]
+            if not ignore:
+                PX[j] = (PX[j]*NX[j] + (X[these] == truth))/(1+NX[j])
+                PX[j] = np.maximum(np.minimum(PX[j],PXmax),PXmin)
+            NX[j] += 1
+            NT[j] += 1
+
+        # Test subjects - unsupervised learning:
+        unknown = (Y == -1)
+        increment = mean_probability[rs[unknown]]
+        said_lens = (X[unknown] == 1)
+        for these,hit in [(said_lens,1.0),(~said_lens,0.0)]:
+            j = ra[unknown][these]
+            inc = increment[these]
+            if not ignore:
+                PL[j] = (PL[j]*NL[j] + hit*inc)/(NL[j] + inc)
+                PL[j] = np.maximum(np.minimum(PL[j],swap.PLmax),swap.PLmin)
+            NL[j] += inc
+            if not ignore:
+                PD[j] = (PD[j]*ND[j] + (1.0-hit)*(1.0-inc))/(ND[j] + (1.0-inc))
+                PD[j] = np.maximum(np.minimum(PD[j],swap.PDmax),swap.PDmin)
+            ND[j] += (1.0 - inc)
+        NT[ra[unknown]] += 1
+
+        if record:
+            skill[ra] = swap.expectedInformationGain(0.5,PL[ra],PD[ra])
+            trained_skill[r] = skill[ra]
+            trained_PL[r] = PL[ra]
+            trained_PD[r] = PD[ra]
+
+    return {'heard':heard,
+            'annotated':annotated, 'annotated_PL':annotated_PL, 'annotated_PD':annotated_PD,
+            'updated':updated, 'posterior':posterior,
+            'tested':tested, 'tested_I':tested_I, 'tested_skill':tested_skill,
+            'trained_PL':trained_PL, 'trained_PD':trained_PD, 'trained_skill':trained_skill}
+
+# ----------------------------------------------------------------------------
+# Append the results of update_states() to the histories, one agent or
+# subject at a time:
+
+def append_histories(chunk,agents,subjects,crowd,members,results,trajectory='full'):
+
+    ItWas = chunk['ItWas']
+    ActuallyItWas = chunk['ActuallyItWas']
+    at_time = chunk['At_Time']
+
+    for j,these in groups(subjects,np.where(results['annotated'])[0]):
+        members[j].annotationhistory.extend(Name=chunk['Name'][these],
+                                            ItWas=ItWas[these],
+                                            At_X=[chunk['At_X'][i] for i in these],
+                                            At_Y=[chunk['At_Y'][i] for i in these],
+                                            PL=results['annotated_PL'][these],
+                                            PD=results['annotated_PD'][these],
+                                            At_Time=at_time[these])
+
+    for j,these in groups(subjects,np.where(results['updated'])[0]):
+        swap.record_trajectory(members[j].trajectoryhistory,results['posterior'][these],trajectory)
+
+    for j,these in groups(agents,np.where(results['tested'])[0]):
+        crowd[j].testhistory.extend(ID=chunk['ID'][these],
+                                    I=results['tested_I'][these],
+                                    Skill=results['tested_skill'][these],
+                                    ItWas=ItWas[these],
+                                    At_Time=at_time[these])
+
+    for j,these in groups(agents,np.where(results['heard'])[0]):
+        crowd[j].traininghistory.extend(ID=chunk['ID'][these],
+                                        Skill=results['trained_skill'][these],
+                                        PL=results['trained_PL'][these],
+                                        PD=results['trained_PD'][these],
+                                        ItWas=ItWas[these],
+                                        ActuallyItWas=ActuallyItWas[these],
+                                        At_Time=at_time[these])
+
+    return
+
+# ======================================================================
@@ -270,3 +270,274 @@ class Bureau(object):
 
 # ======================================================================
 
+
+# Columns of an ArrayBureau, and their types:
+agent_columns = [('PL',float), ('PD',float), ('NL',float), ('ND',float),
+                 ('N',int), ('NT',int), ('skill',float),
+                 ('contribution',float), ('kind',np.int8)]
+
+# ======================================================================
+
+class ArrayBureau(Bureau):
+    """
+    NAME
+        ArrayBureau
+
+    PURPOSE
+        A Bureau whose agents' state is stored in contiguous arrays.
+
+    COMMENTS
+        Instead of a dictionary of Agent objects, an ArrayBureau keeps
+        PL, PD, NL, ND, N, NT, skill, contribution and kind in typed
+        column arrays, indexed by an integer agent id. The Names of the
+        agents are mapped to their ids with a dictionary. This makes
+        the pickle much smaller, and collect_probabilities() a matter of
+        slicing. Each agent's training and test histories are kept in
+        lists, also indexed by agent id.
+
+        ArrayBureau.member still looks like a dictionary of agents:
+        member[Name] returns an AgentView onto the columns, and
+        member[Name] = agent copies a new Agent's state in. So SWAP.py,
+        the report code and the plotting scripts can use either kind
+        of bureau.
+
+    INITIALISATION
+        From scratch, or from an existing Bureau (whose agents are
+        copied in).
+
+    METHODS AND VARIABLES
+        ArrayBureau.columns[key]      Column arrays (with spare capacity)
+        ArrayBureau.indices(Names)    Agent ids of the named agents
+        ArrayBureau.rows()            Agent ids of all current agents
+        ArrayBureau.view(i)           An AgentView onto agent i
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,bureau=None,capacity=1024):
+
+        Bureau.__init__(self)
+
+        self.names = []
+        self.index = {}
+        self.traininghistories = []
+        self.testhistories = []
+        self.columns = {}
+        for key,kind in agent_columns:
+            self.columns[key] = np.zeros(capacity,dtype=kind)
+        self.member = Roster(self)
+
+        if bureau is not None:
+            for Name in bureau.list():
+                self.member[Name] = bureau.member[Name]
+
+        return None
+
+# ----------------------------------------------------------------------------
+# Pickle only the rows that are in use:
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['columns'] = {}
+        for key in self.columns:
+            state['columns'][key] = np.array(self.columns[key][:len(self.names)])
+        return state
+
+# ----------------------------------------------------------------------------
+# Bring histories read from old pickles up to date:
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        for i in range(len(self.names)):
+            self.traininghistories[i] = swap.History.migrate(self.traininghistories[i],swap.traininghistory_fields)
+            self.testhistories[i] = swap.History.migrate(self.testhistories[i],swap.testhistory_fields)
+        return
+
+# ----------------------------------------------------------------------------
+# Add a new agent (or overwrite an old one), copying in its state:
+
+    def add(self,Name,agent):
+
+        if Name in self.index:
+            i = self.index[Name]
+        else:
+            i = len(self.names)
+            if i == len(self.columns['PL']):
+                for key in self.columns:
+                    extra = np.zeros(max(i,1),dtype=self.columns[key].dtype)
+                    self.columns[key] = np.concatenate([self.columns[key],extra])
+            self.names.append(Name)
+            self.traininghistories.append(None)
+            self.testhistories.append(None)
+            self.index[Name] = i
+
+        # Assigning a view of this very agent back to itself is a no-op:
+        if isinstance(agent,swap.AgentView) and agent.bureau is self and agent.index == i:
+            return i
+
+        for key,kind in agent_columns:
+            if key == 'kind':
+                self.columns[key][i] = swap.agent_kinds.index(agent.kind)
+            else:
+                self.columns[key][i] = getattr(agent,key)
+        self.traininghistories[i] = agent.traininghistory
+        self.testhistories[i] = agent.testhistory
+
+        return i
+
+# ----------------------------------------------------------------------------
+# Remove an agent. Its row stays in the columns, but is no longer used:
+
+    def remove(self,Name):
+
+        i = self.index.pop(Name)
+        self.names[i] = None
+        self.traininghistories[i] = None
+        self.testhistories[i] = None
+
+        return i
+
+# ----------------------------------------------------------------------------
+# Make a free-standing copy of an agent:
+
+    def detach(self,Name):
+
+        view = self.member[Name]
+        agent = swap.Agent.__new__(swap.Agent)
+        for key,kind in agent_columns:
+            setattr(agent,key,getattr(view,key))
+        agent.name = view.name
+        agent.traininghistory = view.traininghistory
+        agent.testhistory = view.testhistory
+
+        return agent
+
+# ----------------------------------------------------------------------------
+
+    def view(self,i):
+        return swap.AgentView(self,i)
+
+# ----------------------------------------------------------------------------
+# Return agent ids, for a list of Names, or for all current agents:
+
+    def indices(self,Names):
+        return np.array([self.index[Name] for Name in Names],dtype=int)
+
+    def rows(self):
+        return np.array(sorted(self.index.values()),dtype=int)
+
+# ----------------------------------------------------------------------------
+
+    def size(self):
+        return len(self.index)
+
+    def list(self):
+        return [self.names[i] for i in self.rows()]
+
+# ----------------------------------------------------------------------------
+# Extract all the classification probabilities used by the agents, by
+# slicing the columns:
+
+    def collect_probabilities(self):
+
+        rows = self.rows()
+
+        self.probabilities['LENS'] = self.columns['PL'][rows]
+        self.probabilities['NOT'] = self.columns['PD'][rows]
+        self.contributions = self.columns['contribution'][rows]
+        self.skills = self.columns['skill'][rows]
+        self.Ntraining = self.columns['NT'][rows].astype(float)
+        self.Ntotal = self.columns['N'][rows].astype(float)
+        self.Ntest = self.Ntotal - self.Ntraining
+
+        return
+
+# ======================================================================
+
+class Roster(object):
+    """
+    NAME
+        Roster
+
+    PURPOSE
+        The dictionary-like member attribute of an ArrayBureau (or an
+        ArrayCollection).
+
+    COMMENTS
+        Looking up a Name returns a view onto the store's columns (an
+        AgentView, say); assigning an object to a Name copies its state
+        into the columns, and popping a Name returns a free-standing
+        copy. Missing Names raise KeyError, just like a dictionary.
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,store):
+        self.store = store
+        return None
+
+    def __getitem__(self,Name):
+        return self.store.view(self.store.index[Name])
+
+    def __setitem__(self,Name,thing):
+        self.store.add(Name,thing)
+
+    def __delitem__(self,Name):
+        self.store.remove(Name)
+
+    def __contains__(self,Name):
+        return Name in self.store.index
+
+    def __len__(self):
+        return len(self.store.index)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def has_key(self,Name):
+        return Name in self.store.index
+
+    def get(self,Name,default=None):
+        if Name in self.store.index:
+            return self[Name]
+        return default
+
+    def pop(self,Name):
+        thing = self.store.detach(Name)
+        self.store.remove(Name)
+        return thing
+
+    def update(self,other):
+        for Name in other.keys():
+            self[Name] = other[Name]
+
+    def keys(self):
+        return self.store.list()
+
+    def values(self):
+        return [self[Name] for Name in self.keys()]
+
+    def items(self):
+        return [(Name,self[Name]) for Name in self.keys()]
+
+# ======================================================================
@@ -0,0 +1,283 @@
+# ======================================================================
+
+import swap
+
+import os,json,shutil,datetime
+
+# ======================================================================
+
+checkpoint_format = 'SWAP checkpoints'
+checkpoint_version = 1
+
+# The parameters a checkpoint saves - the state files, and where we got
+# to (in the database, and in the event log):
+checkpoint_files = ['bureaufile','samplefile','offlinefile','dbfile','random_file']
+checkpoint_parameters = checkpoint_files + ['start','start_key','eventlog_size']
+
+# ======================================================================
+
+class Checkpoints(object):
+    """
+    NAME
+        Checkpoints
+
+    PURPOSE
+        Save everything SWAP needs to carry on - bureau, collection,
+        offline EM state, Toy database, random state and config - all
+        together or not at all, and find the latest complete save.
+
+    COMMENTS
+        SWAP used to write the bureau, then the collection, then the
+        random state and update.config, each over the last one: dying
+        part way through left a new bureau with an old collection (or a
+        half-written pickle), and the only way back was to start again
+        from some earlier time. Instead, each checkpoint is written to
+        a new, numbered generation directory, as <generation>.tmp, and
+        only renamed to <generation> once every file in it has been
+        written and synced. Then the manifest, which says which
+        generation is the latest, is written to manifest.json.tmp and
+        renamed over manifest.json. That rename is the moment the
+        checkpoint is made: before it, the last checkpoint stands, and
+        after it, the new one does. Older generations are then removed,
+        keeping the last few.
+
+        The manifest ties together the files of the generation (by
+        parameter: bureaufile, samplefile, offlinefile, dbfile and
+        random_file) and the parameters that say where SWAP got to:
+        start, the time of the last classification processed,
+        start_key, its place in the database (see swap.Record), and
+        eventlog_size, how many classifications the event log had. When
+        SWAP carries on from a config file (any start but
+        'the_beginning'), it takes these parameters from the latest
+        checkpoint, whatever the config file says - so a crash after a
+        checkpoint, but before update.config was written, loses
+        nothing.
+
+        Everything in the last generation is carried over into the new
+        one as hard links, before anything is written: so files that
+        are not saved again (the Toy database, say, or a run with
+        nothing new in it) are still in the new checkpoint, and only
+        the files in snapshot directories that have changed are written
+        again (see snapshot.py). Files are always written to a
+        temporary name and renamed, so the links are replaced, and the
+        last generation is never changed.
+
+    INITIALISATION
+        dirname      The checkpoint directory (made if need be)
+        keep         No. of generations to keep
+
+    METHODS
+        Checkpoints.latest()               The latest manifest, or None
+        Checkpoints.begin()                Start a new generation
+        Checkpoints.path(filename)         Where to write a file in it
+        Checkpoints.final_path(filename)   Where it will end up
+        Checkpoints.carried(filename)      Was it carried over?
+        Checkpoints.commit(parameters)     Make it the latest
+        Checkpoints.resume(parameters)     Set parameters from the latest
+
+    BUGS
+        The trajectory store and event log are not part of a
+        checkpoint: they are only ever appended to. The collection says
+        how much of the store it uses, and the event log is cut back to
+        eventlog_size when SWAP carries on (see EventLog.truncate()).
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,dirname,keep=2):
+
+        self.dirname = dirname
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.keep = max(keep,1)
+        self.generation = None
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def __str__(self):
+        manifest = self.latest()
+        if manifest is None:
+            return 'empty set of checkpoints in %s' % self.dirname
+        return 'checkpoint %d in %s' % (manifest['generation'],self.dirname)
+
+# ----------------------------------------------------------------------------
+# The latest complete checkpoint's manifest, or None:
+
+    def latest(self):
+
+        filename = os.path.join(self.dirname,'manifest.json')
+        if not os.path.isfile(filename):
+            return None
+
+        F = open(filename,'r')
+        manifest = json.load(F)
+        F.close()
+
+        if manifest.get('format') != checkpoint_format:
+            raise Exception("SWAP: "+filename+" is not a checkpoint manifest")
+
+        return manifest
+
+# ----------------------------------------------------------------------------
+# Start writing a new generation, in a temporary directory (throwing
+# away any that were never finished):
+
+    def begin(self):
+
+        manifest = self.latest()
+        if manifest is None:
+            self.generation = 1
+        else:
+            self.generation = manifest['generation'] + 1
+
+        # (A generation that was renamed, but never got into the
+        # manifest, is thrown away too.)
+        for name in os.listdir(self.dirname):
+            if name.endswith('.tmp') or (name.isdigit() and int(name) >= self.generation):
+                if os.path.isdir(os.path.join(self.dirname,name)):
+                    shutil.rmtree(os.path.join(self.dirname,name))
+
+        work = self.workdir()
+        os.makedirs(work)
+
+        # Hard-link the last generation in, so that what is not written
+        # again is kept, and snapshots can be updated rather than
+        # written from scratch:
+        if manifest is not None:
+            link_tree(self.last(),work)
+
+        return work
+
+    def last(self):
+        return os.path.join(self.dirname,generation_name(self.generation-1))
+
+    def workdir(self):
+        return os.path.join(self.dirname,generation_name(self.generation)+'.tmp')
+
+# ----------------------------------------------------------------------------
+# Where to write a file in the new generation, and where it will be once
+# the generation is committed:
+
+    def path(self,filename):
+        return os.path.join(self.workdir(),os.path.basename(filename))
+
+    def final_path(self,filename):
+        return os.path.join(self.dirname,generation_name(self.generation),os.path.basename(filename))
+
+# Is this one of the files carried over from the last generation?
+
+    def carried(self,filename):
+        if filename is None:
+            return False
+        return os.path.abspath(os.path.dirname(filename)) == os.path.abspath(self.last())
+
+# ----------------------------------------------------------------------------
+# Make the new generation the latest checkpoint: sync it, rename it,
+# and then write the manifest, with the given parameters (file names in
+# the new generation are given as their final paths).
+
+    def commit(self,parameters):
+
+        work = self.workdir()
+        final = os.path.join(self.dirname,generation_name(self.generation))
+
+        for root,dirs,files in os.walk(work):
+            for name in files:
+                sync(os.path.join(root,name))
+            sync(root)
+        os.rename(work,final)
+        sync(self.dirname)
+
+        manifest = {'format': checkpoint_format,
+                    'version': checkpoint_version,
+                    'generation': self.generation,
+                    'saved': datetime.datetime.utcnow().strftime('%Y-%m-%d_%H:%M:%S'),
+                    'parameters': parameters}
+        write_json_atomically(manifest,os.path.join(self.dirname,'manifest.json'))
+
+        # Keep the last few generations:
+        for name in os.listdir(self.dirname):
+            if name.isdigit() and int(name) <= self.generation - self.keep:
+                shutil.rmtree(os.path.join(self.dirname,name))
+
+        self.generation = None
+
+        return final
+
+# ----------------------------------------------------------------------------
+# Carry on from the latest checkpoint: set the parameters it saved.
+# Returns the manifest, or None if there are no checkpoints yet.
+
+    def resume(self,parameters):
+
+        manifest = self.latest()
+        if manifest is None:
+            return None
+
+        for key,value in manifest['parameters'].items():
+            parameters[key] = value
+
+        return manifest
+
+# ======================================================================
+
+# ----------------------------------------------------------------------------
+
+def generation_name(generation):
+    return '%06d' % generation
+
+# ----------------------------------------------------------------------------
+# Flush a file (or directory) to disk:
+
+def sync(path):
+
+    fd = os.open(path,os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    return
+
+# ----------------------------------------------------------------------------
+# Write a JSON file, via a temporary file, so that it is never left half
+# written:
+
+def write_json_atomically(contents,filename):
+
+    F = open(filename+'.tmp','w')
+    json.dump(contents,F,indent=1,sort_keys=True)
+    F.flush()
+    os.fsync(F.fileno())
+    F.close()
+    os.rename(filename+'.tmp',filename)
+    sync(os.path.dirname(os.path.abspath(filename)))
+
+    return
+
+# ----------------------------------------------------------------------------
+# Copy a directory tree as hard links:
+
+def link_tree(source,destination):
+
+    for root,dirs,files in os.walk(source):
+        folder = os.path.join(destination,os.path.relpath(root,source))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for name in files:
+            if not name.endswith('.tmp'):
+                os.link(os.path.join(root,name),os.path.join(folder,name))
+
+    return
+
+# ======================================================================
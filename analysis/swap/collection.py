@@ -4,7 +4,7 @@ import swap
 
 import numpy as np
 import pylab as plt
-from subject import Ntrajectory
+from subject import Ntrajectory, subject_codes
 # ======================================================================
 
 class Collection(object):
@@ -25,6 +25,9 @@ class Collection(object):
         Collection.member(Name)     Returns the Subject called Name
         Collection.size()           Returns the size of the Collection
         Collection.list()           Returns the IDs of the members
+        Collection.transitions      Log of the subjects whose state or
+                                      status has changed (see
+                                      Transitions)
 
     BUGS
 
@@ -40,12 +43,25 @@ class Collection(object):
 
     def __init__(self):
 
-        self.member = {}
+        self.transitions = Transitions()
+        self.member = Members(self.transitions)
         self.probabilities = {'sim':np.array([]), 'dud':np.array([]), 'test':np.array([])}
         self.exposure = {'sim':np.array([]), 'dud':np.array([]), 'test':np.array([])}
 
         return None
 
+# ----------------------------------------------------------------------------
+# Collections in old pickles have no transitions log, and a plain
+# dictionary of members:
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if 'transitions' not in state:
+            self.transitions = Transitions()
+        if not isinstance(self.member,Members):
+            self.member = Members(self.transitions,self.member)
+        return
+
 # ----------------------------------------------------------------------------
 
     def __str__(self):
@@ -360,3 +376,451 @@ class Collection(object):
         return
 
 # ======================================================================
+
+# Subject attributes stored in the columns of an ArrayCollection, and
+# the attributes kept in its lists:
+
+subject_columns = [('mean_probability',float), ('median_probability',float),
+                   ('exposure',int), ('retirement_age',float),
+                   ('detection_threshold',float), ('rejection_threshold',float),
+                   ('kind',np.int8), ('category',np.int8),
+                   ('status',np.int8), ('state',np.int8)]
+
+subject_lists = ['ZooID', 'flavor', 'truth', 'location', 'retirement_time',
+                 'trajectoryhistory', 'annotationhistory']
+
+# ======================================================================
+
+class ArrayCollection(Collection):
+    """
+    NAME
+        ArrayCollection
+
+    PURPOSE
+        A Collection whose subjects' state is stored in contiguous arrays.
+
+    COMMENTS
+        Instead of a dictionary of Subject objects, an ArrayCollection
+        keeps the probability ensembles in one 2-D float array of shape
+        (Nsubjects, Ntrajectory), and the mean and median
+        probabilities, exposure, thresholds and retirement age in typed
+        column arrays, all indexed by an integer subject id. Kind,
+        category, status and state are integer-coded (see
+        swap.subject_codes). The IDs are mapped to subject ids with a
+        dictionary, and the remaining attributes (ZooID, trajectory,
+        annotationhistory and so on) are kept in lists.
+
+        ArrayCollection.member still looks like a dictionary of
+        subjects: member[ID] returns a SubjectView onto the columns,
+        and member[ID] = subject copies a new Subject's state in.
+        shortlist(), thresholds(), collect_probabilities() and
+        take_stock() work directly on the columns.
+
+    INITIALISATION
+        From scratch, or from an existing Collection (whose subjects are
+        copied in).
+
+    METHODS AND VARIABLES
+        ArrayCollection.columns[key]      Column arrays (with spare capacity)
+        ArrayCollection.lists[key]        Per-subject lists
+        ArrayCollection.indices(IDs)      Subject ids of the given subjects
+        ArrayCollection.rows()            Subject ids of all current subjects
+        ArrayCollection.view(i)           A SubjectView onto subject i
+        ArrayCollection.select(...)       Subject ids of a given kind etc
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,collection=None,capacity=1024):
+
+        Collection.__init__(self)
+
+        self.names = []
+        self.index = {}
+        self.columns = {}
+        for key,kind in subject_columns:
+            self.columns[key] = np.zeros(capacity,dtype=kind)
+        self.columns['probability'] = np.zeros((capacity,Ntrajectory))
+        self.lists = {}
+        for key in subject_lists:
+            self.lists[key] = []
+        self.member = swap.Roster(self)
+
+        if collection is not None:
+            self.transitions = collection.transitions
+            for ID in collection.list():
+                self.member[ID] = collection.member[ID]
+
+        return None
+
+# ----------------------------------------------------------------------------
+# Pickle only the rows that are in use:
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['columns'] = {}
+        for key in self.columns:
+            state['columns'][key] = np.array(self.columns[key][:len(self.names)])
+        return state
+
+# ----------------------------------------------------------------------------
+# Bring histories read from old pickles up to date (and give them a
+# transitions log):
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if 'transitions' not in state:
+            self.transitions = Transitions()
+        for key in ['trajectory','trajectory_buffer']:
+            if key in self.lists:
+                self.lists['trajectoryhistory'] = [swap.migrate_trajectory(trajectory) for trajectory in self.lists.pop(key)]
+        for i in range(len(self.names)):
+            self.lists['annotationhistory'][i] = swap.History.migrate(self.lists['annotationhistory'][i],swap.annotationhistory_fields)
+        return
+
+# ----------------------------------------------------------------------------
+# Add a new subject (or overwrite an old one), copying in its state:
+
+    def add(self,ID,subject):
+
+        if ID in self.index:
+            i = self.index[ID]
+        else:
+            i = len(self.names)
+            if i == len(self.columns['exposure']):
+                for key in self.columns:
+                    old = self.columns[key]
+                    extra = np.zeros((max(i,1),)+old.shape[1:],dtype=old.dtype)
+                    self.columns[key] = np.concatenate([old,extra])
+            self.names.append(ID)
+            for key in subject_lists:
+                self.lists[key].append(None)
+            self.index[ID] = i
+
+        # Assigning a view of this very subject back to itself is a no-op:
+        if isinstance(subject,swap.SubjectView) and subject.collection is self and subject.index == i:
+            return i
+
+        for key,kind in subject_columns:
+            if key in subject_codes:
+                self.columns[key][i] = subject_codes[key].index(getattr(subject,key))
+            else:
+                self.columns[key][i] = getattr(subject,key)
+        self.columns['probability'][i] = subject.probability
+        for key in subject_lists:
+            self.lists[key][i] = getattr(subject,key)
+
+        return i
+
+# ----------------------------------------------------------------------------
+# Remove a subject. Its row stays in the columns, but is no longer used:
+
+    def remove(self,ID):
+
+        i = self.index.pop(ID)
+        self.names[i] = None
+        for key in subject_lists:
+            self.lists[key][i] = None
+
+        return i
+
+# ----------------------------------------------------------------------------
+# Make a free-standing copy of a subject:
+
+    def detach(self,ID):
+
+        view = self.member[ID]
+        subject = swap.Subject.__new__(swap.Subject)
+        for key,kind in subject_columns:
+            setattr(subject,key,getattr(view,key))
+        for key in subject_lists:
+            setattr(subject,key,getattr(view,key))
+        subject.probability = view.probability.copy()
+        subject.ID = view.ID
+
+        return subject
+
+# ----------------------------------------------------------------------------
+
+    def view(self,i):
+        return swap.SubjectView(self,i)
+
+# ----------------------------------------------------------------------------
+# Return subject ids, for a list of IDs, or for all current subjects:
+
+    def indices(self,IDs):
+        return np.array([self.index[ID] for ID in IDs],dtype=int)
+
+    def rows(self):
+        return np.array(sorted(self.index.values()),dtype=int)
+
+# ----------------------------------------------------------------------------
+# Return the subject ids of the current subjects of a given kind, status
+# and state:
+
+    def select(self,kind='Any',status='Any',state='Any',rows=None):
+
+        if rows is None: rows = self.rows()
+        keep = np.ones(len(rows),dtype=bool)
+        for key,value in [('kind',kind),('status',status),('state',state)]:
+            if value != 'Any':
+                code = subject_codes[key].index(value)
+                keep &= (self.columns[key][rows] == code)
+
+        return rows[keep]
+
+# ----------------------------------------------------------------------------
+
+    def size(self):
+        return len(self.index)
+
+    def list(self):
+        return [self.names[i] for i in self.rows()]
+
+# ----------------------------------------------------------------------------
+# Return a list of N collection members, selected at regular intervals:
+
+    def shortlist(self,N,kind='Any',status='Any'):
+
+        rows = self.select(kind=kind,status=status)
+        if kind != 'Any' or status != 'Any':
+            if len(rows) < N: N = len(rows)
+
+        if N == 0:
+            shortlist = []
+        else:
+            shortlist = [self.names[i] for i in rows[0::int(len(rows)/N)][0:N]]
+
+        return shortlist
+
+# ----------------------------------------------------------------------------
+# Get the probability thresholds for this sample:
+
+    def thresholds(self):
+
+        thresholds = {}
+        i = self.rows()[0]
+
+        thresholds['detection'] = self.columns['detection_threshold'][i]
+        thresholds['rejection'] = self.columns['rejection_threshold'][i]
+
+        return thresholds
+
+# ----------------------------------------------------------------------------
+# Extract all the lens probabilities of the members of a given kind:
+
+    def collect_probabilities(self,kind):
+
+        rows = self.select(kind=kind)
+
+        self.probabilities[kind] = self.columns['mean_probability'][rows]
+        self.exposure[kind] = self.columns['exposure'][rows].astype(float)
+
+        return
+
+# ----------------------------------------------------------------------
+# Take stock: how many detections? how many rejections?
+
+    def take_stock(self):
+
+        rows = self.rows()
+        kind = self.columns['kind'][rows]
+        category = self.columns['category'][rows]
+        status = self.columns['status'][rows]
+        state = self.columns['state'][rows]
+
+        training = (category == subject_codes['category'].index('training'))
+        sim = training & (kind == subject_codes['kind'].index('sim'))
+        dud = training & (kind == subject_codes['kind'].index('dud'))
+        detected = (status == subject_codes['status'].index('detected'))
+        rejected = (status == subject_codes['status'].index('rejected'))
+        retired = (state == subject_codes['state'].index('inactive'))
+
+        self.N = len(rows)
+        self.Nt = np.sum(training)
+        self.Ns = self.N - self.Nt
+        self.Ntl = np.sum(sim)
+        self.Ntd = np.sum(dud)
+        self.Ns_retired = np.sum(retired)
+        self.Ns_rejected = np.sum(~training & rejected)
+        self.Ns_detected = np.sum(~training & detected)
+        self.Nt_rejected = np.sum(training & rejected)
+        self.Nt_detected = np.sum(training & detected)
+        self.Ntl_rejected = np.sum(sim & rejected)
+        self.Ntl_detected = np.sum(sim & detected)
+        self.Ntd_rejected = np.sum(dud & rejected)
+        self.Ntd_detected = np.sum(dud & detected)
+        self.retirement_ages = self.columns['retirement_age'][rows[retired]]
+
+        return
+
+# ======================================================================
+
+class Transitions(object):
+    """
+    NAME
+        Transitions
+
+    PURPOSE
+        Log the subjects in a collection whose state or status has
+        changed, since the log was last cleared.
+
+    COMMENTS
+        Subjects are retired (made inactive) and detected one
+        classification at a time, but the retirement list used to be
+        made by going through the whole collection, at every report,
+        and then compared with the last one to see what was new - work
+        in proportion to the size of the collection, not to what had
+        changed.
+
+        Instead, a subject notes its state and status in its
+        collection's log whenever Subject.update_state() changes them
+        (the batch engine, and offline EM, note them as they copy the
+        subjects' new state in). Only the first is kept, so there is
+        one entry per subject that has changed, however often it did.
+        changes() compares each with the subject's state and status
+        now, so that a subject that was retired and brought back again
+        (by offline EM, say) has not changed at all. SWAP writes out
+        the subjects retired since the last save, and then clears the
+        log - see save_state() in SWAP.py.
+
+    INITIALISATION
+        From scratch.
+
+    METHODS AND VARIABLES
+        Transitions.note(ID,state,status)   Note a subject's state and
+                                              status, before a change
+        Transitions.changes(collection)     Lists of the IDs of the
+                                              subjects 'retired',
+                                              'revived', 'detected' and
+                                              'undetected' since the log
+                                              was cleared
+        Transitions.clear()                 Start again
+        Transitions.N                       No. of changes noted
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self):
+
+        self.before = {}
+        self.N = 0
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'log of %d changes to %d subjects' % (self.N,len(self.before))
+
+    def __len__(self):
+        return len(self.before)
+
+# ----------------------------------------------------------------------------
+
+    def note(self,ID,state,status):
+
+        self.N += 1
+        if ID not in self.before:
+            self.before[ID] = (state,status)
+
+        return
+
+# ----------------------------------------------------------------------------
+# Compare the subjects' state and status with what they were, and list
+# the IDs of those that have changed, in order:
+
+    def changes(self,collection):
+
+        changes = {'retired': [], 'revived': [], 'detected': [], 'undetected': []}
+        for ID in sorted(self.before):
+            state,status = self.before[ID]
+            subject = collection.member[ID]
+            if subject.state != state:
+                changes[{'inactive': 'retired', 'active': 'revived'}[subject.state]].append(ID)
+            if (subject.status == 'detected') != (status == 'detected'):
+                changes[{True: 'detected', False: 'undetected'}[subject.status == 'detected']].append(ID)
+
+        return changes
+
+# ----------------------------------------------------------------------------
+
+    def clear(self):
+
+        self.before = {}
+        self.N = 0
+
+        return
+
+# ======================================================================
+
+class Members(dict):
+    """
+    NAME
+        Members
+
+    PURPOSE
+        The member dictionary of a Collection, which tells each Subject
+        put in it where to note its transitions.
+
+    COMMENTS
+        Just a dictionary of subjects, except that member[ID] = subject
+        (and unpickling) sets subject.transitions to the collection's
+        log (see Transitions). Subjects don't pickle it themselves.
+
+    INITIALISATION
+        transitions, and optionally a dictionary of subjects
+
+    BUGS
+        - update() and setdefault() don't tell the subjects.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,transitions,members={}):
+
+        dict.__init__(self,members)
+        self.transitions = transitions
+        for subject in self.itervalues():
+            subject.transitions = transitions
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def __setitem__(self,ID,subject):
+        subject.transitions = self.transitions
+        dict.__setitem__(self,ID,subject)
+
+    def __reduce__(self):
+        return (Members,(self.transitions,dict(self)))
+
+# ======================================================================
@@ -0,0 +1,335 @@
+# ======================================================================
+
+import numpy as np
+
+import os,json,calendar,datetime
+
+from record import Record,category_codes,kind_codes,result_codes
+
+# ======================================================================
+
+# One fixed-width record per classification. Names and subjects are
+# coded as integers, indexing the log's names and subjects tables, and
+# the clicks are a slice of the log's clicks file:
+
+event_dtype = np.dtype([('t','<i8'), ('name','<i4'), ('subject','<i4'),
+                        ('result','i1'), ('stage','i1'),
+                        ('clicks_start','<i8'), ('clicks_count','<i4')])
+
+# ======================================================================
+
+class EventLog(object):
+    """
+    NAME
+        EventLog
+
+    PURPOSE
+        Record every classification digested by SWAP in a compact,
+        append-only binary log - and replay it later, as if it were
+        a database.
+
+    COMMENTS
+        An EventLog is a directory containing:
+
+          events.bin      One fixed-width record per classification:
+                            time, name code, subject code, result,
+                            stage, and where its clicks are
+          clicks.bin      The (x,y) click positions, as float64 pairs
+          names.txt       The Names, one per line: line n is code n
+          subjects.txt    The subjects' metadata (ID, ZooID, category,
+                            kind, flavor, truth, location), as one
+                            JSON list of strings per line: line n is
+                            code n
+
+        Results are coded as in swap.Record (LENS = 1, NOT = 0).
+
+        All four files are only ever appended to. New records are
+        buffered, and written out by EventLog.flush(): the tables and
+        clicks go first, and the events last, so a log that was cut
+        short can still be read.
+
+        To replay a log, set "dbspecies: Log" and "eventlog: <dir>" in
+        the config file. An EventLog has the same find() and digest()
+        interface as MongoDB and ToyDB, so SWAP can then be re-run with
+        a different prior, skepticism, thresholds and so on, without
+        any database at all. Classifications are logged after the
+        result has been decided, so replays can't change
+        use_marker_positions.
+
+    INITIALISATION
+        dirname       The log directory (created if it does not exist)
+
+    METHODS AND VARIABLES
+        EventLog.append(record)     Log the Record from a digest()
+        EventLog.flush()            Write buffered records to disk
+        EventLog.find(word,t,...)   Events 'since' or 'before' time t
+        EventLog.digest(event,...)  The Record for an event
+        EventLog.subject_of(event)  The ID of an event's subject
+        EventLog.size()             No. of events in the log
+        EventLog.truncate(N)        Cut it back to the first N
+
+    BUGS
+        - Times are only stored to the nearest second (as are the
+          digested Records' times, in any case).
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,dirname):
+
+        self.dirname = dirname
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        # Tidy up after any write that was cut short, and then read in
+        # the tables, and index them:
+        self.repair()
+        self.names = self.read_table('names.txt',json_lines=False)
+        self.subjects = self.read_table('subjects.txt',json_lines=True)
+        self.name_codes = dict([(Name,i) for i,Name in enumerate(self.names)])
+        self.subject_codes = dict([(subject[0],i) for i,subject in enumerate(self.subjects)])
+        self.coded_subjects = [self.code_subject(subject) for subject in self.subjects]
+
+        # Events are only read in when needed:
+        self.events = None
+        self.clicks = None
+        if os.path.exists(self.path('clicks.bin')):
+            self.Nclicks = os.path.getsize(self.path('clicks.bin'))/16
+        else:
+            self.Nclicks = 0
+
+        # Buffers for new records:
+        self.new_names = []
+        self.new_subjects = []
+        self.new_clicks = []
+        self.new_events = []
+        self.buffersize = 100000
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'event log of %d classifications' % (self.size())
+
+    def path(self,filename):
+        return os.path.join(self.dirname,filename)
+
+# ----------------------------------------------------------------------------
+# Cut each file back to its last complete record or line, so that new
+# records are appended in the right place:
+
+    def repair(self):
+
+        for filename,width in [('events.bin',event_dtype.itemsize),('clicks.bin',16)]:
+            if os.path.exists(self.path(filename)):
+                size = os.path.getsize(self.path(filename))
+                if size % width != 0:
+                    F = open(self.path(filename),'r+b')
+                    F.truncate(size - size % width)
+                    F.close()
+
+        for filename in ['names.txt','subjects.txt']:
+            if os.path.exists(self.path(filename)):
+                F = open(self.path(filename),'r+b')
+                contents = F.read()
+                if not contents.endswith('\n'):
+                    F.truncate(contents.rfind('\n')+1)
+                F.close()
+
+        return
+
+# ----------------------------------------------------------------------------
+# Read one of the tables: a list of names, or of subjects' metadata:
+
+    def read_table(self,filename,json_lines=False):
+
+        table = []
+        if os.path.exists(self.path(filename)):
+            F = open(self.path(filename),'r')
+            for line in F:
+                if json_lines:
+                    table.append([str(item) for item in json.loads(line)])
+                else:
+                    table.append(line[:-1])
+            F.close()
+
+        return table
+
+# ----------------------------------------------------------------------------
+# A subject's metadata, with its category, kind and truth coded as in a
+# Record:
+
+    def code_subject(self,subject):
+
+        ID,ZooID,category,kind,flavor,truth,location = subject
+
+        return ID,ZooID,category_codes[category],kind_codes[kind],flavor,result_codes[truth],location
+
+# ----------------------------------------------------------------------------
+# Read in all the events, ignoring any incomplete record at the end:
+
+    def read_events(self):
+
+        self.flush()
+
+        if os.path.exists(self.path('events.bin')):
+            N = os.path.getsize(self.path('events.bin'))/event_dtype.itemsize
+            self.events = np.fromfile(self.path('events.bin'),dtype=event_dtype,count=N)
+            self.clicks = np.fromfile(self.path('clicks.bin'),dtype=float).reshape(-1,2)
+        else:
+            self.events = np.zeros(0,dtype=event_dtype)
+            self.clicks = np.zeros([0,2])
+
+        return
+
+# ----------------------------------------------------------------------------
+# Log the Record returned by MongoDB.digest (or ToyDB.digest):
+
+    def append(self,record):
+
+        if record.Name not in self.name_codes:
+            self.name_codes[record.Name] = len(self.names)
+            self.names.append(record.Name)
+            self.new_names.append(record.Name)
+
+        if record.ID not in self.subject_codes:
+            subject = [record.ID,record.ZooID,record.category_name,record.kind_name,record.flavor,record.truth_name,record.location]
+            self.subject_codes[record.ID] = len(self.subjects)
+            self.subjects.append(subject)
+            self.coded_subjects.append(self.code_subject(subject))
+            self.new_subjects.append(subject)
+
+        N = min(len(record.at_x),len(record.at_y))
+        self.new_clicks.append(np.array([record.at_x[:N],record.at_y[:N]],dtype=float).T)
+
+        t = calendar.timegm(record.t.timetuple())
+        self.new_events.append((t,self.name_codes[record.Name],self.subject_codes[record.ID],record.result,record.stage,self.Nclicks,N))
+        self.Nclicks += N
+
+        if len(self.new_events) >= self.buffersize: self.flush()
+
+        return
+
+# ----------------------------------------------------------------------------
+# Write out the buffered records: tables and clicks first, events last.
+
+    def flush(self):
+
+        if len(self.new_events) == 0:
+            return
+
+        F = open(self.path('names.txt'),'a')
+        for Name in self.new_names:
+            F.write(Name+'\n')
+        F.close()
+
+        F = open(self.path('subjects.txt'),'a')
+        for subject in self.new_subjects:
+            F.write(json.dumps(subject)+'\n')
+        F.close()
+
+        F = open(self.path('clicks.bin'),'ab')
+        for clicks in self.new_clicks:
+            clicks.tofile(F)
+        F.close()
+
+        F = open(self.path('events.bin'),'ab')
+        np.array(self.new_events,dtype=event_dtype).tofile(F)
+        F.close()
+
+        self.new_names = []
+        self.new_subjects = []
+        self.new_clicks = []
+        self.new_events = []
+        self.events = None
+
+        return
+
+# ----------------------------------------------------------------------------
+# Return the events made 'since' or 'before' time t, in order of time,
+# and then of when they were logged. Each event is just its position in
+# the log. Given the key of the last event done, (time, position) as
+# from swap.read_key(), 'since' carries on straight after it instead.
+
+    def find(self,word,t,after=None):
+
+        if self.events is None: self.read_events()
+
+        seconds = calendar.timegm(t.timetuple())
+        if word == 'since' and after is not None:
+            seconds,event = calendar.timegm(after[0].timetuple()),int(after[1])
+            later = (self.events['t'] > seconds) | ((self.events['t'] == seconds) & (np.arange(len(self.events)) > event))
+            batch = np.where(later)[0]
+        elif word == 'since':
+            batch = np.where(self.events['t'] > seconds)[0]
+        elif word == 'before':
+            batch = np.where(self.events['t'] < seconds)[0]
+        else:
+            print "EventLog: error, cannot find classifications '"+word+"' "+str(t)
+
+        # (The events are usually in time order already, and the sort
+        # is stable.)
+        batch = batch[np.argsort(self.events['t'][batch],kind='mergesort')]
+
+        return iter(batch)
+
+# ----------------------------------------------------------------------------
+# Return the same Record that MongoDB.digest returned when this event
+# was logged:
+
+    def digest(self,event,survey,method=False):
+
+        if self.events is None: self.read_events()
+
+        t,name,subject,result,stage,start,N = self.events[event]
+        ID,ZooID,category,kind,flavor,truth,location = self.coded_subjects[subject]
+        clicks = self.clicks[start:start+N]
+
+        t = datetime.datetime.utcfromtimestamp(t)
+
+        return Record(t,self.names[name],ID,ZooID,category,kind,flavor,int(result),truth,location,int(stage),clicks[:,0].copy(),clicks[:,1].copy(),(t,int(event)))
+
+# ----------------------------------------------------------------------------
+# The ID of an event's subject, without making its Record:
+
+    def subject_of(self,event):
+        return self.subjects[self.events['subject'][event]][0]
+
+# ----------------------------------------------------------------------------
+
+    def size(self):
+
+        N = len(self.new_events)
+        if os.path.exists(self.path('events.bin')):
+            N += os.path.getsize(self.path('events.bin'))/event_dtype.itemsize
+
+        return N
+
+# ----------------------------------------------------------------------------
+# Cut the log back to its first N events, as it was when the state SWAP
+# is carrying on from was saved, so that classifications done again are
+# not logged twice. (The names, subjects and clicks of the events cut
+# are left where they are: later events just don't use them, or use
+# them again.)
+
+    def truncate(self,N):
+
+        self.flush()
+        if self.size() > N:
+            F = open(self.path('events.bin'),'r+b')
+            F.truncate(N*event_dtype.itemsize)
+            F.close()
+            self.events = None
+
+        return
+
+# ======================================================================
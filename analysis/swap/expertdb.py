@@ -3,6 +3,7 @@
 import numpy as np
 import os,sys,datetime
 
+from record import make_record
 
 # Hard-coded for all Space Warps datasets:
 testGroup = '5154a3783ae74086ab000001'
@@ -72,22 +73,22 @@ class ExpertDB(object):
 # Return a batch of classifications, defined by a time range - either
 # claasifications made 'since' t, or classifications made 'before' t:
 
-    def find(self,word,t):
+    def find(self,word,t,after=None):
 
         # TODO: let's just return all the classifications for now
 
         return self.classifications
 
 # ----------------------------------------------------------------------------
-# Return a tuple of the key quantities, given a cursor pointing to a
-# record in the classifications table:
+# Return a Record of the key quantities, given a row of the
+# classifications table:
 
     def digest(self,classification,survey,method=False):
         """
-        items = db.digest(classification,survey,method=use_marker_positions)
-tstring,Name,ID,ZooID,category,kind,flavor,X,Y,location,classification_stage,at_x,at_y = items
+        record = db.digest(classification,survey,method=use_marker_positions)
+        t,Name,ID,ZooID,category,kind,flavor,result,truth,location,stage,at_x,at_y,key = record
 
-items = t.strftime('%Y-%m-%d_%H:%M:%S'),str(Name),str(ID),str(ZooID),category,kind,flavor,result,truth,str(location),str(classification_stage),str(annotation_x),str(annotation_y)
+        See swap.Record for the types of the fields.
         """
 
         # When was the classification made? TODO: Assume it's just some time.
@@ -127,10 +128,7 @@ items = t.strftime('%Y-%m-%d_%H:%M:%S'),str(Name),str(ID),str(ZooID),category,ki
         # UNKNOWN
         truth = 'UNKNOWN'
 
-        items = t.strftime('%Y-%m-%d_%H:%M:%S'),str(Name),str(ID),str(ZooID),category,kind,flavor,result,truth,str(location),str(classification_stage),str(annotation_x),str(annotation_y)
-        if len(items) != 13: print "MongoDB: digest failed: ",items[:] 
-
-        return items[:]
+        return make_record(t,str(Name),str(ID),str(ZooID),category,kind,flavor,result,truth,str(location),classification_stage,annotation_x,annotation_y)
 
 # ----------------------------------------------------------------------------
 # Return the size of the classification table:
@@ -173,9 +171,9 @@ if __name__ == '__main__':
 
         if count == total: print classification
 
-        # Check we got all 9 items:
+        # Check we got all 14 items:
         if items is not None:
-            if len(items) != 9:
+            if len(items) != 14:
                 print "oops! ",items[:]
             else:
                 # Count classifications
@@ -0,0 +1,241 @@
+# ======================================================================
+
+import numpy as np
+
+# ======================================================================
+
+class Buffer(object):
+    """
+    NAME
+        Buffer
+
+    PURPOSE
+        A growable 1-D array, for accumulating histories.
+
+    COMMENTS
+        Appending to a numpy array with np.append copies the whole
+        array every time, so building up a history of N entries costs
+        O(N^2). A Buffer keeps some spare capacity at the end of its
+        array, and doubles it whenever it runs out, so that appending
+        is O(1) on average. Buffer.view() returns the entries so far,
+        as a read-only array (which is not copied).
+
+        Strings, and entries that are themselves lists (like the click
+        positions in a subject's annotationhistory), are stored with
+        dtype=object.
+
+    INITIALISATION
+        dtype, optional initial values
+
+    METHODS
+        Buffer.append(value)     Add one entry
+        Buffer.extend(values)    Add several entries
+        Buffer.view()            The entries so far, read-only
+        Buffer.wrap(data)        A full Buffer holding an existing array
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,dtype=float,values=(),capacity=16):
+
+        self.length = 0
+        self.data = np.empty(max(capacity,len(values)),dtype=dtype)
+        self.extend(values)
+
+        return None
+
+# ----------------------------------------------------------------------
+# Make a full Buffer out of an existing array, without copying it (the
+# array is copied as soon as anything is appended):
+
+    @staticmethod
+    def wrap(data):
+        buffer = Buffer.__new__(Buffer)
+        buffer.data = data
+        buffer.length = len(data)
+        return buffer
+
+# ----------------------------------------------------------------------
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return 'history buffer of %d entries' % self.length
+
+# ----------------------------------------------------------------------
+# Pickle only the entries, not the spare capacity:
+
+    def __getstate__(self):
+        return {'length':self.length, 'data':np.array(self.data[:self.length])}
+
+# ----------------------------------------------------------------------
+# Make sure there is room for another n entries:
+
+    def reserve(self,n):
+
+        if self.length + n > len(self.data):
+            capacity = max(2*len(self.data),self.length+n,16)
+            data = np.empty(capacity,dtype=self.data.dtype)
+            data[:self.length] = self.data[:self.length]
+            self.data = data
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def append(self,value):
+
+        self.reserve(1)
+        self.data[self.length] = value
+        self.length += 1
+
+        return
+
+    def extend(self,values):
+
+        n = len(values)
+        self.reserve(n)
+        if self.data.dtype == object:
+            # Assign one at a time, so that list entries are not unpacked:
+            for k,value in enumerate(values):
+                self.data[self.length+k] = value
+        else:
+            self.data[self.length:self.length+n] = values
+        self.length += n
+
+        return
+
+# ----------------------------------------------------------------------
+
+    def view(self):
+
+        entries = self.data[:self.length]
+        entries.flags.writeable = False
+
+        return entries
+
+# ======================================================================
+
+class History(object):
+    """
+    NAME
+        History
+
+    PURPOSE
+        A dictionary of Buffers, one per field, that grow together.
+
+    COMMENTS
+        Agents' training and test histories, and subjects' annotation
+        histories, are Histories. history[key] returns the entries so
+        far, as a read-only array, so code that reads histories does not
+        need to change. New entries are added with history.append(),
+        one value per field, or history.extend(), one array per field.
+        Assigning history[key] = values replaces that field's entries.
+
+        Old pickles contain plain dictionaries of arrays and lists:
+        History.migrate() converts them.
+
+    INITIALISATION
+        fields       List of (key,dtype) pairs
+        values       Optional dictionary of initial values for each key
+
+    METHODS
+        History.append(key=value,...)     Add one entry to each field
+        History.extend(key=values,...)    Add several entries to each field
+        History.migrate(old,fields)       Convert an old dictionary
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,fields,values={}):
+
+        self.buffers = {}
+        for key,kind in fields:
+            self.buffers[key] = Buffer(dtype=kind,values=values.get(key,()))
+
+        return None
+
+# ----------------------------------------------------------------------
+
+    def __str__(self):
+        return 'history of %s' % (', '.join(sorted(self.buffers.keys())))
+
+# ----------------------------------------------------------------------
+# Dictionary-like access to the fields:
+
+    def __getitem__(self,key):
+        return self.buffers[key].view()
+
+    def __setitem__(self,key,values):
+        if key in self.buffers:
+            kind = self.buffers[key].data.dtype
+        else:
+            kind = object
+        self.buffers[key] = Buffer(dtype=kind,values=values)
+
+    def __contains__(self,key):
+        return key in self.buffers
+
+    def __iter__(self):
+        return iter(self.buffers)
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def keys(self):
+        return self.buffers.keys()
+
+    def has_key(self,key):
+        return key in self.buffers
+
+    def get(self,key,default=None):
+        if key in self.buffers:
+            return self[key]
+        return default
+
+    def items(self):
+        return [(key,self[key]) for key in self.buffers]
+
+# ----------------------------------------------------------------------
+
+    def append(self,**values):
+        for key in values:
+            self.buffers[key].append(values[key])
+        return
+
+    def extend(self,**values):
+        for key in values:
+            self.buffers[key].extend(values[key])
+        return
+
+# ----------------------------------------------------------------------
+# Convert a history read from an old pickle, if necessary:
+
+    @staticmethod
+    def migrate(old,fields):
+        if old is None or isinstance(old,History):
+            return old
+        return History(fields,values=old)
+
+# ======================================================================
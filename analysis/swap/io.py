@@ -20,12 +20,17 @@ import os,cPickle,numpy as np
 
         read_pickle(filename):
 
+        (Filenames ending in .snapshot are snapshot directories: see
+        snapshot.py.)
+
         write_list(sample, filename, item=None):
         
         read_list(filename):
      
         write_catalog(sample, filename, thresholds, kind=kind):
 
+        write_em_trace(trace, filename):
+
         rm(filename):
 
     BUGS
@@ -49,6 +54,12 @@ import os,cPickle,numpy as np
 
 def read_pickle(filename,flavour):
 
+    # Bureaux and collections may have been saved as snapshots instead:
+    if swap.is_snapshot(filename):
+        contents = swap.read_snapshot(filename,flavour)
+        print "SWAP: read an old",contents,"from snapshot "+filename
+        return contents
+
     try:
         F = open(filename,"rb")
         contents = cPickle.load(F)
@@ -71,7 +82,7 @@ def read_pickle(filename,flavour):
             contents = swap.Collection()
             print "SWAP: made a new",contents
 
-        elif flavour == 'database':
+        elif flavour == 'database' or flavour == 'offline':
             contents = None
 
     return contents
@@ -81,9 +92,17 @@ def read_pickle(filename,flavour):
 
 def write_pickle(contents,filename):
 
-    F = open(filename,"wb")
+    # Bureaux and collections can be saved as snapshots instead:
+    if filename.endswith('.snapshot'):
+        swap.write_snapshot(contents,filename)
+        return
+
+    # Via a temporary file, so that the old one is only replaced by a
+    # complete new one:
+    F = open(filename+'.tmp',"wb")
     cPickle.dump(contents,F,protocol=2)
     F.close()
+    os.rename(filename+'.tmp',filename)
 
     return
 
@@ -92,6 +111,10 @@ def write_pickle(contents,filename):
 
 def write_list(sample, filename, item=None):
 
+    # Array-backed collections can select the subjects from their columns:
+    if isinstance(sample,swap.ArrayCollection):
+        return write_list_from_columns(sample, filename, item=item)
+
     count = 0
     F = open(filename,'w')
     for ID in sample.list():
@@ -131,6 +154,50 @@ def write_list(sample, filename, item=None):
 
     return count
 
+# ----------------------------------------------------------------------------
+# The subjects to be listed, as (key, kind, status, state) for each item:
+
+list_selections = {'retired_subject': ('ZooID', 'Any', 'Any', 'inactive'),
+                   'candidate': ('location', 'test', 'detected', 'Any'),
+                   'true_positive': ('location', 'sim', 'detected', 'Any'),
+                   'false_positive': ('location', 'dud', 'detected', 'Any'),
+                   'true_negative': ('location', 'dud', 'rejected', 'Any'),
+                   'false_negative': ('location', 'sim', 'rejected', 'Any')}
+
+def write_list_from_columns(sample, filename, item=None):
+
+    count = 0
+    F = open(filename,'w')
+    if item in list_selections:
+        key,kind,status,state = list_selections[item]
+        for i in sample.select(kind=kind,status=status,state=state):
+            string = sample.lists[key][i]
+            if string is not None:
+                F.write('%s\n' % string)
+                count += 1
+    F.close()
+
+    return count
+
+# ----------------------------------------------------------------------------
+# Write out the ZooIDs of the subjects retired since the sample's
+# transitions log was last cleared (see swap.Transitions), and clear it.
+# Returns the changes, as Transitions.changes() does:
+
+def write_retirement_feed(sample, filename):
+
+    changes = sample.transitions.changes(sample)
+
+    F = open(filename+'.tmp','w')
+    for ID in changes['retired']:
+        F.write('%s\n' % sample.member[ID].ZooID)
+    F.close()
+    os.rename(filename+'.tmp',filename)
+
+    sample.transitions.clear()
+
+    return changes
+
 # ----------------------------------------------------------------------------
 # Read in a simple list of string items.
 
@@ -149,6 +216,16 @@ def write_catalog(sample, filename, thresholds, kind='test'):
     F = open(filename,'w')
     F.write('%s\n' % "# zooid     P          Nclass  image")
 
+    # Array-backed collections can select the candidates from their columns:
+    if isinstance(sample,swap.ArrayCollection):
+        rows = sample.rows()
+        P = sample.columns['mean_probability'][rows]
+        for i in sample.select(kind=kind,rows=rows[P > thresholds['rejection']]):
+            F.write('%s  %9.7f  %s       %s\n' % (sample.lists['ZooID'][i],sample.columns['mean_probability'][i],str(sample.columns['exposure'][i]),sample.lists['location'][i]))
+            Nlenses += 1
+        F.close()
+        return Nlenses,len(rows)
+
     for ID in sample.list():
         subject = sample.member[ID]
         P = subject.mean_probability
@@ -169,6 +246,19 @@ def write_catalog(sample, filename, thresholds, kind='test'):
 
     return Nlenses,Nsubjects
 
+# ----------------------------------------------------------------------------
+# Write out the offline EM convergence trace, one line per iteration.
+
+def write_em_trace(trace, filename):
+
+    F = open(filename,'w')
+    F.write('%s\n' % "# iteration  steps  epsilon    loglikelihood    seconds   update")
+    for iteration,steps,epsilon,loglikelihood,seconds,update in trace:
+        F.write('%9d  %5d  %9.3e  %15.6f  %8.3f   %s\n' % (iteration,steps,epsilon,loglikelihood,seconds,update))
+    F.close()
+
+    return len(trace)
+
 # ----------------------------------------------------------------------------
 # Make up a new filename, based on tonight's parameters:
 
@@ -181,22 +271,28 @@ def get_new_filename(pars,flavour):
     if flavour == 'bureau' or \
          flavour == 'collection' or \
          flavour == 'database' or \
+         flavour == 'subject_cache' or \
          flavour == 'offline':
         stem = pars['survey']+'_'+flavour
         ext = 'pickle'
         folder = '.'
+        # Agents and subjects can be saved as snapshots instead:
+        if flavour in ['bureau','collection'] and pars.get('state_format') == 'snapshot':
+            ext = 'snapshot'
     elif flavour == 'histories' or \
          flavour == 'trajectories' or \
          flavour == 'sample' or \
          flavour == 'probabilities':
         ext = 'png'
         folder = pars['dir']
-    elif flavour == 'retire_these':
+    elif flavour == 'retire_these' or \
+         flavour == 'retirement_feed':
         ext = 'txt'
         folder = pars['dir']
     elif flavour == 'candidate_catalog' or \
          flavour == 'sim_catalog' or \
-         flavour == 'dud_catalog':
+         flavour == 'dud_catalog' or \
+         flavour == 'EM_trace':
         ext = 'txt'
         folder = pars['dir']
     elif flavour == 'candidates' or \
@@ -212,11 +308,12 @@ def get_new_filename(pars,flavour):
     return folder+'/'+stem+'.'+ext
 
 # ----------------------------------------------------------------------------
-# Write configuration file given a dictionary of parameters:
+# Write configuration file given a dictionary of parameters (via a
+# temporary file, so that it is never left half-written):
 
 def write_config(filename, pars):
 
-    F = open(filename,'w')
+    F = open(filename+'.tmp','w')
 
     header = """
 # ======================================================================
@@ -240,6 +337,7 @@ def write_config(filename, pars):
 
     shortlist = ['survey', \
                  'start', \
+                 'start_key', \
                  'end', \
                  'bureaufile', \
                  'samplefile', \
@@ -261,12 +359,39 @@ def write_config(filename, pars):
                  'detection_threshold', \
                  'rejection_threshold', \
                  'random_file', \
+                 'random_seed', \
                  'dbspecies', \
+                 'dbfile', \
+                 'toy_rate', \
                  'offline', \
+                 'n_workers', \
+                 'N_min', \
+                 'N_max', \
+                 'epsilon_min', \
+                 'EM_acceleration', \
+                 'incremental', \
+                 'offlinefile', \
                  'prior', \
+                 'engine', \
+                 'N_per_chunk', \
+                 'N_shards', \
+                 'N_per_sync', \
+                 'bureau_backend', \
+                 'collection_backend', \
+                 'state_format', \
+                 'checkpoints', \
+                 'trajectory', \
+                 'trajectory_store', \
+                 'eventlog', \
+                 'eventlog_size', \
+                 'subject_cache', \
+                 'N_per_query', \
+                 'N_digest_workers', \
                  ]
 
     for keyword in shortlist:
+        # Optional parameters may not have been set:
+        if keyword not in pars: continue
         F.write('\n')
         F.write('%s: %s\n' % (keyword,str(pars[keyword])))
 
@@ -275,6 +400,7 @@ def write_config(filename, pars):
     F.write(footer)
 
     F.close()
+    os.rename(filename+'.tmp',filename)
 
     return
 
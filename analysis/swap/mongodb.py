@@ -1,9 +1,13 @@
 # ======================================================================
 
 import numpy as np
-import os,sys,datetime
+import os,sys,datetime,cPickle
 
-try: from pymongo import MongoClient
+from record import make_record
+
+try:
+    from pymongo import MongoClient
+    from bson.objectid import ObjectId
 except:
     print "MongoDB: pymongo is not installed. You can still --practise though"
     # sys.exit()
@@ -11,6 +15,18 @@ except:
 # Hard-coded for all Space Warps datasets:
 testGroup = '5154a3783ae74086ab000001'
 trainingGroup = '5154a3783ae74086ab000002'
+
+# The only subject fields that digest() needs:
+subject_projection = {'group_id': 1, 'metadata.training': 1, 'location.standard': 1}
+
+# ...and the only classification fields:
+classification_projection = {'updated_at': 1, 'user_id': 1, 'user_ip': 1,
+                             'subjects.id': 1, 'subjects.zooniverse_id': 1,
+                             'annotations': 1}
+
+# find() hands out classifications in this order, which needs an index
+# (see utils/index_mongo.py):
+classification_index = [('updated_at',1),('_id',1)]
     
 # ======================================================================
 
@@ -42,11 +58,46 @@ class MongoDB(object):
         Pr(LENS|d) updated using these matrices.
 
 
+        digest() needs a few fields from each classification's subject.
+        Rather than asking the Mongo for them one classification at a
+        time, we keep a cache of every subject's group_id,
+        metadata.training and location.standard. The first find()
+        preloads all the subjects with a single projected query; after
+        that, find() looks up any subjects missing from the cache in
+        batches, with one $in query per N_lookup classifications. The
+        cache is pickled to the cachefile by save_subject_cache(), so
+        that SWAPSHOP batches can carry on using it. Subjects that are
+        not in the subject table are cached too, as None, so that they
+        are only looked for once.
+
+        find() only asks for the classification fields that digest()
+        uses, sorted by updated_at and then _id, and batch_size at a
+        time. Given the key of the last classification done (see
+        swap.Record), it carries on from the one after it - updated_at
+        later, or the same and _id greater - so that no classification
+        at a batch boundary is lost, or done twice. The sort needs an
+        index on the classifications: make it once, after each
+        mongorestore, with utils/index_mongo.py (SWIPE.csh does). If it
+        is not there, MongoDB says so, and find() is slow - it is not
+        made on the fly, as building it can take a long time, and write
+        access.
+
+        digest() returns a swap.Record, with the time as a datetime,
+        the stage as an integer, the category, kind, result and truth
+        as integer codes, and the clicks as float arrays.
+
     INITIALISATION
-        
-    
+        cachefile     Optional subject cache pickle (default None)
+        batch_size    No. of classifications per round trip (default 1000)
+
     METHODS AND VARIABLES
-        ToyDB.get_classification()
+        MongoDB.find(word,t,after=None)
+        MongoDB.digest(classification,survey,method=False)
+        MongoDB.get_subject(ID)
+        MongoDB.subject_of(classification)
+        MongoDB.save_subject_cache()
+        MongoDB.create_index()
+        MongoDB.connect()
         
     BUGS
         - groupIds are hard-coded, and so could go wrong any time.
@@ -60,13 +111,42 @@ class MongoDB(object):
     HISTORY
       2013-04-18  Started: Marshall (Oxford)
       2013-04-23  Correct Mongo calls supplied: Kapadia (Adler) 
+      2026-10-18  Subject metadata cache; projected, sorted find.
+      2026-10-18  find() resumes from an (updated_at, _id) key.
     """
 
 # ----------------------------------------------------------------------------
 
-    def __init__(self):
-        
-        # Connect to the Mongo:
+    def __init__(self,cachefile=None,batch_size=1000):
+
+        self.connect()
+
+        # Without the index, every find() has to sort the whole table:
+        if not self.indexed():
+            print "MongoDB: warning: the classifications are not indexed by updated_at and _id, so they will be slow to sort"
+            print "MongoDB: make the index with utils/index_mongo.py"
+
+        # Read in the subject cache, if there is one:
+        self.cachefile = cachefile
+        self.subject_cache = {}
+        if cachefile is not None and os.path.exists(cachefile):
+            F = open(cachefile,'rb')
+            self.subject_cache = cPickle.load(F)
+            F.close()
+            print "MongoDB: read",len(self.subject_cache),"subjects from cache "+cachefile
+        self.N_lookup = 1000
+
+        # How many classifications to ask the Mongo for at a time:
+        self.batch_size = batch_size
+
+        return None
+
+# ----------------------------------------------------------------------------
+# Connect to the Mongo - again, in a new process (see swap.digested),
+# as a connection can't be shared with one:
+
+    def connect(self):
+
         try: self.client = MongoClient('localhost', 27017)
         except: 
             print "MongoDB: couldn't connect to the Mongo"
@@ -83,214 +163,166 @@ class MongoDB(object):
         # Set up tables of subjects, and classifications: 
         self.subjects = self.db['spacewarp_subjects']
         self.classifications = self.db['spacewarp_classifications']
-        
-        return None
+
+        return
 
 # ----------------------------------------------------------------------------
 # Return a batch of classifications, defined by a time range - either 
-# claasifications made 'since' t, or classifications made 'before' t:
-
-    def find(self,word,t):
-
-       if word == 'since':
-            batch = self.classifications.find({'updated_at': {"$gt": t}},timeout=False)
+# claasifications made 'since' t, or classifications made 'before' t.
+# Given the key of the last classification done, (updated_at, _id) as
+# from swap.read_key(), 'since' carries on straight after it instead:
+
+    def find(self,word,t,after=None):
+
+       # Only ask for the fields that digest() needs, in time order (so
+       # that SWAP can stop as soon as it passes its end time, and carry
+       # on from there), and batch_size at a time:
+       if word == 'since' and after is not None:
+            t,_id = after[0],ObjectId(after[1])
+            batch = self.classifications.find({'$or': [{'updated_at': {"$gt": t}},
+                                                       {'updated_at': t, '_id': {"$gt": _id}}]},
+                                              classification_projection,timeout=False)
+
+       elif word == 'since':
+            batch = self.classifications.find({'updated_at': {"$gt": t}},classification_projection,timeout=False)
        
        elif word == 'before':
-            batch = self.classifications.find({'updated_at': {"$lt": t}},timeout=False)
+            batch = self.classifications.find({'updated_at': {"$lt": t}},classification_projection,timeout=False)
        
        else:
            print "MongoDB: error, cannot find classifications '"+word+"' "+str(t)
 
-       return batch
+       batch = batch.sort(classification_index).batch_size(self.batch_size)
+
+       # Make sure we know about the classifications' subjects before
+       # they are digested:
+       if len(self.subject_cache) == 0:
+           self.preload_subjects()
+
+       return self.looking_ahead(batch)
 
 # ----------------------------------------------------------------------------
-# Return a tuple of the key quantities, given a cursor pointing to a 
-# record in the classifications table:
+# Is there an index for find() to sort the classifications with? And
+# make one, if not:
 
-    def digest(self,classification,survey,method=False):
-        
-        # When was this classification made?
-        t = classification['updated_at']
-        
-        # Who made the classification?
-        
-        # The classification will be identified by either the user_id or
-        # the user_ip.  The value will be abstracted into the variable
-        # Name.
-        
-        # Not all records have all keys.  For instance, classifications 
-        # from anonymous users will not have a user_id key. We must 
-        # check that the key exists, and if so, get the value.
-        
-        if classification.has_key('user_id'):
-            Name = classification['user_id']
-        
-        else:
-            # If there is no user_id, get the ip address...
-            # I think we're safe with user_ip.  All records should have 
-            # this field. Check the key if you're worried. 
-            Name = classification['user_ip']
-        
-        # Pull out the subject that was classified. Note that by default
-        # Zooniverse subjects are stored as lists, because they can 
-        # oontain multiple images. 
-        
-        subjects = classification['subjects']
-        
-        # Ignore the empty lists (eg the first tutorial subject...)
-        if len(subjects) == 0:
-            return None
-        
-        # Get the subject ID, and also its Zooniverse ID:
-        for subject in subjects:
-            ID = subject['id']
-            ZooID = subject['zooniverse_id']
-        
-        # Pull out the annotations and get the stage the classification was made at:
-        annotations = classification['annotations']
-        
-        classification_stage = 1
-        for annotation in annotations:
-            if annotation.has_key('stage'):
-                classification_stage = annotation['stage']
-        
-        # Also get the survey name!
-        project = "CFHTLS"
-        for annotation in annotations:
-            if annotation.has_key('project'):
-                project = annotation['project']
-        
-        # Check project: ignore this classification by returning None 
-        # if classification is from a different project:
-        if project != survey:
-            # print "Fail! A classification from "+project+" ( != "+survey+" ), stage = ",classification_stage
-            return None
-        # else:
-            # Success! A classification from "+project+" ( = "+survey+" ), stage = ",classification_stage
-        
-        # Now pull the subject itself from the subject table:
-        subject = self.subjects.find_one({'_id': ID},timeout=False)
-        
-        # Was it a training subject or a test subject?
-        if subject.has_key('group_id'):
-            groupId = subject['group_id']
+    def indexed(self):
+
+        for index in self.classifications.index_information().values():
+            if [(key,int(direction)) for key,direction in index['key']] == classification_index:
+                return True
+
+        return False
+
+    def create_index(self):
+
+        if self.indexed():
+            print "MongoDB: the classifications are already indexed by updated_at and _id"
         else:
-            # Subject is tutorial and has no group id:
+            print "MongoDB: indexing the classifications by updated_at and _id..."
+            self.classifications.create_index(classification_index)
+            print "MongoDB: done"
+
+        return
+
+# ----------------------------------------------------------------------------
+# Read every subject's metadata into the cache, with one query:
+
+    def preload_subjects(self):
+
+        for subject in self.subjects.find({},subject_projection,timeout=False):
+            self.subject_cache[subject['_id']] = subject
+
+        print "MongoDB: preloaded",len(self.subject_cache),"subjects into the cache"
+
+        return
+
+# ----------------------------------------------------------------------------
+# Look up a list of subjects that are not in the cache, in batches.
+# Those that are not in the subject table either are cached as None:
+
+    def fetch_subjects(self,IDs):
+
+        IDs = [ID for ID in set(IDs) if ID not in self.subject_cache]
+        for k in range(0,len(IDs),self.N_lookup):
+            for subject in self.subjects.find({'_id': {'$in': IDs[k:k+self.N_lookup]}},subject_projection,timeout=False):
+                self.subject_cache[subject['_id']] = subject
+        for ID in IDs:
+            self.subject_cache.setdefault(ID,None)
+
+        return
+
+# ----------------------------------------------------------------------------
+# Pass on the classifications from a cursor, N_lookup at a time, first
+# fetching any of their subjects that are not in the cache:
+
+    def looking_ahead(self,batch):
+
+        block = []
+        for classification in batch:
+            block.append(classification)
+            if len(block) == self.N_lookup:
+                self.fetch_subjects([subject['id'] for c in block for subject in c['subjects']])
+                for c in block:
+                    yield c
+                block = []
+
+        self.fetch_subjects([subject['id'] for c in block for subject in c['subjects']])
+        for c in block:
+            yield c
+
+# ----------------------------------------------------------------------------
+# Return a subject's cached metadata (looking it up if necessary), or
+# None if it is not in the subject table:
+
+    def get_subject(self,ID):
+
+        if ID not in self.subject_cache:
+            self.fetch_subjects([ID])
+
+        return self.subject_cache[ID]
+
+# ----------------------------------------------------------------------------
+# Write the subject cache out, for next time:
+
+    def save_subject_cache(self):
+
+        if self.cachefile is None:
+            return
+
+        # Via a temporary file, so that a run that dies part way through
+        # leaves the old cache, not half a new one:
+        F = open(self.cachefile+'.tmp','wb')
+        cPickle.dump(self.subject_cache,F,protocol=2)
+        F.close()
+        os.rename(self.cachefile+'.tmp',self.cachefile)
+        print "MongoDB: saved",len(self.subject_cache),"subjects to cache "+self.cachefile
+
+        return
+
+# ----------------------------------------------------------------------------
+# Return a Record of the key quantities, given a cursor pointing to a 
+# document in the classifications table. The work is done by decode(),
+# below, given the subject's metadata from the cache:
+
+    def digest(self,classification,survey,method=False):
+
+        ID = subject_id(classification)
+        if ID is None:
             return None
-        
-        subject_metadata = subject['metadata']        
-        
-        # Check subject stage:
-        # if subject_metadata.has_key('stage2'):
-        #     if classification_stage == 1: 
-        #         # This happens when the data is uploaded, but the site has
-        #         # not been taken down... Need to ignore these classifications!
-        #         # print "WARNING: classification labelled stage 1, while subject is stage 2!"
-        #         return None
-        
-        # PJM: The above code causes a bug when SWAP is re-run on stage 1 later on!
-        # Commented out, and moved to using timestamps rigorously to delineate 
-        # stage 1 and stage 2, as well as checking classification stage, that is.
-       
-        
-        # What kind of subject was it? Training or test? A sim or a dud?
-        # PJM 2014-08-21 And what flavor of sim is it?
-        kind = ''
-        if str(groupId) == trainingGroup:
-            category = 'training'
-            things = subject_metadata['training']
-            # things is either a list of dictionaries, or in beta, a 
-            # single dictionary:
-            if type(things) == list:
-                thing = things[0]
-            else:
-                thing = things
-            flavor = thing['type']
-            if (flavor == 'lensing cluster' \
-               or flavor == 'lensed galaxy' \
-               or flavor == 'lensed quasar'):
-                kind = 'sim'
-            else:
-                kind = 'dud'
-                flavor = 'dud'
-        else: # It's a test subject:
-            category = 'test'
-            kind = 'test'
-            flavor = 'test'
-                
-        # What's the URL of this image?
-        if subject.has_key('location'):
-            things = subject['location']
-            location = things['standard']
-        else:
-            location = None
-        
-        
-        # What did the volunteer say about this subject?
 
-        # For sims, we really we want to know if the volunteer hit the 
-        # arcs - but this is not yet stored in the database 
-        # (issued 2013-04-23). For now, treat sims by just saying that 
-        # any number of markers placed constitutes a hit.
-        
-        # NB: Not every annotation has an associated coordinate 
-        # (e.g. x, y) - tutorials fail this criterion.
-
-        N_markers = 0
-        simFound = False
-        # CPD 31.5.14: added annotation values
-        annotation_x = []
-        annotation_y = []
-        for annotation in annotations:
-            if annotation.has_key('x'): 
-                N_markers += 1
-                if len(annotation['x']) > 0:
-                    annotation_x.append(float(annotation['x']))
-                    annotation_y.append(float(annotation['y']))
+        return decode(classification,self.get_subject(ID),survey,method=method)
 
-        
-        # Detect whether sim was found or not:
-        if kind == 'sim':
-            if method:
-                # Use the marker positions!
-                for annotation in annotations:
-                    if annotation.has_key('simFound'):
-                        string = annotation['simFound']
-                        if string == 'true': simFound = True
-            else:
-                if N_markers > 0: simFound = True
-        
-        # Now turn indicators into results:
-        if kind == 'sim':
-            if simFound:
-                result = 'LENS'
-            else:
-                result = 'NOT'
-              
-        elif kind == 'test' or kind == 'dud':
-            if N_markers == 0:
-                result = 'NOT'
-            else:
-                result = 'LENS'
-        
-        # And finally, what's the truth about this subject?
-        if kind == 'sim':
-            truth = 'LENS'
-        elif kind == 'dud':
-            truth = 'NOT'
-        else:    
-            truth = 'UNKNOWN'
-          
-        # Testing to see what people do:
-        # print "In db.digest: kind,N_markers,simFound,result,truth = ",kind,N_markers,simFound,result,truth
-        
-        # Check we got all 10 items:            
-        items = t.strftime('%Y-%m-%d_%H:%M:%S'),str(Name),str(ID),str(ZooID),category,kind,flavor,result,truth,str(location),str(classification_stage),str(annotation_x),str(annotation_y)
-        if len(items) != 13: print "MongoDB: digest failed: ",items[:] 
+# ----------------------------------------------------------------------------
+# Return the ID of a classification's subject (as digest() would), or
+# None, without looking the subject up:
+
+    def subject_of(self,classification):
 
-                         
-        return items[:]
+        ID = subject_id(classification)
+        if ID is None:
+            return None
 
+        return str(ID)
 
 # ----------------------------------------------------------------------------
 # Return the size of the classification table:
@@ -327,6 +359,212 @@ class MongoDB(object):
         
         return
 
+# ======================================================================
+# Pull out the ID of the (last) subject in a classification, or None if
+# there are no subjects:
+
+def subject_id(classification):
+
+    ID = None
+    for subject in classification['subjects']:
+        ID = subject['id']
+
+    return ID
+
+# ----------------------------------------------------------------------------
+# Return a Record of the key quantities, given a document from the
+# classifications table, and its subject's record from the subject table
+# (or None). This is pure number-crunching, with no database access, so
+# that it can be done on other processes - see swap.digested().
+
+def decode(classification,subject_record,survey,method=False):
+    
+    # When was this classification made?
+    t = classification['updated_at']
+    
+    # Who made the classification?
+    
+    # The classification will be identified by either the user_id or
+    # the user_ip.  The value will be abstracted into the variable
+    # Name.
+    
+    # Not all records have all keys.  For instance, classifications 
+    # from anonymous users will not have a user_id key. We must 
+    # check that the key exists, and if so, get the value.
+    
+    if classification.has_key('user_id'):
+        Name = classification['user_id']
+    
+    else:
+        # If there is no user_id, get the ip address...
+        # I think we're safe with user_ip.  All records should have 
+        # this field. Check the key if you're worried. 
+        Name = classification['user_ip']
+    
+    # Pull out the subject that was classified. Note that by default
+    # Zooniverse subjects are stored as lists, because they can 
+    # oontain multiple images. 
+    
+    subjects = classification['subjects']
+    
+    # Ignore the empty lists (eg the first tutorial subject...)
+    if len(subjects) == 0:
+        return None
+    
+    # Get the subject ID, and also its Zooniverse ID:
+    for subject in subjects:
+        ID = subject['id']
+        ZooID = subject['zooniverse_id']
+    
+    # Pull out the annotations and get the stage the classification was made at:
+    annotations = classification['annotations']
+    
+    classification_stage = 1
+    for annotation in annotations:
+        if annotation.has_key('stage'):
+            classification_stage = annotation['stage']
+    
+    # Also get the survey name!
+    project = "CFHTLS"
+    for annotation in annotations:
+        if annotation.has_key('project'):
+            project = annotation['project']
+    
+    # Check project: ignore this classification by returning None 
+    # if classification is from a different project:
+    if project != survey:
+        # print "Fail! A classification from "+project+" ( != "+survey+" ), stage = ",classification_stage
+        return None
+    # else:
+        # Success! A classification from "+project+" ( = "+survey+" ), stage = ",classification_stage
+    
+    # The subject's own metadata (from the subject table) was looked up
+    # for us:
+    subject = subject_record
+    
+    # Was it a training subject or a test subject?
+    if subject is None:
+        return None
+    elif subject.has_key('group_id'):
+        groupId = subject['group_id']
+    else:
+        # Subject is tutorial and has no group id:
+        return None
+    
+    subject_metadata = subject.get('metadata',{})
+    
+    # Check subject stage:
+    # if subject_metadata.has_key('stage2'):
+    #     if classification_stage == 1: 
+    #         # This happens when the data is uploaded, but the site has
+    #         # not been taken down... Need to ignore these classifications!
+    #         # print "WARNING: classification labelled stage 1, while subject is stage 2!"
+    #         return None
+    
+    # PJM: The above code causes a bug when SWAP is re-run on stage 1 later on!
+    # Commented out, and moved to using timestamps rigorously to delineate 
+    # stage 1 and stage 2, as well as checking classification stage, that is.
+   
+    
+    # What kind of subject was it? Training or test? A sim or a dud?
+    # PJM 2014-08-21 And what flavor of sim is it?
+    kind = ''
+    if str(groupId) == trainingGroup:
+        category = 'training'
+        things = subject_metadata['training']
+        # things is either a list of dictionaries, or in beta, a 
+        # single dictionary:
+        if type(things) == list:
+            thing = things[0]
+        else:
+            thing = things
+        flavor = thing['type']
+        if (flavor == 'lensing cluster' \
+           or flavor == 'lensed galaxy' \
+           or flavor == 'lensed quasar'):
+            kind = 'sim'
+        else:
+            kind = 'dud'
+            flavor = 'dud'
+    else: # It's a test subject:
+        category = 'test'
+        kind = 'test'
+        flavor = 'test'
+            
+    # What's the URL of this image?
+    if subject.has_key('location'):
+        things = subject['location']
+        location = things['standard']
+    else:
+        location = None
+    
+    
+    # What did the volunteer say about this subject?
+
+    # For sims, we really we want to know if the volunteer hit the 
+    # arcs - but this is not yet stored in the database 
+    # (issued 2013-04-23). For now, treat sims by just saying that 
+    # any number of markers placed constitutes a hit.
+    
+    # NB: Not every annotation has an associated coordinate 
+    # (e.g. x, y) - tutorials fail this criterion.
+
+    N_markers = 0
+    simFound = False
+    # CPD 31.5.14: added annotation values
+    annotation_x = []
+    annotation_y = []
+    for annotation in annotations:
+        if annotation.has_key('x'): 
+            N_markers += 1
+            if len(annotation['x']) > 0:
+                annotation_x.append(float(annotation['x']))
+                annotation_y.append(float(annotation['y']))
+
+    
+    # Detect whether sim was found or not:
+    if kind == 'sim':
+        if method:
+            # Use the marker positions!
+            for annotation in annotations:
+                if annotation.has_key('simFound'):
+                    string = annotation['simFound']
+                    if string == 'true': simFound = True
+        else:
+            if N_markers > 0: simFound = True
+    
+    # Now turn indicators into results:
+    if kind == 'sim':
+        if simFound:
+            result = 'LENS'
+        else:
+            result = 'NOT'
+          
+    elif kind == 'test' or kind == 'dud':
+        if N_markers == 0:
+            result = 'NOT'
+        else:
+            result = 'LENS'
+    
+    # And finally, what's the truth about this subject?
+    if kind == 'sim':
+        truth = 'LENS'
+    elif kind == 'dud':
+        truth = 'NOT'
+    else:    
+        truth = 'UNKNOWN'
+      
+    # Testing to see what people do:
+    # print "In db.digest: kind,N_markers,simFound,result,truth = ",kind,N_markers,simFound,result,truth
+    
+    return make_record(t,str(Name),str(ID),str(ZooID),category,kind,flavor,result,truth,str(location),classification_stage,annotation_x,annotation_y,key=(t,classification['_id']))
+
+# ----------------------------------------------------------------------------
+# Decode a list of (classification, subject record) pairs:
+
+def decode_chunk(work,survey,method=False):
+    return [decode(classification,subject_record,survey,method=method) for classification,subject_record in work]
+
 # ======================================================================
 
 if __name__ == '__main__':
@@ -346,8 +584,8 @@ if __name__ == '__main__':
     print "Whoah! Found ",total," classifications!"
     print "Here's the last one:"
     for classification in db.classifications.find(timeout=False).skip(total-1).limit(1):
-        items = db.digest(classification)
-        print items[:]
+        items = db.digest(classification,'CFHTLS')
+        print items
     
     print "Reading them all one by one, just for fun:"
     
@@ -358,13 +596,13 @@ if __name__ == '__main__':
     count = 0
     for classification in batch:
         
-        items = db.digest(classification)
+        items = db.digest(classification,'CFHTLS')
         
         if count == total: print classification
         
-        # Check we got all 9 items:            
+        # Check we got all 14 items:            
         if items is not None:
-            if len(items) != 9: 
+            if len(items) != 14: 
                 print "oops! ",items[:]
             else:    
                 # Count classifications
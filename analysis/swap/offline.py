@@ -0,0 +1,828 @@
+# ======================================================================
+
+import swap
+
+import numpy as np
+import multiprocessing,time
+from subject import Ntrajectory
+from batch import gather_agents,scatter_agents,gather_subjects,scatter_subjects
+
+# ======================================================================
+
+"""
+    NAME
+        offline
+
+    PURPOSE
+        Run the offline EM analysis on the whole agent x subject
+        classification matrix at once, instead of one
+        Subject.was_described_many_times() and one
+        Agent.heard_many_times() call per subject and agent per step.
+
+    COMMENTS
+        Offline, the classifications don't change from one EM step to
+        the next: only the agents' PL and PD, and the subjects'
+        probabilities, do. So we gather the classifications just once,
+        into a sparse matrix: parallel arrays of agent index, subject
+        index and ItWas (COO format). The E step is then one likelihood
+        per classification, summed into its subject with np.bincount;
+        the M step is four more bincounts, into the agents.
+
+        The E step uses the subjects' annotation histories, leaving out
+        banned agents, as in Subject.was_described_many_times(). The M
+        step uses the agents' training and test histories, as in
+        SWAP.py: supervised, the training subjects' truths;
+        supervised_and_unsupervised, the training subjects' truths (or
+        probabilities, for test subjects) and the test subjects'
+        probabilities; unsupervised, just the test subjects'
+        probabilities.
+
+        Offline, every trajectory of a subject gets the same update, so
+        during EM we just follow one probability per subject, and copy
+        it out to all Ntrajectory of them at the end. The subjects'
+        status and state, and the agents' PL and PD, come out as if
+        Subject.update_state() and Agent.heard_many_times() had been
+        called at every step. Subjects with no annotations are left
+        alone, and so are subjects whose annotations all came from
+        banned agents (the old code turned their probabilities into
+        NaNs).
+
+        The E step gives the same numbers as the per-subject code; the
+        M step's sums are done in a different order, so PL and PD can
+        differ in the last decimal place.
+
+        With n_workers > 1, each step is split across a pool of
+        processes (see EMWorkers): the E step into contiguous ranges of
+        subjects, and the M step into contiguous ranges of agents. Every
+        subject's (or agent's) sums are then done by just one worker, in
+        the same order as in a single process, so the results are
+        identical whatever the number of workers.
+
+        Plain EM can take hundreds of steps to settle down, as
+        subjects' probabilities creep geometrically towards 0 or 1. With
+        acceleration = 'squarem' or 'aitken', offline_em() extrapolates
+        along that path after every two steps (see extrapolate()), with
+        a step length limit that grows while the jumps are paying off
+        and shrinks when they aren't. A subject only jumps if that
+        makes its annotations more likely, given the agents' PL and PD:
+        the E step is the EM update of the subjects' probabilities for
+        that likelihood, and supervised, where PL and PD are fixed by
+        the training subjects, each subject's likelihood has just the
+        one maximum, so the accelerated runs head for the same answer as
+        plain EM, only faster. Unsupervised, PL and PD move with the
+        probabilities, there can be more than one answer, and the
+        accelerated runs can settle on a different one from plain EM
+        (aitken more often than squarem). The trace offline_em() returns
+        records the convergence, iteration by iteration.
+
+        From one SWAPSHOP batch to the next, most of the classifications
+        are the same. So supervised EM can be warm-started from the last
+        batch's converged state (em_state(), saved next to the bureau
+        and collection): only the agents and subjects that the new
+        classifications affect have to converge again, on their own,
+        before a final sweep over everything - and they converge to
+        where starting from scratch would take them (see warm_start()).
+
+    FUNCTIONS
+        gather_classifications(bureau,sample,supervised=False,supervised_and_unsupervised=False):
+
+        expectation(matrix,PL,PD,probability,laplace_smoothing=0):
+
+        maximization(matrix,mean_probability,N=None,laplace_smoothing=1.):
+
+        make_shards(keys,N,N_shards):
+
+        log_likelihood(matrix,PL,PD,probability,by_subject=False):
+
+        extrapolate(method,x0,x1,x2,step_max=4.0):
+
+        restrict(matrix,agents,subjects):
+
+        em_state(bureau,sample,settings):
+
+        warm_start(bureau,sample,state,settings):
+
+        offline_em(bureau,sample,supervised=False,supervised_and_unsupervised=False,N_min=40,N_max=100,epsilon_min=1e-6,n_workers=1,acceleration=None,prior=swap.prior,active=None):
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+"""
+
+#=========================================================================
+# Gather all the classifications into a sparse matrix. The E step needs
+# (agent, subject, ItWas) for every annotation; the M step needs
+# (agent, ItWas, probability) for every entry in the agents' histories,
+# where the probability is either fixed (a training subject's truth) or
+# that subject's current mean probability (subject index >= 0).
+
+def gather_classifications(bureau,sample,supervised=False,supervised_and_unsupervised=False):
+
+    matrix = {}
+    matrix['agents'] = np.array(bureau.list(),dtype=object)
+    matrix['subjects'] = np.array(sample.list(),dtype=object)
+    agent_index = dict([(Name,a) for a,Name in enumerate(matrix['agents'])])
+    subject_index = dict([(ID,s) for s,ID in enumerate(matrix['subjects'])])
+
+    # E step: the subjects' annotations.
+    agents,subjects,ItWas = [],[],[]
+    described = np.zeros(len(matrix['subjects']),dtype=bool)
+    kinds = np.empty(len(matrix['subjects']),dtype=object)
+    for s,ID in enumerate(matrix['subjects']):
+        subject = sample.member[ID]
+        kinds[s] = subject.kind
+        names = subject.annotationhistory['Name']
+        if len(names) == 0: continue
+        described[s] = True
+        agents.extend([agent_index[Name] for Name in names])
+        subjects.extend([s]*len(names))
+        ItWas.extend(subject.annotationhistory['ItWas'])
+
+    matrix['agent'] = np.array(agents,dtype=int)
+    matrix['subject'] = np.array(subjects,dtype=int)
+    matrix['ItWas'] = np.array(ItWas,dtype=int)
+    matrix['described'] = described
+
+    # Banned agents' annotations don't count:
+    crowd,crowd_state = gather_agents(bureau,matrix['agents'])
+    live = ~crowd_state['banned'][matrix['agent']]
+    for key in ['agent','subject','ItWas']:
+        matrix[key] = matrix[key][live]
+
+    # M step: the agents' histories.
+    agents,ItWas,subjects,fixed = [],[],[],[]
+    for a,agent in enumerate(crowd):
+
+        if supervised_and_unsupervised or supervised:
+            history = agent.traininghistory
+            ids = [subject_index[ID] for ID in history['ID']]
+            agents.extend([a]*len(ids))
+            ItWas.extend(history['ItWas'])
+            if supervised_and_unsupervised:
+                # Perfect training for sims and duds, but test subjects
+                # (if any) use their probabilities:
+                for s in ids:
+                    if kinds[s] == 'test':
+                        subjects.append(s)
+                        fixed.append(0.0)
+                    else:
+                        subjects.append(-1)
+                        fixed.append(1.0 if kinds[s] == 'sim' else 0.0)
+            else:
+                subjects.extend([-1]*len(ids))
+                fixed.extend(history['ActuallyItWas'])
+
+        if supervised_and_unsupervised or not supervised:
+            history = agent.testhistory
+            ids = [subject_index[ID] for ID in history['ID']]
+            agents.extend([a]*len(ids))
+            ItWas.extend(history['ItWas'])
+            subjects.extend(ids)
+            fixed.extend([0.0]*len(ids))
+
+    matrix['m_agent'] = np.array(agents,dtype=int)
+    matrix['m_ItWas'] = np.array(ItWas,dtype=int)
+    matrix['m_subject'] = np.array(subjects,dtype=int)
+    matrix['m_fixed'] = np.array(fixed,dtype=float)
+
+    return matrix
+
+# ----------------------------------------------------------------------------
+# The part of the matrix that the given agents and subjects (boolean masks
+# over matrix['agents'] and matrix['subjects']) need: the E step entries
+# of those subjects, and the M step entries of those agents.
+
+def restrict(matrix,agents,subjects):
+
+    part = dict(matrix)
+    keep = subjects[matrix['subject']]
+    for key in ['agent','subject','ItWas']:
+        part[key] = matrix[key][keep]
+    keep = agents[matrix['m_agent']]
+    for key in ['m_agent','m_ItWas','m_subject','m_fixed']:
+        part[key] = matrix[key][keep]
+
+    return part
+
+# ----------------------------------------------------------------------------
+# E step: update every subject's probability, given the agents' PL and PD,
+# using the average likelihood of its annotations - see
+# Subject.was_described_many_times(). Returns the new probabilities, and
+# the number of annotations used for each subject.
+
+def expectation(matrix,PL,PD,probability,laplace_smoothing=0):
+
+    a,s = matrix['agent'],matrix['subject']
+    lens = (matrix['ItWas'] == 1)
+    M_cl = np.where(lens,PL[a],1-PL[a])
+    M_cn = np.where(lens,1-PD[a],PD[a])
+
+    p = probability[s]
+    likelihood = M_cl + laplace_smoothing
+    likelihood /= (M_cl*p + M_cn*(1-p) + 2 * laplace_smoothing)
+
+    likelihood_sum = np.bincount(s,weights=likelihood,minlength=len(probability))
+    N_used = np.bincount(s,minlength=len(probability))
+
+    used = (N_used > 0)
+    new_probability = probability.copy()
+    new_probability[used] = likelihood_sum[used] * probability[used] / N_used[used]
+
+    return new_probability,N_used
+
+# ----------------------------------------------------------------------------
+# M step: update every agent's PL and PD, given the subjects' mean
+# probabilities - see Agent.heard_many_times(). N is the number of agents
+# (by default, all of them).
+
+def maximization(matrix,mean_probability,N=None,laplace_smoothing=1.):
+
+    a = matrix['m_agent']
+    if N is None: N = len(matrix['agents'])
+    classifications = matrix['m_ItWas']
+    probabilities = matrix['m_fixed'].copy()
+    live = (matrix['m_subject'] >= 0)
+    probabilities[live] = mean_probability[matrix['m_subject'][live]]
+
+    probability_sum = np.bincount(a,weights=probabilities,minlength=N)
+    probability_num = np.bincount(a,minlength=N)
+    classification_probability_sum = np.bincount(a,weights=classifications*probabilities,minlength=N)
+    classification_sum = np.bincount(a,weights=classifications,minlength=N)
+
+    PL = (laplace_smoothing + classification_probability_sum) / (2 * laplace_smoothing + probability_sum)
+    PD = (laplace_smoothing + probability_num - classification_sum - probability_sum + classification_probability_sum) / (2 * laplace_smoothing + probability_num - probability_sum)
+
+    return PL,PD
+
+# ----------------------------------------------------------------------------
+# Split N items (subjects or agents) into at most N_shards contiguous
+# ranges, with roughly equal numbers of entries in each. keys is the
+# (sorted) item index of each entry. Returns a list of (start,stop,first,
+# last): items start:stop, and their entries first:last.
+
+def make_shards(keys,N,N_shards):
+
+    counts = np.bincount(keys,minlength=N)
+    ends = np.concatenate([[0],np.cumsum(counts)])
+    targets = np.arange(1,N_shards)*len(keys)/float(N_shards)
+    cuts = np.searchsorted(ends,targets)
+    edges = np.unique(np.concatenate([[0],cuts,[N]]).clip(0,N))
+
+    return [(edges[k],edges[k+1],ends[edges[k]],ends[edges[k+1]]) for k in range(len(edges)-1)]
+
+#=========================================================================
+# The worker processes' view of the shared arrays, set up by attach():
+
+shared = {}
+
+def attach(arrays):
+    for key,(raw,dtype,size) in arrays.items():
+        shared[key] = np.frombuffer(raw,dtype=dtype,count=size)
+    return
+
+# E step for subjects start:stop, whose annotations are first:last:
+
+def expectation_shard(shard):
+
+    start,stop,first,last = shard
+    part = {'agent': shared['agent'][first:last],
+            'subject': shared['subject'][first:last] - start,
+            'ItWas': shared['ItWas'][first:last]}
+    shared['new_probability'][start:stop] = expectation(part,shared['PL'],shared['PD'],shared['probability'][start:stop])[0]
+
+    return
+
+# M step for agents start:stop, whose history entries are first:last:
+
+def maximization_shard(shard):
+
+    start,stop,first,last = shard
+    part = {'m_agent': shared['m_agent'][first:last] - start,
+            'm_ItWas': shared['m_ItWas'][first:last],
+            'm_subject': shared['m_subject'][first:last],
+            'm_fixed': shared['m_fixed'][first:last]}
+    shared['PL'][start:stop],shared['PD'][start:stop] = maximization(part,shared['mean_probability'],N=stop-start)
+
+    return
+
+# ----------------------------------------------------------------------------
+
+class EMWorkers(object):
+    """
+    NAME
+        EMWorkers
+
+    PURPOSE
+        Do the E and M steps of the offline EM on a pool of processes.
+
+    COMMENTS
+        The classification matrix, and the agents' and subjects' current
+        values, are copied into shared memory (multiprocessing
+        RawArrays) once, before the pool is started, so the workers
+        never have to be sent any arrays: each task is just a range of
+        subjects or agents. Each worker writes its results straight
+        into the shared arrays, and the main process reads them back
+        when the whole step is done.
+
+        The matrix must be sorted by subject (annotations) and by agent
+        (history entries), as gather_classifications() leaves it.
+
+    INITIALISATION
+        matrix        From gather_classifications()
+        n_workers     No. of processes
+
+    METHODS
+        EMWorkers.expectation(PL,PD,probability)     As expectation()
+        EMWorkers.maximization(mean_probability)     As maximization()
+        EMWorkers.close()                            Stop the pool
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,matrix,n_workers):
+
+        N_agents = len(matrix['agents'])
+        N_subjects = len(matrix['subjects'])
+
+        arrays = {}
+        self.arrays = {}
+        for key,size in [('PL',N_agents),('PD',N_agents),
+                         ('probability',N_subjects),('new_probability',N_subjects),
+                         ('mean_probability',N_subjects)]:
+            arrays[key] = np.zeros(size)
+        for key in ['agent','subject','ItWas','m_agent','m_ItWas','m_subject','m_fixed']:
+            arrays[key] = matrix[key]
+
+        shareable = {}
+        for key,array in arrays.items():
+            raw = multiprocessing.RawArray('b',max(array.nbytes,1))
+            shareable[key] = (raw,array.dtype,array.size)
+            self.arrays[key] = np.frombuffer(raw,dtype=array.dtype,count=array.size)
+            self.arrays[key][:] = array
+
+        self.e_shards = make_shards(matrix['subject'],N_subjects,n_workers)
+        self.m_shards = make_shards(matrix['m_agent'],N_agents,n_workers)
+        self.N_used = np.bincount(matrix['subject'],minlength=N_subjects)
+
+        self.pool = multiprocessing.Pool(n_workers,initializer=attach,initargs=(shareable,))
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def expectation(self,PL,PD,probability):
+
+        self.arrays['PL'][:] = PL
+        self.arrays['PD'][:] = PD
+        self.arrays['probability'][:] = probability
+        self.pool.map(expectation_shard,self.e_shards)
+
+        return self.arrays['new_probability'].copy(),self.N_used
+
+    def maximization(self,mean_probability):
+
+        self.arrays['mean_probability'][:] = mean_probability
+        self.pool.map(maximization_shard,self.m_shards)
+
+        return self.arrays['PL'].copy(),self.arrays['PD'].copy()
+
+# ----------------------------------------------------------------------------
+
+    def close(self):
+
+        self.pool.terminate()
+        self.pool.join()
+
+        return
+
+# ----------------------------------------------------------------------------
+# Log-likelihood of all the (unbanned) annotations, given the agents' PL
+# and PD and the subjects' probabilities: each annotation is LENS or NOT
+# with the probability its agent would give it if the subject were a LENS
+# with its current probability. The E step is the EM update of each
+# subject's probability for exactly this likelihood, so with PL and PD
+# held fixed (as they are, supervised) it never goes down. Reported in the
+# convergence trace. With by_subject=True, returns each subject's part
+# of it instead, which the accelerated steps are safeguarded on.
+
+def log_likelihood(matrix,PL,PD,probability,by_subject=False):
+
+    a,s = matrix['agent'],matrix['subject']
+    lens = (matrix['ItWas'] == 1)
+    p = probability[s]
+
+    terms = np.log(np.where(lens,PL[a],1-PL[a])*p + np.where(lens,1-PD[a],PD[a])*(1-p))
+    if by_subject:
+        return np.bincount(s,weights=terms,minlength=len(probability))
+
+    return np.sum(terms)
+
+# ----------------------------------------------------------------------------
+# Extrapolate a sequence of three EM iterates x0,x1,x2 (the subjects'
+# probabilities) towards its fixed point, by at most step_max times the
+# length of a plain step, and no more than step_max times nearer to 0 or
+# 1 than x2. Returns the new point and whether the step length limit was
+# binding, or None if there is nothing to gain.
+#   squarem: the "SqS3" steplength of Varadhan & Roland (2008): alpha = -1
+#            would just give x2
+#   aitken:  Aitken's delta-squared, with the rate of convergence
+#            estimated from the lengths of the last two steps
+
+def extrapolate(method,x0,x1,x2,step_max=4.0):
+
+    d1,d2 = x1-x0,x2-x1
+
+    if method == 'squarem':
+        v = d2 - d1
+        norm_v = np.sqrt(np.dot(v,v))
+        if norm_v == 0: return None
+        alpha = -np.sqrt(np.dot(d1,d1))/norm_v
+        binding = (alpha <= -step_max)
+        alpha = min(max(alpha,-step_max),-1.0)
+        if alpha == -1.0: return None
+        x = x0 - 2*alpha*d1 + alpha*alpha*v
+
+    elif method == 'aitken':
+        norm_d1 = np.sqrt(np.dot(d1,d1))
+        if norm_d1 == 0: return None
+        rate = np.sqrt(np.dot(d2,d2))/norm_d1
+        if not 0 < rate < 1: return None
+        binding = (rate/(1-rate) >= step_max)
+        x = x2 + d2*min(rate/(1-rate),step_max)
+
+    else:
+        raise Exception("SWAP: unknown EM acceleration "+str(method))
+
+    if not np.all(np.isfinite(x)): return None
+
+    # Probabilities have to stay probabilities, and keep well away from
+    # certainty, which the E step would take a very long time to get
+    # back out of: a jump takes them at most step_max times nearer to 0
+    # or 1 than x2 is.
+    x = np.clip(x,x2/step_max,1.0-(1.0-x2)/step_max)
+
+    return x,binding
+
+# ======================================================================
+
+class EMState(dict):
+    """
+    NAME
+        EMState
+
+    PURPOSE
+        The converged state of one batch's offline EM, to start the next
+        batch's EM from.
+
+    COMMENTS
+        A dictionary, keyed by:
+
+          settings       supervised, supervised_and_unsupervised,
+                         initialPL, initialPD and prior
+          PL,PD          each agent's, by Name
+          N_agent        how many training subjects each agent had
+                         classified
+          probability    each subject's, by ID
+          N_subject      how many classifications each subject had had
+
+        Pickled next to the bureau and the collection, when offline EM
+        is incremental.
+
+    INITIALISATION
+        em_state(bureau,sample,settings)
+
+    METHODS
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+    def __str__(self):
+        return 'offline EM state of %d agents and %d subjects' % (len(self['PL']),len(self['probability']))
+
+# ----------------------------------------------------------------------------
+# Take a copy of the converged EM state, to start the next batch's EM
+# from: every agent's PL and PD, and every subject's probability, along
+# with how many classifications they came from (for the agents,
+# supervised, just the training subjects count), and the settings it was
+# found with.
+
+def em_state(bureau,sample,settings):
+
+    state = EMState(settings=dict(settings),PL={},PD={},N_agent={},probability={},N_subject={})
+
+    for Name in bureau.list():
+        agent = bureau.member[Name]
+        state['PL'][Name] = agent.PL
+        state['PD'][Name] = agent.PD
+        state['N_agent'][Name] = len(agent.traininghistory['ID'])
+
+    for ID in sample.list():
+        subject = sample.member[ID]
+        state['probability'][ID] = np.atleast_1d(subject.probability)[0]
+        state['N_subject'][ID] = len(subject.annotationhistory['Name'])
+
+    return state
+
+# ----------------------------------------------------------------------------
+# Start supervised EM from a previous batch's state (see em_state()),
+# instead of from scratch. Supervised, each agent's PL and PD only depend
+# on the training subjects it has classified, and then each subject's
+# probability converges to the one maximum of its likelihood, given its
+# annotators' PL and PD (see log_likelihood()) - wherever it starts from.
+# So the agents with no new training classifications get their PL and PD
+# back, and the subjects with no new annotations, none of whose annotators
+# are new or have new training classifications, get their converged
+# probabilities back: that is where starting from scratch would take
+# them again. Everyone else starts from scratch (the known agents from
+# their old PL and PD, which the first M step replaces), and has to
+# converge again. Returns the (Names, IDs) of those agents and subjects -
+# or None, if the state was found with different settings (in which
+# case nothing is changed).
+#
+# Unsupervised, PL and PD depend on the subjects' probabilities too, and
+# there can be more than one answer: which one EM finds depends on where
+# it starts, so it has to start from scratch.
+
+def warm_start(bureau,sample,state,settings):
+
+    if state is None or state['settings'] != dict(settings):
+        return None
+
+    prior = settings['prior']
+    names,IDs = set(),[]
+
+    for Name in bureau.list():
+        agent = bureau.member[Name]
+        if Name in state['PL']:
+            agent.PL = state['PL'][Name]
+            agent.PD = state['PD'][Name]
+            if len(agent.traininghistory['ID']) != state['N_agent'][Name]:
+                names.add(Name)
+        else:
+            agent.PL = settings['initialPL']
+            agent.PD = settings['initialPD']
+            names.add(Name)
+
+    for ID in sample.list():
+        subject = sample.member[ID]
+        history = subject.annotationhistory['Name']
+        if ID in state['probability'] and len(history) == state['N_subject'][ID] and names.isdisjoint(history):
+            subject.probability = state['probability'][ID]
+        else:
+            subject.probability = prior
+            IDs.append(ID)
+        subject.update_state()
+
+    return list(names),IDs
+
+# ----------------------------------------------------------------------------
+# Run EM to convergence, starting from the agents' current PL and PD and
+# the subjects' current probabilities, and leave the results in the bureau
+# and the sample. With n_workers > 1, the steps are done on a pool of
+# processes.
+#
+# With acceleration = 'squarem' or 'aitken', each iteration after the
+# first takes two plain steps, and extrapolates the subjects'
+# probabilities from them. The subjects whose annotations that makes
+# more likely (see log_likelihood()) than the second plain step did keep
+# their jumps, and one more step is taken from there; if there are none,
+# the iteration ends with the plain steps. Either way, epsilon is the
+# change made by the last step, as in plain EM. N_min and N_max count
+# E+M steps, however they are grouped.
+#
+# When warm-started (see warm_start()), pass active = (Names, IDs) of the
+# agents and subjects that have to converge again: EM first converges on
+# just those, holding everyone else fixed, at a cost in proportion to
+# their classifications, and then takes at least one step over the whole
+# matrix, carrying on until that has converged too. N_min only applies
+# from scratch.
+#
+# Returns the trace: one (iteration, steps, epsilon, log-likelihood,
+# seconds, update) tuple per iteration, where update is 'plain', the
+# acceleration method, or 'rejected' - prefixed with 'local_' while just
+# the active agents and subjects are converging.
+
+def offline_em(bureau,sample,supervised=False,supervised_and_unsupervised=False,N_min=40,N_max=100,epsilon_min=1e-6,n_workers=1,acceleration=None,prior=swap.prior,active=None):
+
+    if acceleration in [None,'None','none','plain']: acceleration = None
+    start_time = time.time()
+
+    matrix = gather_classifications(bureau,sample,supervised=supervised,supervised_and_unsupervised=supervised_and_unsupervised)
+
+    crowd,crowd_state = gather_agents(bureau,matrix['agents'])
+    members,sample_state = gather_subjects(sample,matrix['subjects'])
+    PL,PD = crowd_state['PL'],crowd_state['PD']
+    probability = sample_state['probability'][:,0].copy()
+    mean_probability = sample_state['mean_probability'].copy()
+
+    described = matrix['described']
+    test = sample_state['test']
+    rejection = sample_state['rejection_threshold']
+    detection = sample_state['detection_threshold']
+
+    # Subjects with (unbanned) annotations are the only ones that change:
+    N_used = np.bincount(matrix['subject'],minlength=len(probability))
+    updated = (N_used > 0)
+    original_mean_probability = mean_probability
+
+    # The stages EM goes through, as (part of the matrix, mask of the
+    # agents whose PL and PD it updates, or None for all of them): from
+    # scratch, just the whole matrix; warm-started, the active agents and
+    # subjects first.
+    stages = [(matrix,None)]
+    if active is not None:
+        names,IDs = set(active[0]),set(active[1])
+        active_agents = np.array([Name in names for Name in matrix['agents']],dtype=bool)
+        active_subjects = np.array([ID in IDs for ID in matrix['subjects']],dtype=bool)
+        if np.any(active_subjects):
+            stages.insert(0,(restrict(matrix,active_agents,active_subjects),active_agents))
+
+    # The current stage's E and M steps, and which agents it updates:
+    current = {}
+    def maximize(mean_probability,PL,PD):
+        new_PL,new_PD = current['m_step'](mean_probability)
+        if current['moving'] is None:
+            return new_PL,new_PD
+        return np.where(current['moving'],new_PL,PL),np.where(current['moving'],new_PD,PD)
+
+    # One E step and one M step:
+    def step(probability,PL,PD):
+        probability = current['e_step'](PL,PD,probability)[0]
+        mean_probability = original_mean_probability.copy()
+        mean_probability[updated] = probability[updated]
+        PL,PD = maximize(mean_probability,PL,PD)
+        return probability,mean_probability,PL,PD
+
+    # Root mean square change in probability, divided by the number of
+    # subjects (that the current stage updates):
+    def change(new_mean_probability,mean_probability):
+        counted = current['counted']
+        num_taus = np.sum(counted)
+        if num_taus == 0: return 0
+        return np.sqrt(np.sum((new_mean_probability - mean_probability)[counted]**2)) * 1. / num_taus
+
+    # Which way did Subject.update_state() last set each test subject's
+    # state? (0 = not yet, 1 = retired, 2 = revived)
+    last = np.zeros(len(probability),dtype=int)
+    def track(mean_probability):
+        rejected = updated & (mean_probability < rejection)
+        undecided = updated & ~rejected & ~(mean_probability > detection)
+        last[rejected & test] = 1
+        last[undecided & test] = 2
+
+    trace = []
+    step_max = 4.0
+    N_try = 0
+    for part,moving in stages:
+
+        local = (part is not matrix)
+        N_start = N_try
+        if local:
+            # (Leaving at least one step for the whole matrix.)
+            N_least,N_most = 0,N_max-1
+        elif active is None:
+            N_least,N_most = N_min,N_max
+        else:
+            N_least,N_most = N_try+1,N_max
+
+        # While the active subjects converge on their own, only their
+        # part of the log-likelihood changes:
+        offset = 0.0
+        if local:
+            offset = log_likelihood(matrix,PL,PD,probability) - log_likelihood(part,PL,PD,probability)
+
+        current['moving'] = moving
+        current['counted'] = (described & active_subjects) if local else described
+        if n_workers > 1:
+            workers = EMWorkers(part,n_workers)
+            current['e_step'],current['m_step'] = workers.expectation,workers.maximization
+        else:
+            workers = None
+            current['e_step'] = lambda PL,PD,probability: expectation(part,PL,PD,probability)
+            current['m_step'] = lambda mean_probability: maximization(part,mean_probability)
+
+        epsilon_taus = 10
+        try:
+            while (epsilon_taus > epsilon_min) * (N_try < N_most) + (N_try < N_least):
+
+                # The first step of a stage is never accelerated (from
+                # scratch, it starts from the initial PL and PD, rather
+                # than from an M step); nor is a step that would overrun
+                # N_max:
+                if acceleration is None or N_try == N_start or N_try + 3 > max(N_most,N_least):
+                    new = step(probability,PL,PD)
+                    N_try += 1
+                    update = 'plain'
+                    epsilon_taus = change(new[1],mean_probability)
+                    loglikelihood = log_likelihood(part,new[2],new[3],new[0])
+
+                else:
+                    first = step(probability,PL,PD)
+                    track(first[1])
+                    second = step(first[0],first[2],first[3])
+                    track(second[1])
+                    N_try += 2
+                    new,update = second,'plain'
+                    epsilon_taus = change(second[1],first[1])
+                    loglikelihoods = log_likelihood(part,second[2],second[3],second[0],by_subject=True)
+                    loglikelihood = np.sum(loglikelihoods)
+
+                    # Only step on from the jump, for the subjects it
+                    # makes more likely than the plain steps did - given
+                    # PL and PD, each subject's likelihood is independent
+                    # of the others':
+                    jump = extrapolate(acceleration,probability[updated],first[0][updated],second[0][updated],step_max)
+                    if jump is not None:
+                        x,binding = jump
+                        extrapolated = second[0].copy()
+                        extrapolated[updated] = x
+                        better = updated & (log_likelihood(part,second[2],second[3],extrapolated,by_subject=True) > loglikelihoods)
+                        if np.any(better):
+                            extrapolated = np.where(better,extrapolated,second[0])
+                            mean = original_mean_probability.copy()
+                            mean[updated] = extrapolated[updated]
+                            new = step(extrapolated,*maximize(mean,second[2],second[3]))
+                            N_try += 1
+                            update = acceleration
+                            epsilon_taus = change(new[1],mean)
+                            loglikelihood = log_likelihood(part,new[2],new[3],new[0])
+                            if binding: step_max *= 4
+                        else:
+                            update = 'rejected'
+                            step_max = max(step_max/4,2.0)
+
+                probability,mean_probability,PL,PD = new
+                track(mean_probability)
+
+                trace.append((len(trace)+1,N_try,epsilon_taus,loglikelihood+offset,time.time()-start_time,('local_' if local else '')+update))
+
+                # Nothing had been learnt about the agents before the
+                # first step from scratch, so it says nothing about
+                # convergence:
+                if N_try == 1 and active is None: epsilon_taus = 10
+
+        finally:
+            if workers is not None: workers.close()
+
+    # Copy the agents' PL and PD back into the bureau:
+    crowd_state['PL'],crowd_state['PD'] = PL,PD
+    scatter_agents(bureau,crowd,crowd_state)
+
+    # And the updated subjects' probabilities, status and state back into
+    # the sample - see Subject.update_state():
+    ids = np.where(updated)[0] if N_try > 0 else np.zeros(0,dtype=int)
+    state = {}
+    for key in sample_state:
+        state[key] = sample_state[key][ids]
+    state['probability'] = np.zeros([len(ids),Ntrajectory]) + probability[ids][:,np.newaxis]
+    state['mean_probability'] = 10.0 ** np.mean(np.log10(state['probability']),axis=1)
+    state['median_probability'] = np.median(state['probability'],axis=1)
+
+    P = state['mean_probability']
+    rejected = P < state['rejection_threshold']
+    detected = ~rejected & (P > state['detection_threshold'])
+    undecided = ~rejected & ~detected
+    state['status'][rejected] = 'rejected'
+    state['status'][detected] = 'detected'
+    state['status'][undecided] = 'undecided'
+
+    # Detected subjects keep whatever state they were last left in:
+    retired = state['test'] & (rejected | (detected & (last[ids] == 1)))
+    state['state'][retired] = 'inactive'
+    state['retirement_time'][retired] = 'end of time'
+    state['retirement_age'][retired] = state['exposure'][retired]
+
+    revived = state['test'] & (undecided | (detected & (last[ids] == 2)))
+    state['state'][revived] = 'active'
+    state['retirement_time'][revived] = 'not yet'
+    state['retirement_age'][revived] = 0.0
+
+    scatter_subjects(sample,[members[i] for i in ids],state)
+
+    return trace
+
+# ======================================================================
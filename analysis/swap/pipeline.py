@@ -0,0 +1,396 @@
+# ======================================================================
+
+import swap
+
+import multiprocessing,Queue,signal,time,traceback
+
+# ======================================================================
+
+"""
+    NAME
+        pipeline
+
+    PURPOSE
+        Read and digest classifications on other processes, while the
+        main process gets on with updating the agents and subjects.
+
+    COMMENTS
+        Decoding a classification from the Mongo (scanning its
+        annotations, pulling out the markers, formatting strings) does
+        not depend on any other classification, while the Bayesian
+        updates that follow have to be done one after another, in time
+        order. Nor does reading the classifications from the cursor, or
+        looking up their subjects in the cache (and in the subject
+        table, with $in queries, if they are not there yet). So:
+
+          - a Reader process makes its own connection to the Mongo,
+            runs the query, reads the raw classifications from the
+            cursor in chunks, pairs each one with its subject's
+            metadata, and deals the chunks out to
+          - N_workers Digester processes, which decode them (with
+            swap.mongodb.decode), and pass the Records on to
+          - the main process, which collects them from the Digesters
+            in turn - and so in the original order - as it needs them.
+
+        The subjects that the Reader looked up are passed on with the
+        Records, to go in the main process's cache (and be saved with
+        it). Each chunk is only pickled twice on the way: the raw
+        classifications to a Digester, and the Records from it.
+
+        At most about N_ahead chunks are on their way at any one time,
+        so that the Reader can't run away from the updates, and memory
+        stays bounded. When the consumer stops early (at SWAP's time or
+        count limits), it should close the generator, which stops the
+        processes.
+
+        With one worker, or for the Toy database and event logs (whose
+        digests are cheap), classifications are just read and digested
+        one at a time, by the main process, as before.
+
+        Given an index of retired subjects (swap.RetiredSubjects),
+        classifications of those subjects are dropped before anything
+        is done with them - even before their subjects are looked up -
+        and counted by the index. The Reader drops those of subjects
+        that were retired when it started, and the main process those
+        of subjects retired since. (The index is keyed by the IDs as
+        strings, as in the Records, not by the Mongo's ObjectIds.)
+
+    FUNCTIONS
+        digested(db,query,survey,method=False,N_workers=1,N_per_chunk=1000,N_ahead=None,retired=None):
+
+        chunks(iterable,N):
+
+    BUGS
+        - The processes are forked, with a copy of everything: this
+          only works on Unix.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+"""
+
+#=========================================================================
+# Split an iterable up into lists of N items:
+
+def chunks(iterable,N):
+
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == N:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+# ----------------------------------------------------------------------------
+# Yield the digest of each classification that the query - (word, t,
+# after), as for db.find() - picks out, in order, which might be None, as
+# with db.digest(), skipping any of retired subjects:
+
+def digested(db,query,survey,method=False,N_workers=1,N_per_chunk=1000,N_ahead=None,retired=None):
+
+    word,t,after = query
+
+    if N_workers <= 1 or not isinstance(db,swap.MongoDB):
+        batch = db.find(word,t,after=after)
+        if retired is not None:
+            batch = (classification for classification in batch if not retired.skip(db.subject_of(classification)))
+        for classification in batch:
+            yield db.digest(classification,survey,method=method)
+        return
+
+    if N_ahead is None: N_ahead = 2*N_workers
+
+    stopping = multiprocessing.Event()
+    digesters = [Digester(survey,method,max(N_ahead/N_workers,1),stopping) for k in range(N_workers)]
+    reader = Reader(db,query,N_per_chunk,retired,digesters,stopping)
+    for process in digesters+[reader]:
+        process.start()
+
+    try:
+        k = 0
+        while True:
+            items = digesters[k % N_workers].receive(reader)
+            if items is None:
+                break
+            records,subjects,skipped = items
+            k += 1
+
+            db.subject_cache.update(subjects)
+            if retired is not None:
+                retired.skipped += skipped
+
+            for record in records:
+                # (Subjects can retire after the Reader has gone past.)
+                if record is not None and retired is not None and retired.skip(record.ID):
+                    continue
+                yield record
+
+    finally:
+        stop(digesters+[reader],stopping)
+
+    return
+
+# ----------------------------------------------------------------------------
+# Stop the processes, emptying the Digesters' queues so that they can
+# finish, and waiting (a while) for them to do so:
+
+def stop(processes,stopping):
+
+    stopping.set()
+
+    deadline = time.time() + 60.0
+    while time.time() < deadline and any([process.is_alive() for process in processes]):
+        for process in processes:
+            if isinstance(process,Digester):
+                try:
+                    process.outbox.get(timeout=0.01)
+                except Queue.Empty:
+                    pass
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+    return
+
+# ----------------------------------------------------------------------------
+# Put something in a queue, as soon as there is room, unless asked to stop
+# first (and then don't wait for the queue to empty before exiting).
+# Returns whether it went in:
+
+def put(queue,items,stopping):
+
+    while not stopping.is_set():
+        try:
+            queue.put(items,timeout=0.1)
+            return True
+        except Queue.Full:
+            pass
+
+    queue.cancel_join_thread()
+
+    return False
+
+# ----------------------------------------------------------------------------
+# Both kinds of process leave ^C to the main process, which then stops
+# them:
+
+def detach():
+
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    signal.signal(signal.SIGTERM,signal.SIG_DFL)
+
+    return
+
+#=========================================================================
+
+class Reader(multiprocessing.Process):
+    """
+    NAME
+        Reader
+
+    PURPOSE
+        Read classifications from the Mongo, and pair them with their
+        subjects, on another process - see swap.digested().
+
+    COMMENTS
+        The Reader is started from the main process, which has the
+        MongoDB, and so is forked with a copy of it (and of the retired
+        subject index), but makes its own connection. The chunks go to
+        the Digesters in turn, as (work, subjects, skipped): the
+        (classification, subject metadata) pairs to decode, the subjects
+        that were not in the cache, and the number of classifications
+        dropped as being of retired subjects. Then each Digester gets a
+        None, to say that that's it - or the traceback, if the Reader
+        failed.
+
+    INITIALISATION
+        db, query, N_per_chunk, retired, digesters, stopping
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,db,query,N_per_chunk,retired,digesters,stopping):
+
+        multiprocessing.Process.__init__(self)
+
+        self.db = db
+        self.query = query
+        self.N_per_chunk = N_per_chunk
+        self.retired = retired
+        self.digesters = digesters
+        self.stopping = stopping
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def run(self):
+
+        detach()
+        k = 0
+
+        try:
+            db = self.db
+            db.connect()
+            known = set(db.subject_cache)
+            word,t,after = self.query
+
+            for chunk in chunks(db.find(word,t,after=after),self.N_per_chunk):
+
+                work,subjects,skipped = [],{},0
+                for classification in chunk:
+                    ID = swap.subject_id(classification)
+                    if ID is None:
+                        work.append((classification,None))
+                    elif self.retired is not None and str(ID) in self.retired:
+                        skipped += 1
+                    else:
+                        subject = db.get_subject(ID)
+                        work.append((classification,subject))
+                        if ID not in known:
+                            subjects[ID] = subject
+                            known.add(ID)
+
+                if not put(self.digesters[k % len(self.digesters)].inbox,(work,subjects,skipped),self.stopping):
+                    self.abandon()
+                    return
+                k += 1
+
+            ending = None
+
+        except Exception:
+            ending = traceback.format_exc()
+
+        # Tell the Digesters, starting with the one that the main process
+        # will look at next:
+        for j in range(len(self.digesters)):
+            if not put(self.digesters[(k+j) % len(self.digesters)].inbox,ending,self.stopping):
+                self.abandon()
+                return
+
+        return
+
+# When asked to stop, don't wait for the Digesters to take what was sent
+# to them before finishing:
+
+    def abandon(self):
+
+        for digester in self.digesters:
+            digester.inbox.cancel_join_thread()
+
+        return
+
+#=========================================================================
+
+class Digester(multiprocessing.Process):
+    """
+    NAME
+        Digester
+
+    PURPOSE
+        Decode chunks of classifications from the Reader, on another
+        process, for the main process - see swap.digested().
+
+    COMMENTS
+        Each chunk of Records goes to the main process as (records,
+        subjects, skipped), passing on what came with it from the
+        Reader. Anything else - None, when the Reader has finished, or a
+        traceback - is passed on as it is, and the Digester finishes.
+        receive() (on the main process) returns the next chunk, or None,
+        and raises an Exception if the Reader or this Digester failed.
+
+    INITIALISATION
+        survey, method, N_ahead, stopping
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,survey,method,N_ahead,stopping):
+
+        multiprocessing.Process.__init__(self)
+
+        self.survey = survey
+        self.method = method
+        self.stopping = stopping
+        self.inbox = multiprocessing.Queue(N_ahead)
+        self.outbox = multiprocessing.Queue(1)
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def run(self):
+
+        detach()
+
+        while not self.stopping.is_set():
+            try:
+                items = self.inbox.get(timeout=0.1)
+            except Queue.Empty:
+                continue
+
+            if isinstance(items,tuple):
+                work,subjects,skipped = items
+                try:
+                    items = (swap.decode_chunk(work,self.survey,self.method),subjects,skipped)
+                except Exception:
+                    items = traceback.format_exc()
+
+            if not put(self.outbox,items,self.stopping) or not isinstance(items,tuple):
+                break
+
+        return
+
+# ----------------------------------------------------------------------------
+# On the main process: the next chunk from this Digester, or None.
+
+    def receive(self,reader):
+
+        while True:
+            try:
+                items = self.outbox.get(timeout=1.0)
+                break
+            except Queue.Empty:
+                # (Anything sent just before finishing is still on its
+                # way, so look again before giving up.)
+                if not self.is_alive() or (not reader.is_alive() and reader.exitcode != 0):
+                    try:
+                        items = self.outbox.get(timeout=1.0)
+                        break
+                    except Queue.Empty:
+                        raise Exception("swap.digested: a reading or digesting process has died")
+
+        if isinstance(items,basestring):
+            raise Exception("swap.digested: classifications could not be read and digested:\n"+items)
+
+        return items
+
+#=========================================================================
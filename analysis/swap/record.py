@@ -0,0 +1,158 @@
+# ======================================================================
+
+import numpy as np
+
+import collections,datetime
+
+from agent import actually_it_was_dictionary
+from subject import subject_codes
+
+# ======================================================================
+
+# The fields of a digested classification, in the order the databases
+# used to return them as a tuple of strings, and then where it is in the
+# database (see Record):
+
+record_fields = ['t', 'Name', 'ID', 'ZooID', 'category', 'kind', 'flavor',
+                 'result', 'truth', 'location', 'stage', 'at_x', 'at_y',
+                 'key']
+
+# How category, kind, result and truth are coded: categories and kinds
+# as in an ArrayCollection, results and truths as in the agents'
+# histories (LENS = 1, NOT = 0, UNKNOWN = -1):
+
+category_codes = dict([(c,i) for i,c in enumerate(subject_codes['category'])])
+kind_codes = dict([(k,i) for i,k in enumerate(subject_codes['kind'])])
+result_codes = actually_it_was_dictionary
+result_names = dict([(code,result) for result,code in result_codes.items()])
+
+# ======================================================================
+
+class Record(collections.namedtuple('Record',record_fields)):
+    """
+    NAME
+        Record
+
+    PURPOSE
+        One digested classification, with every field in its natural
+        type.
+
+    COMMENTS
+        The databases used to return each classification as a tuple of
+        13 strings, which SWAP then had to parse back again, with
+        strptime and eval, one classification at a time. A Record
+        keeps:
+
+          t              datetime, to the nearest second
+          Name,ID,ZooID  strings
+          category       integer code, index of subject_codes['category']
+          kind           integer code, index of subject_codes['kind']
+          flavor         string
+          result,truth   integer codes: LENS = 1, NOT = 0, UNKNOWN = -1
+          location       string
+          stage          integer
+          at_x,at_y      float arrays of click positions
+          key            (time, tie-breaker): where the classification
+                           is in the database's order, or None
+
+        The codes' names, and the timestamp string that goes into the
+        histories, are available as properties. Use make_record() to
+        code up the fields from their names.
+
+        The databases hand out classifications in order of time, and
+        then of their _id (ToyDB, EventLog: their position), and the key
+        is that pair, with the time to full precision. Times alone are
+        not enough to carry on from: SWAP used to ask for
+        classifications made after the last one it had processed, to
+        the nearest second, so that at each batch boundary, the rest of
+        the classifications made in that second were lost (or, from a
+        Mongo with milliseconds, done again). The last key is saved as
+        start_key, and find() carries on from the classification after
+        it. key_string() and read_key() write and read keys as config
+        values.
+
+        Records are namedtuples, so they can be unpacked, and pickled
+        to other processes, like the old tuples. (The clicks are pickled
+        as lists, which is much quicker than pickling small arrays.)
+
+    INITIALISATION
+        make_record(t,Name,ID,ZooID,category,kind,flavor,result,truth,location,stage,at_x,at_y,key=None)
+
+    METHODS AND VARIABLES
+        Record.tstring          Timestamp, as '%Y-%m-%d_%H:%M:%S'
+        Record.category_name    'training' or 'test'
+        Record.kind_name        'sim', 'dud' or 'test'
+        Record.result_name      'LENS' or 'NOT'
+        Record.truth_name       'LENS', 'NOT' or 'UNKNOWN'
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        return (unpickle_record,(tuple(self[:11]),self.at_x.tolist(),self.at_y.tolist(),self.key))
+
+# ----------------------------------------------------------------------------
+
+    @property
+    def tstring(self):
+        return self.t.strftime('%Y-%m-%d_%H:%M:%S')
+
+    @property
+    def category_name(self):
+        return subject_codes['category'][self.category]
+
+    @property
+    def kind_name(self):
+        return subject_codes['kind'][self.kind]
+
+    @property
+    def result_name(self):
+        return result_names[self.result]
+
+    @property
+    def truth_name(self):
+        return result_names[self.truth]
+
+# ======================================================================
+# Make a Record, coding up the category, kind, result and truth:
+
+def make_record(t,Name,ID,ZooID,category,kind,flavor,result,truth,location,stage,at_x,at_y,key=None):
+
+    return Record(t.replace(microsecond=0),Name,ID,ZooID,
+                  category_codes[category],kind_codes[kind],flavor,
+                  result_codes[result],result_codes[truth],location,
+                  int(stage),np.array(at_x,dtype=float),np.array(at_y,dtype=float),key)
+
+# Make a pickled Record again:
+
+def unpickle_record(fields,at_x,at_y,key):
+
+    return Record(*(fields+(np.array(at_x,dtype=float),np.array(at_y,dtype=float),key)))
+
+# ----------------------------------------------------------------------------
+# Write a Record's key as a config value, and read it back, as (time,
+# tie-breaker string) - each database knows what its tie-breakers are:
+
+def key_string(key):
+
+    t,tiebreaker = key
+
+    return t.strftime('%Y-%m-%d_%H:%M:%S.%f')+'/'+str(tiebreaker)
+
+def read_key(string):
+
+    t,tiebreaker = string.split('/',1)
+
+    return datetime.datetime.strptime(t,'%Y-%m-%d_%H:%M:%S.%f'),tiebreaker
+
+# ======================================================================
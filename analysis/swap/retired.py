@@ -0,0 +1,145 @@
+# ======================================================================
+
+import swap
+
+import numpy as np
+
+# ======================================================================
+
+class RetiredSubjects(object):
+    """
+    NAME
+        RetiredSubjects
+
+    PURPOSE
+        Know which subjects have been retired, cheaply enough to check
+        every classification before it is digested.
+
+    COMMENTS
+        In a hasty run, a classification of a retired (inactive) test
+        subject changes nothing but the classifier's count - yet SWAP
+        would still look up its subject in the database, digest it,
+        register its classifier and branch on the supervision mode
+        before finding that out. So the retired subjects are kept as a
+        bitset, one bit per subject ID (each ID that has been seen is
+        given a bit number, in order), built from the collection when
+        it is read in and set as subjects retire. The database's
+        subject_of() gives the ID of a raw classification's subject, so
+        that swap.digested() can drop classifications of retired
+        subjects before anything else is done with them, and count
+        them.
+
+        Only inactive subjects are in the bitset. Subjects that have
+        been detected, and training subjects past threshold, are not
+        retired (so that detections stay live, and the training set
+        gives the selection function), and are still ignored by
+        Subject.was_described() as before.
+
+    INITIALISATION
+        sample     The collection to find the retired subjects in
+                     (optional)
+
+    METHODS
+        RetiredSubjects.add(ID)        Retire a subject
+        RetiredSubjects.discard(ID)    Bring a subject back
+        ID in RetiredSubjects          Is the subject retired?
+        RetiredSubjects.skip(ID)       Is it? And count it if so
+        RetiredSubjects.size()         No. of retired subjects
+
+    BUGS
+        A classification that is dropped is not counted by its
+        classifier's agent (agent.N), and neither is it passed on to
+        the agent in unsupervised mode: in a hasty run, both used to
+        happen even though the subject had been retired. Volunteers
+        who have only classified retired subjects get no agent at all.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,sample=None,capacity=1024):
+
+        self.codes = {}
+        self.bits = np.zeros(max((capacity+7)/8,1),dtype=np.uint8)
+        self.N = 0
+        self.skipped = 0
+
+        if sample is not None:
+            if isinstance(sample,swap.ArrayCollection):
+                IDs = [sample.names[i] for i in sample.select(state='inactive')]
+            else:
+                IDs = [ID for ID in sample.list() if sample.member[ID].state == 'inactive']
+            for ID in IDs:
+                self.add(ID)
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'index of %d retired subjects' % (self.size())
+
+    def size(self):
+        return self.N
+
+# ----------------------------------------------------------------------------
+# Is this subject retired?
+
+    def __contains__(self,ID):
+
+        code = self.codes.get(ID)
+        if code is None:
+            return False
+
+        return bool((self.bits[code >> 3] >> (code & 7)) & 1)
+
+# Is it? And if so, count one more classification skipped:
+
+    def skip(self,ID):
+
+        if ID in self:
+            self.skipped += 1
+            return True
+
+        return False
+
+# ----------------------------------------------------------------------------
+# Set (or clear) a subject's bit, giving it one first if need be:
+
+    def add(self,ID):
+
+        code = self.code(ID)
+        if not (self.bits[code >> 3] >> (code & 7)) & 1:
+            self.bits[code >> 3] |= (1 << (code & 7))
+            self.N += 1
+
+        return
+
+    def discard(self,ID):
+
+        if ID in self:
+            code = self.codes[ID]
+            self.bits[code >> 3] &= ~np.uint8(1 << (code & 7))
+            self.N -= 1
+
+        return
+
+    def code(self,ID):
+
+        code = self.codes.get(ID)
+        if code is None:
+            code = len(self.codes)
+            self.codes[ID] = code
+            if (code >> 3) == len(self.bits):
+                self.bits = np.concatenate([self.bits,np.zeros(len(self.bits),dtype=np.uint8)])
+
+        return code
+
+# ======================================================================
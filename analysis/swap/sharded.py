@@ -0,0 +1,282 @@
+# ======================================================================
+
+import swap
+
+import numpy as np
+import multiprocessing,zlib
+from batch import gather_agents,scatter_agents,gather_subjects,scatter_subjects,update_states,append_histories
+
+# ======================================================================
+
+"""
+    NAME
+        sharded
+
+    PURPOSE
+        EXPERIMENTAL: apply a chunk of classifications on several
+        processes at once, each looking after its own share of the
+        subjects, and reconciling the agents' confusion matrices between
+        them every so often.
+
+    COMMENTS
+        Subjects only interact with each other through the agents' PL
+        and PD. So: the subjects are dealt out to N_shards shards by a
+        hash of their IDs, and the chunk is cut into windows of
+        N_per_sync classifications, in time order. In each window, every
+        shard's classifications are applied by one worker process, with
+        the batch engine's update_states(), to its subjects and to its
+        own copy of the agents as they were at the start of the window.
+        Each worker sees its own updates to the agents straight away,
+        but the other shards' only at the end of the window, when the
+        agents' changes are merged:
+
+          * agents that only one shard heard from just take that
+            shard's state;
+          * for agents that several shards heard from, the changes in
+            N, NT, NL, ND, the contribution, and the "number correct"
+            PL*NL and PD*ND are added up, and PL and PD recomputed
+            from them (and capped, as in Agent.heard()).
+
+        Histories are appended in the main process, in time order, just
+        as in batch_update(). The confusion matrix realizations are
+        always drawn from keyed streams (see swap.streams), so that they
+        don't depend on which worker draws them; without a seed, one is
+        drawn from the global np.random stream for each chunk.
+
+        With one shard, or N_per_sync = 1, this is the batch engine
+        (with keyed streams), exactly. Otherwise the agents lag behind:
+        each subject's posterior uses confusion matrices that are
+        missing up to one window's worth of the other shards'
+        classifications. The larger the windows, the less time is
+        spent shipping state to and from the workers, and the larger
+        the lag. On a 6000 classification Toy survey (400 subjects,
+        400 volunteers, agents learning from the test subjects),
+        compared with the sequential engine and the same seed, on a
+        single core:
+
+          N_shards  N_per_sync  |dlog10 P|: median   max   decisions   time
+                                                           changed
+          sequential                                                  1.7s
+          batch                                                       0.75s
+             4          10               0.000002  0.25      0        4.7s
+             4         100               0.02      0.38      0        1.6s
+             4        1000               0.15      0.80      2        0.9s
+             4        6000               0.65      2.5       3        1.0s
+
+        (Supervised, the agents' PL and PD come out the same, and no
+        decisions changed until N_per_sync = 6000.) The time per window
+        goes on shipping the agents' and subjects' state to the workers
+        and back, so on one core sharding is always slower than the
+        batch engine; any gain needs many cores, and windows of
+        thousands of classifications.
+
+    FUNCTIONS
+        shard_of(IDs,N_shards):
+
+        take(chunk,rows):
+
+        merge_agents(crowd_state,snapshot,outputs,record=True):
+
+        sharded_update(bureau,sample,chunk,workers,N_per_sync=1000,...):
+
+    BUGS
+        Experimental: the posteriors only approximate those of the
+        sequential engine, as above.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+"""
+
+#=========================================================================
+# Which shard does each subject belong to? (A hash of its ID, so that it
+# stays in the same shard from one chunk, and one batch, to the next.)
+
+def shard_of(IDs,N_shards):
+
+    return np.array([zlib.crc32(str(ID)) & 0xffffffff for ID in IDs],dtype=np.int64) % N_shards
+
+# ----------------------------------------------------------------------------
+# The parts of a chunk that update_states() needs, for the given rows:
+
+def take(chunk,rows):
+
+    return dict([(key,chunk[key][rows]) for key in ['Name','ID','ItWas','ActuallyItWas','Training','At_Time']])
+
+# ----------------------------------------------------------------------------
+# Apply one shard's classifications in a window, in a worker process:
+
+def update_shard(work):
+
+    chunk,agents,subjects,IDs,crowd_state,sample_state,options = work
+    results = update_states(chunk,agents,subjects,IDs,crowd_state,sample_state,**options)
+
+    return crowd_state,sample_state,results
+
+# ----------------------------------------------------------------------------
+# Merge the shards' updated agents back into crowd_state, given its state
+# at the start of the window (snapshot), and a list of (indices, state)
+# from the shards:
+
+def merge_agents(crowd_state,snapshot,outputs,record=True):
+
+    additive = ['N','NT','NL','ND','contribution']
+    touched = np.zeros(len(snapshot['PL']),dtype=int)
+    change = dict([(key,np.zeros(len(snapshot['PL']))) for key in additive+['CL','CD']])
+
+    for ids,state in outputs:
+        touched[ids] += 1
+        for key in additive:
+            change[key][ids] += state[key] - snapshot[key][ids]
+        change['CL'][ids] += state['PL']*state['NL'] - snapshot['PL'][ids]*snapshot['NL'][ids]
+        change['CD'][ids] += state['PD']*state['ND'] - snapshot['PD'][ids]*snapshot['ND'][ids]
+        for key in additive+['PL','PD','skill']:
+            crowd_state[key][ids] = state[key]
+
+    shared = np.where(touched > 1)[0]
+    if len(shared) == 0: return
+
+    for key in additive:
+        crowd_state[key][shared] = snapshot[key][shared] + change[key][shared]
+    PL = (snapshot['PL'][shared]*snapshot['NL'][shared] + change['CL'][shared])/crowd_state['NL'][shared]
+    PD = (snapshot['PD'][shared]*snapshot['ND'][shared] + change['CD'][shared])/crowd_state['ND'][shared]
+    crowd_state['PL'][shared] = np.maximum(np.minimum(PL,swap.PLmax),swap.PLmin)
+    crowd_state['PD'][shared] = np.maximum(np.minimum(PD,swap.PDmax),swap.PDmin)
+    if record:
+        crowd_state['skill'][shared] = swap.expectedInformationGain(0.5,crowd_state['PL'][shared],crowd_state['PD'][shared])
+
+    return
+
+# ----------------------------------------------------------------------------
+
+class ShardWorkers(object):
+    """
+    NAME
+        ShardWorkers
+
+    PURPOSE
+        A pool of processes to apply the shards' classifications on.
+
+    COMMENTS
+        With one shard, the work is just done in this process.
+
+    INITIALISATION
+        N_shards      No. of shards (and processes)
+
+    METHODS
+        ShardWorkers.map(work)     update_shard() each piece of work
+        ShardWorkers.close()       Stop the pool
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,N_shards):
+
+        self.N_shards = N_shards
+        if N_shards > 1:
+            self.pool = multiprocessing.Pool(N_shards)
+        else:
+            self.pool = None
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def map(self,work):
+
+        if self.pool is None:
+            return [update_shard(piece) for piece in work]
+        else:
+            return self.pool.map(update_shard,work)
+
+# ----------------------------------------------------------------------------
+
+    def close(self):
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+        return
+
+# ----------------------------------------------------------------------------
+# Apply a chunk of classifications to the bureau and the sample, shard by
+# shard, reconciling the agents every N_per_sync classifications. The
+# keyword arguments are those of batch_update(). Returns the number of
+# classifications processed.
+
+def sharded_update(bureau,sample,chunk,workers,N_per_sync=1000,while_ignoring=0,haste=False,supervised=False,supervised_and_unsupervised=False,agents_willing_to_learn=False,realize_confusion=True,laplace_smoothing=0,record=True,seed=None,trajectory='full'):
+
+    M = len(chunk['Name'])
+    if M == 0: return 0
+
+    if seed is None: seed = np.random.randint(2**31)
+    options = {'while_ignoring':while_ignoring, 'haste':haste,
+               'supervised':supervised, 'supervised_and_unsupervised':supervised_and_unsupervised,
+               'agents_willing_to_learn':agents_willing_to_learn, 'realize_confusion':realize_confusion,
+               'laplace_smoothing':laplace_smoothing, 'record':record, 'seed':seed}
+
+    # Gather the agents' and subjects' state into arrays:
+    names,agents = np.unique(chunk['Name'],return_inverse=True)
+    crowd,crowd_state = gather_agents(bureau,names)
+    IDs,subjects = np.unique(chunk['ID'],return_inverse=True)
+    members,sample_state = gather_subjects(sample,IDs)
+    shard = shard_of(IDs,workers.N_shards)[subjects]
+
+    results = {}
+    for start in range(0,M,N_per_sync):
+        window = np.arange(start,min(start+N_per_sync,M))
+
+        # Send each shard its classifications, and the agents and
+        # subjects they involve:
+        work,parts = [],[]
+        for k in range(workers.N_shards):
+            rows = window[shard[window] == k]
+            if len(rows) == 0: continue
+            a,local_agents = np.unique(agents[rows],return_inverse=True)
+            s,local_subjects = np.unique(subjects[rows],return_inverse=True)
+            work.append((take(chunk,rows),local_agents,local_subjects,IDs[s],
+                         dict([(key,value[a]) for key,value in crowd_state.items()]),
+                         dict([(key,value[s]) for key,value in sample_state.items()]),
+                         options))
+            parts.append((rows,a,s))
+
+        outputs = workers.map(work)
+
+        # Each subject is in just one shard, but the agents need merging:
+        snapshot = dict([(key,value.copy()) for key,value in crowd_state.items()])
+        merge_agents(crowd_state,snapshot,[(a,output[0]) for (rows,a,s),output in zip(parts,outputs)],record=record)
+
+        for (rows,a,s),(shard_crowd,shard_sample,shard_results) in zip(parts,outputs):
+            for key,value in shard_sample.items():
+                sample_state[key][s] = value
+            for key,value in shard_results.items():
+                if key not in results:
+                    results[key] = np.zeros((M,)+value.shape[1:],dtype=value.dtype)
+                results[key][rows] = value
+
+    # Scatter the agents' state back into the bureau:
+    scatter_agents(bureau,crowd,crowd_state)
+
+    # And the subjects' back into the sample:
+    scatter_subjects(sample,members,sample_state)
+
+    if record: append_histories(chunk,agents,subjects,crowd,members,results,trajectory=trajectory)
+
+    return M
+
+# ======================================================================
@@ -0,0 +1,402 @@
+# ======================================================================
+
+import swap
+
+import os,json,hashlib,cPickle,numpy as np
+
+# ======================================================================
+
+"""
+    NAME
+        snapshot
+
+    PURPOSE
+        Save and load bureaux and collections as directories of numpy
+        columns, instead of as pickles.
+
+    COMMENTS
+        A snapshot is a directory containing:
+
+          manifest.json                  Format, version, flavour, number
+                                           of rows, and a checksum for
+                                           every file
+          columns/<key>.npy              One array per column (PL, NT,
+                                           probability, exposure etc)
+          lists/<key>.npy                Object arrays (names, ZooIDs etc)
+          histories/<name>/lengths.npy   Length of each row's history,
+                                           field by field
+          histories/<name>/<field>.npy   All rows' histories, end to end
+
+        Columns are read memory-mapped (copy-on-write), so changing
+        them in memory does not change the files (they are read through
+        once, to check them - see below). Each row's history is a slice
+        of the concatenated arrays, again without copying: history
+        files are only paged in as they are used.
+
+        When a snapshot is written over an existing one, files whose
+        checksum has not changed are left alone, so only the changed
+        columns are written. Histories only ever grow, so a history is
+        rewritten only when the length of one of its rows has changed.
+        Every file is written to a temporary name and then renamed, so
+        that files still mapped by the running process are not
+        truncated; the manifest is written last.
+
+        A write that dies part way through would leave some new files
+        next to the old manifest. So before any file is written over,
+        the manifest is rewritten with the checksums of the files that
+        are about to change cleared (so that the next write writes them
+        again, whatever they hold); and when a snapshot is read, every
+        column and list is checked against its checksum in the
+        manifest, each history's lengths likewise, and the number of
+        entries in each of its fields against the lengths. A snapshot
+        that does not match its manifest is not read at all. History
+        entries themselves are not checksummed: histories are assumed
+        to be append-only, so that their lengths are enough to tell
+        whether they have changed.
+
+        Snapshots always read back as an ArrayBureau or an
+        ArrayCollection. A Bureau or a Collection is converted when it
+        is written.
+
+    FUNCTIONS
+        write_snapshot(contents,dirname):
+
+        read_snapshot(dirname,flavour=None):
+
+        is_snapshot(dirname):
+
+        convert_pickle(picklefile,dirname=None):
+
+    BUGS
+        A snapshot that a write died part way through cannot be read,
+        and has to be written again from its bureau or collection (or
+        the checkpoint before it used instead).
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+"""
+
+#=========================================================================
+
+snapshot_format = 'SWAP snapshot'
+snapshot_version = 2
+
+# The lists and histories in each flavour of snapshot. Histories are
+# (attribute of the store, fields), where the attribute is a list with
+# one History per row:
+
+snapshot_lists = {'bureau': ['names'],
+                  'collection': ['names', 'ZooID', 'flavor', 'truth',
+                                 'location', 'retirement_time']}
+
+snapshot_histories = {'bureau': {'traininghistory': ('traininghistories', swap.traininghistory_fields),
+                                 'testhistory': ('testhistories', swap.testhistory_fields)},
+                      'collection': {'annotationhistory': ('annotationhistory', swap.annotationhistory_fields),
+                                     'trajectory': ('trajectoryhistory', swap.trajectory_fields)}}
+
+# Version 1 snapshots kept just the ensembles of each trajectory:
+old_trajectory_fields = [('trajectory',float)]
+
+#=========================================================================
+# Is this a snapshot directory?
+
+def is_snapshot(dirname):
+    return dirname is not None and os.path.isfile(os.path.join(dirname,'manifest.json'))
+
+# ----------------------------------------------------------------------------
+# Checksums, to decide which files need writing:
+
+def array_checksum(array):
+    array = np.ascontiguousarray(array)
+    md5 = hashlib.md5(str(array.dtype)+str(array.shape))
+    md5.update(array)
+    return md5.hexdigest()
+
+def object_checksum(array):
+    return hashlib.md5(cPickle.dumps(list(array),protocol=2)).hexdigest()
+
+# ----------------------------------------------------------------------------
+# Make a 1-D object array, without numpy unpacking any list entries:
+
+def object_array(things):
+    array = np.empty(len(things),dtype=object)
+    for i,thing in enumerate(things):
+        array[i] = thing
+    return array
+
+# ----------------------------------------------------------------------------
+# The store's attributes, by name:
+
+def get_rows(store,attribute):
+    if attribute in store.__dict__:
+        return store.__dict__[attribute]
+    return store.lists[attribute]
+
+def set_rows(store,attribute,rows):
+    if attribute in store.__dict__:
+        store.__dict__[attribute] = rows
+    else:
+        store.lists[attribute] = rows
+    return
+
+# ----------------------------------------------------------------------------
+# Write one array to a file in the snapshot, via a temporary file:
+
+def save_array(dirname,filename,array):
+
+    path = os.path.join(dirname,filename)
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    F = open(path+'.tmp','wb')
+    np.save(F,array)
+    F.close()
+    os.rename(path+'.tmp',path)
+
+    return
+
+# ----------------------------------------------------------------------------
+# Read one array from a file in the snapshot. Numerical arrays are
+# memory-mapped, copy-on-write (empty files can't be mapped though):
+
+def load_array(dirname,filename,mapped=True):
+
+    path = os.path.join(dirname,filename)
+    if mapped:
+        try:
+            return np.load(path,mmap_mode='c')
+        except ValueError:
+            pass
+
+    return np.load(path,allow_pickle=True)
+
+# ----------------------------------------------------------------------------
+# Check that a file in a snapshot is the one its manifest describes:
+
+def check_file(dirname,filename,ok):
+
+    if not ok:
+        raise Exception("SWAP: snapshot "+dirname+" does not match its manifest ("+filename+" has changed): was it only partly written?")
+
+    return
+
+# ----------------------------------------------------------------------------
+# Read a snapshot's manifest:
+
+def read_manifest(dirname):
+
+    F = open(os.path.join(dirname,'manifest.json'),'r')
+    manifest = json.load(F)
+    F.close()
+
+    if manifest.get('format') != snapshot_format:
+        raise Exception("SWAP: "+dirname+" is not a snapshot")
+    if manifest['version'] > snapshot_version:
+        raise Exception("SWAP: snapshot "+dirname+" has version "+str(manifest['version'])+", newer than this code can read")
+
+    return manifest
+
+# ----------------------------------------------------------------------------
+# Write a snapshot's manifest, via a temporary file:
+
+def write_manifest(dirname,manifest):
+
+    F = open(os.path.join(dirname,'manifest.json.tmp'),'w')
+    json.dump(manifest,F,indent=1,sort_keys=True)
+    F.close()
+    os.rename(os.path.join(dirname,'manifest.json.tmp'),os.path.join(dirname,'manifest.json'))
+
+    return
+
+#=========================================================================
+# Write out a bureau or collection as a snapshot, writing only the files
+# that have changed since the last snapshot in this directory:
+
+def write_snapshot(contents,dirname):
+
+    if isinstance(contents,swap.ArrayBureau):
+        flavour = 'bureau'
+    elif isinstance(contents,swap.ArrayCollection):
+        flavour = 'collection'
+    elif isinstance(contents,swap.Bureau):
+        flavour = 'bureau'
+        contents = swap.ArrayBureau(contents)
+    elif isinstance(contents,swap.Collection):
+        flavour = 'collection'
+        contents = swap.ArrayCollection(contents)
+    else:
+        raise Exception("SWAP: can only snapshot a bureau or a collection, not "+str(contents))
+
+    if is_snapshot(dirname):
+        manifest = read_manifest(dirname)
+        old = manifest['files']
+    else:
+        manifest = None
+        old = {}
+
+    N = len(contents.names)
+    files = {}
+
+    # Checksums of the columns' contents, and of the lists':
+    for key in contents.columns:
+        files['columns/'+key+'.npy'] = array_checksum(contents.columns[key][:N])
+
+    things = {}
+    for key in snapshot_lists[flavour]:
+        things[key] = object_array(get_rows(contents,key))
+        files['lists/'+key+'.npy'] = object_checksum(things[key])
+
+    # Histories only change by growing, so their lengths will do:
+    lengths = {}
+    for name,(attribute,fields) in snapshot_histories[flavour].items():
+        rows = get_rows(contents,attribute)
+        lengths[name] = np.zeros([N,len(fields)],dtype=int)
+        for i in range(N):
+            if rows[i] is not None:
+                lengths[name][i] = [len(rows[i][key]) for key,kind in fields]
+        checksum = array_checksum(lengths[name])
+        files['histories/'+name+'/lengths.npy'] = checksum
+        for key,kind in fields:
+            files['histories/'+name+'/'+key+'.npy'] = checksum
+
+    changed = set([filename for filename in files if old.get(filename) != files[filename]])
+
+    # Before anything is written over, the old manifest stops vouching
+    # for the files that are about to change, so that if the write dies
+    # part way through, the snapshot can't be read, and the next write
+    # writes them all again:
+    if manifest is not None and len(changed) > 0:
+        for filename in changed:
+            if filename in old:
+                old[filename] = None
+        write_manifest(dirname,manifest)
+
+    # Columns:
+    for key in contents.columns:
+        filename = 'columns/'+key+'.npy'
+        if filename in changed:
+            save_array(dirname,filename,np.ascontiguousarray(contents.columns[key][:N]))
+
+    # Lists:
+    for key in snapshot_lists[flavour]:
+        filename = 'lists/'+key+'.npy'
+        if filename in changed:
+            save_array(dirname,filename,things[key])
+
+    # Histories, concatenated:
+    for name,(attribute,fields) in snapshot_histories[flavour].items():
+        filenames = ['histories/'+name+'/lengths.npy']
+        filenames += ['histories/'+name+'/'+key+'.npy' for key,kind in fields]
+        if not any([filename in changed for filename in filenames]):
+            continue
+
+        rows = get_rows(contents,attribute)
+        save_array(dirname,filenames[0],lengths[name])
+        for key,kind in fields:
+            pieces = [rows[i][key] for i in range(N) if rows[i] is not None]
+            if kind == object:
+                column = object_array([entry for piece in pieces for entry in piece])
+            elif len(pieces) > 0:
+                column = np.concatenate(pieces).astype(kind)
+            else:
+                column = np.zeros(0,dtype=kind)
+            save_array(dirname,'histories/'+name+'/'+key+'.npy',column)
+        changed.update(filenames)
+
+    # Finally, the new manifest:
+    write_manifest(dirname,{'format': snapshot_format,
+                            'version': snapshot_version,
+                            'flavour': flavour,
+                            'size': N,
+                            'files': files})
+
+    return len(changed)
+
+# ----------------------------------------------------------------------------
+# Read in a snapshot, as an ArrayBureau or an ArrayCollection:
+
+def read_snapshot(dirname,flavour=None):
+
+    manifest = read_manifest(dirname)
+    if flavour is not None and manifest['flavour'] != flavour:
+        raise Exception("SWAP: snapshot "+dirname+" holds a "+manifest['flavour']+", not a "+flavour)
+    flavour = manifest['flavour']
+
+    if flavour == 'bureau':
+        contents = swap.ArrayBureau(capacity=0)
+    else:
+        contents = swap.ArrayCollection(capacity=0)
+
+    for filename in manifest['files']:
+        if filename.startswith('columns/'):
+            key = filename[len('columns/'):-len('.npy')]
+            column = load_array(dirname,filename)
+            check_file(dirname,filename,manifest['files'].get(filename) == array_checksum(column))
+            contents.columns[str(key)] = column
+
+    for key in snapshot_lists[flavour]:
+        filename = 'lists/'+key+'.npy'
+        things = load_array(dirname,filename,mapped=False)
+        check_file(dirname,filename,manifest['files'].get(filename) == object_checksum(things))
+        set_rows(contents,key,list(things))
+
+    for name,(attribute,fields) in snapshot_histories[flavour].items():
+        if name == 'trajectory' and manifest['version'] < 2:
+            fields = old_trajectory_fields
+        filename = 'histories/'+name+'/lengths.npy'
+        lengths = load_array(dirname,filename,mapped=False)
+        check_file(dirname,filename,manifest['files'].get(filename) == array_checksum(lengths))
+        ends = np.cumsum(lengths,axis=0)
+        starts = ends - lengths
+        entries = {}
+        for f,(key,kind) in enumerate(fields):
+            filename = 'histories/'+name+'/'+key+'.npy'
+            entries[key] = load_array(dirname,filename,mapped=(kind != object))
+            check_file(dirname,filename,len(entries[key]) == lengths[:,f].sum())
+
+        rows = []
+        for i,Name in enumerate(contents.names):
+            if Name is None:
+                rows.append(None)
+                continue
+            buffers = {}
+            for f,(key,kind) in enumerate(fields):
+                buffers[key] = swap.Buffer.wrap(entries[key][starts[i,f]:ends[i,f]])
+            if fields is old_trajectory_fields:
+                rows.append(swap.migrate_trajectory(buffers['trajectory']))
+            else:
+                history = swap.History([])
+                history.buffers = buffers
+                rows.append(history)
+        set_rows(contents,attribute,rows)
+
+    contents.index = {}
+    for i,Name in enumerate(contents.names):
+        if Name is not None:
+            contents.index[Name] = i
+
+    return contents
+
+# ----------------------------------------------------------------------------
+# Convert an old bureau or collection pickle into a snapshot:
+
+def convert_pickle(picklefile,dirname=None):
+
+    if dirname is None:
+        dirname = os.path.splitext(picklefile)[0]+'.snapshot'
+
+    F = open(picklefile,'rb')
+    contents = cPickle.load(F)
+    F.close()
+
+    write_snapshot(contents,dirname)
+
+    return dirname
+
+#=========================================================================
@@ -0,0 +1,80 @@
+# ======================================================================
+
+import numpy as np
+
+import hashlib
+
+# ======================================================================
+
+"""
+    NAME
+        streams
+
+    PURPOSE
+        Give every classification its own stream of random numbers,
+        keyed on the run's seed, the subject's ID, and how many times
+        the subject had been classified before (its exposure), so that
+        the binomial realizations of the agents' confusion matrices do
+        not depend on the order in which classifications are processed.
+
+    COMMENTS
+        By default, SWAP draws its realizations from the global
+        np.random stream, whose state is saved to random_file between
+        batches. That is reproducible, but only if everything happens in
+        exactly the same order: skip one classification, or split the
+        updates differently, and every later trajectory changes. With a
+        random_seed set, each classification's draws come from a stream
+        that is a pure function of (seed, subject ID, exposure) instead,
+        just as a counter-based generator would provide.
+
+        numpy's counter-based generators (Philox and friends) arrived
+        after the last numpy to support Python 2, so here the key is
+        hashed into a Mersenne Twister seed array, and one RandomState
+        is re-seeded for each classification. Re-seeding costs about as
+        much as the draws themselves.
+
+        The exposure of a subject counts every classification by an
+        agent that is not banned (and that was not skipped by a hasty
+        run), including those from agents who are still being ignored -
+        so each classification of a subject has its own key.
+
+    FUNCTIONS
+        stream_key(seed,ID,exposure):
+
+        keyed_stream(seed,ID,exposure):
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+"""
+
+# The one RandomState that all the keyed streams are drawn from:
+keyed_state = np.random.RandomState()
+
+#=========================================================================
+# The Mersenne Twister seed array for one classification: four words of
+# the MD5 hash of the subject ID, the seed (in two 32-bit words), and the
+# exposure.
+
+def stream_key(seed,ID,exposure):
+
+    words = np.frombuffer(hashlib.md5(str(ID)).digest(),dtype='<u4').tolist()
+    seed = int(seed)
+    return words + [seed & 0xffffffff, (seed >> 32) & 0xffffffff, int(exposure)]
+
+# ----------------------------------------------------------------------------
+# Re-seed the shared RandomState for one classification, and return it.
+# Its draws are only good until the next call:
+
+def keyed_stream(seed,ID,exposure):
+
+    keyed_state.seed(stream_key(seed,ID,exposure))
+    return keyed_state
+
+#=========================================================================
@@ -4,6 +4,10 @@ import swap
 
 import numpy as np
 import pylab as plt
+import math
+
+from history import History
+from trajectories import trajectory_fields, summarise_ensembles, record_trajectory, trajectory_summary, migrate_trajectory
 
 # Every subject starts with the following probability of being a LENS:
 prior = 2e-4
@@ -13,6 +17,21 @@ prior = 2e-4
 Ntrajectory=50
 # This should really be a user-supplied constant, in the configuration.
 
+# The fields of each subject's annotation history:
+annotationhistory_fields = [('Name',object), ('ItWas',int), ('PL',float),
+                            ('PD',float), ('At_X',object), ('At_Y',object),
+                            ('At_Time',object)]
+
+# ======================================================================
+# Log-odds of a probability (or an array of them), and back again:
+
+def logit(p):
+    with np.errstate(divide='ignore'):
+        return np.log(p) - np.log1p(-p)
+
+def expit(x):
+    return 1.0/(1.0 + np.exp(-x))
+
 # ======================================================================
 
 class Subject(object):
@@ -58,6 +77,21 @@ class Subject(object):
         clicked, what they said it was, where they clicked, and their ability
         to tell a lens (PL) and a dud (PD)
 
+        The probability ensemble is stored as log-odds, so that each
+        classification just adds its log likelihood ratio; the
+        probabilities, and their median, are worked out when needed.
+        The mean probability (the geometric mean of the ensemble) is
+        needed after every classification, to test it against the
+        thresholds, so it is worked out from the log-odds directly.
+        Recording the trajectory still needs the probabilities though:
+        only with the trajectory off is the ensemble never converted
+        back.
+
+        How much of the trajectory is recorded depends on the trajectory
+        mode ('off', 'summary' or 'full', see swap.trajectories), passed
+        in when the subject is made and when it is classified. The
+        trajectory plot only needs the summaries.
+
     INITIALISATION
         ID
 
@@ -85,7 +119,7 @@ class Subject(object):
 
 # ----------------------------------------------------------------------
 
-    def __init__(self,ID,ZooID,category,kind,flavor,truth,thresholds,location,prior=2e-4):
+    def __init__(self,ID,ZooID,category,kind,flavor,truth,thresholds,location,prior=2e-4,trajectory='full'):
 
         self.ID = ID
         self.ZooID = ZooID
@@ -103,7 +137,8 @@ class Subject(object):
         self.probability = np.zeros(Ntrajectory)+prior
         self.mean_probability = prior
         self.median_probability = prior
-        self.trajectory = np.zeros(Ntrajectory)+self.probability;
+        self.trajectoryhistory = History(trajectory_fields)
+        record_trajectory(self.trajectoryhistory,self.probability,trajectory)
         self.exposure = 0
 
         self.detection_threshold = thresholds['detection']
@@ -111,16 +146,119 @@ class Subject(object):
 
         self.location = location
 
-        self.annotationhistory = {'Name': np.array([]),
-                            'ItWas': np.array([], dtype=int),
-                            'PL': np.array([]),
-                            'PD': np.array([]),
-                            'At_X': [],
-                            'At_Y': [],
-                            'At_Time': []}
+        self.annotationhistory = History(annotationhistory_fields)
 
         return None
 
+# ----------------------------------------------------------------------
+# Where to note changes of state and status: the log of the collection
+# the subject is in (see swap.Transitions), which is not pickled with
+# it:
+
+    transitions = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('transitions',None)
+        return state
+
+# ----------------------------------------------------------------------
+# Subjects in old pickles have an array or a Buffer for a trajectory, a
+# dictionary for an annotation history, and plain probability and
+# median probability attributes:
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if 'trajectory' in self.__dict__:
+            self.trajectoryhistory = migrate_trajectory(self.__dict__.pop('trajectory'))
+        if 'trajectory_buffer' in self.__dict__:
+            self.trajectoryhistory = migrate_trajectory(self.__dict__.pop('trajectory_buffer'))
+        if 'probability' in self.__dict__:
+            self.probability = self.__dict__.pop('probability')
+        if 'median_probability' in self.__dict__:
+            self.median_probability = self.__dict__.pop('median_probability')
+        self.annotationhistory = History.migrate(self.annotationhistory,annotationhistory_fields)
+        return
+
+# ----------------------------------------------------------------------
+# The probability ensemble is updated as log-odds, so that each
+# classification is just an addition. Whichever of the log-odds and the
+# probabilities was set last is kept, and the other is worked out (once)
+# when it is needed. Setting the probabilities keeps them as they are,
+# scalar or array:
+
+    @property
+    def logodds(self):
+        if self._logodds is None:
+            self._logodds = logit(self._probability)
+        return self._logodds
+
+    @logodds.setter
+    def logodds(self,value):
+        self._logodds = value
+        self._probability = None
+
+    @property
+    def probability(self):
+        if self._probability is None:
+            self._probability = expit(self._logodds)
+        return self._probability
+
+    @probability.setter
+    def probability(self,value):
+        self._logodds = None
+        self._probability = value
+
+# Multiply the odds of a LENS by the given likelihood ratios, one per
+# trajectory (Bayes' theorem), keeping the probabilities above
+# swap.pmin:
+
+    def multiply_odds(self,ratio):
+        self.logodds = np.maximum(self.logodds + np.log(ratio),math.log(swap.pmin) - math.log1p(-swap.pmin))
+        return
+
+# The log of each probability in the ensemble, from the log-odds if they
+# were set last (log p = -log(1 + exp(-x))), without working out the
+# probabilities:
+
+    def log_probability(self):
+        if self._probability is None:
+            return -np.logaddexp(0.0,-self._logodds)
+        return np.log(self._probability)
+
+# The median probability is only needed for reports, so update_state()
+# just sets it to None, and it is worked out when it is asked for:
+
+    @property
+    def median_probability(self):
+        if self._median_probability is None:
+            self._median_probability = np.median(self.probability)
+        return self._median_probability
+
+    @median_probability.setter
+    def median_probability(self,value):
+        self._median_probability = value
+
+# ----------------------------------------------------------------------
+# The trajectory is the probability ensembles recorded so far (and not
+# yet moved to a TrajectoryStore), one after the other, as a read-only
+# array. Assigning to it replaces them, and their summaries:
+
+    @property
+    def trajectory(self):
+        return self.trajectoryhistory['ensembles']
+
+    @trajectory.setter
+    def trajectory(self,value):
+        self.trajectoryhistory = migrate_trajectory(np.asarray(value,dtype=float))
+
+# The 16th, 50th and 84th percentiles of each ensemble recorded, as an
+# array of shape (Nrecorded, 3):
+
+    @property
+    def trajectory_summary(self):
+        return trajectory_summary(self.trajectoryhistory)
+
 # ----------------------------------------------------------------------
 
     def __str__(self):
@@ -134,7 +272,7 @@ class Subject(object):
 # Update probability of LENS, given latest classification:
 #   eg.  sample.member[ID].was_described(by=agent,as_being='LENS',at_time=t)
 
-    def was_described(self,by=None,as_being=None,at_time=None,while_ignoring=0,haste=False,at_x=[-1],at_y=[-1],online=True,record=True,realize_confusion=True,laplace_smoothing=0):
+    def was_described(self,by=None,as_being=None,at_time=None,while_ignoring=0,haste=False,at_x=[-1],at_y=[-1],online=True,record=True,realize_confusion=True,laplace_smoothing=0,seed=None,trajectory='full'):
 
         # TODO: CPD: make likelihood into an attribute?  if so, I need to
         # probably wipe it here to avoid silent bugs (likelihood not updating,
@@ -174,13 +312,13 @@ class Subject(object):
             # update the annotation history
             if record:
                 as_being_dict = {'LENS': 1, 'NOT': 0}
-                self.annotationhistory['Name'] = np.append(self.annotationhistory['Name'], by.name)
-                self.annotationhistory['ItWas'] = np.append(self.annotationhistory['ItWas'], as_being_dict[as_being])
-                self.annotationhistory['At_X'].append(at_x)
-                self.annotationhistory['At_Y'].append(at_y)
-                self.annotationhistory['PL'] = np.append(self.annotationhistory['PL'], by.PL)
-                self.annotationhistory['PD'] = np.append(self.annotationhistory['PD'], by.PD)
-                self.annotationhistory['At_Time'].append(at_time)
+                self.annotationhistory.append(Name=by.name,
+                                              ItWas=as_being_dict[as_being],
+                                              At_X=at_x,
+                                              At_Y=at_y,
+                                              PL=by.PL,
+                                              PD=by.PD,
+                                              At_Time=at_time)
 
         # Deal with active subjects. Ignore the classifier until they
         # have seen NT > a_few_at_the_start (ie they've had a
@@ -189,56 +327,59 @@ class Subject(object):
             if by.NT > a_few_at_the_start:
 
                 # Calculate likelihood for all Ntrajectory trajectories, generating as many binomial deviates
+                # (from this classification's own stream, if we have a seed):
                 if realize_confusion:
 
-                    PL_realization=by.get_PL_realization(Ntrajectory);
-                    PD_realization=by.get_PD_realization(Ntrajectory);
+                    if seed is None: stream = None
+                    else: stream = swap.keyed_stream(seed,self.ID,self.exposure)
+                    PL_realization=by.get_PL_realization(Ntrajectory,stream);
+                    PD_realization=by.get_PD_realization(Ntrajectory,stream);
                 else:
                     PL_realization=np.ones(Ntrajectory) * by.PL
                     PD_realization=np.ones(Ntrajectory) * by.PD
-                prior_probability=self.probability*1.0;  # TODO: not used?!
 
+                # How likely was this result, if the subject is a LENS
+                # (M_lens), and if it is NOT (M_not)?
                 if as_being == 'LENS':
-                    likelihood = PL_realization + laplace_smoothing
-                    likelihood /= (PL_realization*self.probability + (1-PD_realization)*(1-self.probability) + 2 * laplace_smoothing)
+                    M_lens,M_not = PL_realization,1-PD_realization
                     as_being_number = 1
 
                 elif as_being == 'NOT':
-                    likelihood = (1-PL_realization) + laplace_smoothing
-                    likelihood /= ((1-PL_realization)*self.probability + PD_realization*(1-self.probability) + 2 * laplace_smoothing)
+                    M_lens,M_not = 1-PL_realization,PD_realization
                     as_being_number = 0
 
                 else:
                     raise Exception("Unrecognised classification result: "+as_being)
 
-                if online:
+                if online and laplace_smoothing == 0:
                     # Update subject:
-                    self.probability = likelihood*self.probability
-                    idx=np.where(self.probability < swap.pmin)
-                    self.probability[idx]=swap.pmin
-                    #if self.probability < swap.pmin: self.probability = swap.pmin
-                    posterior_probability=self.probability*1.0;
+                    self.multiply_odds(M_lens/M_not)
+
+                else:
+                    likelihood = M_lens + laplace_smoothing
+                    likelihood /= (M_lens*self.probability + M_not*(1-self.probability) + 2 * laplace_smoothing)
+                    if not online:
+                        return likelihood
 
-                    self.trajectory = np.append(self.trajectory,self.probability)
+                    # Update subject (smoothed, so not in log-odds):
+                    self.probability = np.maximum(likelihood*self.probability,swap.pmin)
 
-                    self.exposure += 1
+                record_trajectory(self.trajectoryhistory,self.probability,trajectory)
 
-                    self.update_state(at_time)
+                self.exposure += 1
 
-                    # Update agent - training history is taken care of in agent.heard(),
-                    # which also keeps agent.skill up to date.
-                    if self.kind == 'test' and record:
+                self.update_state(at_time)
 
-                         by.testhistory['ID'] = np.append(by.testhistory['ID'], self.ID)
-                         by.testhistory['I'] = np.append(by.testhistory['I'], swap.informationGain(self.mean_probability, by.PL, by.PD, as_being))
-                         by.testhistory['Skill'] = np.append(by.testhistory['Skill'], by.skill)
-                         by.testhistory['ItWas'] = np.append(by.testhistory['ItWas'], as_being_number)
-                         by.testhistory['At_Time'] = np.append(by.testhistory['At_Time'], at_time)
-                         by.contribution += by.skill
+                # Update agent - training history is taken care of in agent.heard(),
+                # which also keeps agent.skill up to date.
+                if self.kind == 'test' and record:
 
-                else:
-                    # offline
-                    return likelihood
+                     by.testhistory.append(ID=self.ID,
+                                           I=swap.informationGain(self.mean_probability, by.PL, by.PD, as_being),
+                                           Skill=by.skill,
+                                           ItWas=as_being_number,
+                                           At_Time=at_time)
+                     by.contribution += by.skill
 
 
             else:
@@ -278,16 +419,17 @@ class Subject(object):
 # Update mean and median probability, status, retirement
 
     def update_state(self,at_time=None):
-        # check if iterable
-        try: iterator = iter(self.probability)
-        except TypeError:
+        was = (self.state,self.status)
+        log_probability = self.log_probability()
+        # check if scalar
+        if np.ndim(log_probability) == 0:
             self.mean_probability=self.probability
             self.median_probability=self.mean_probability
         else:
-            # is iterable
-            # Update median probability
-            self.mean_probability=10.0 ** np.mean(np.log10(self.probability))
-            self.median_probability=np.median(self.probability)
+            # Update mean probability, the geometric mean of the
+            # ensemble (the median can wait until it is wanted)
+            self.mean_probability=np.exp(np.mean(log_probability))
+            self.median_probability=None
 
         # Should we count it as a detection, or a rejection?
         # Only test subjects get de-activated:
@@ -320,6 +462,10 @@ class Subject(object):
                 self.retirement_time = 'not yet'
                 self.retirement_age = 0.0
 
+        # Note any change in the collection's log:
+        if self.transitions is not None and (self.state,self.status) != was:
+            self.transitions.note(self.ID,*was)
+
 
 # ----------------------------------------------------------------------
 # Plot subject's trajectory, as an overlay on an existing plot:
@@ -327,18 +473,18 @@ class Subject(object):
     def plot_trajectory(self,axes,highlight=False):
 
         plt.sca(axes[0])
-        N = np.linspace(0, len(self.trajectory)/Ntrajectory+1, len(self.trajectory)/Ntrajectory, endpoint=True);
+        # With no trajectory recorded, just mark where the subject is now:
+        summary = self.trajectory_summary
+        n = len(summary)
+        if n == 0:
+            summary = summarise_ensembles(self.probability)
+            n = self.exposure+1
+        N = np.linspace(0, n+1, n, endpoint=True);
         N[0] = 0.5
-        mdn_trajectory=np.array([]);
-        sigma_trajectory_m=np.array([]);
-        sigma_trajectory_p=np.array([]);
-        for i in range(len(N)):
-	    sorted_arr=np.sort(self.trajectory[i*Ntrajectory:(i+1)*Ntrajectory])
-            sigma_p=sorted_arr[int(0.84*Ntrajectory)]-sorted_arr[int(0.50*Ntrajectory)]
-            sigma_m=sorted_arr[int(0.50*Ntrajectory)]-sorted_arr[int(0.16*Ntrajectory)]
-            mdn_trajectory=np.append(mdn_trajectory,sorted_arr[int(0.50*Ntrajectory)]);
-            sigma_trajectory_p=np.append(sigma_trajectory_p,sigma_p);
-            sigma_trajectory_m=np.append(sigma_trajectory_m,sigma_m);
+        N = N[-len(summary):]
+        mdn_trajectory=summary[:,1]
+        sigma_trajectory_p=summary[:,2]-summary[:,1]
+        sigma_trajectory_m=summary[:,1]-summary[:,0]
 
         if self.kind == 'sim':
             colour = 'blue'
@@ -386,3 +532,153 @@ class Subject(object):
         # if self.kind == 'sim': print self.trajectory[-1], N[-1]
 
         return
+
+# Codes for the categorical attributes of subjects in an ArrayCollection:
+subject_codes = {'kind': ['test', 'sim', 'dud'],
+                 'category': ['test', 'training'],
+                 'status': ['undecided', 'detected', 'rejected'],
+                 'state': ['active', 'inactive']}
+
+# ----------------------------------------------------------------------
+# Make properties that read and write one element of a collection's
+# column arrays, integer-coded columns, or lists of strings:
+
+def collection_column(key):
+
+    def get(self):
+        return self.collection.columns[key][self.index]
+
+    def set(self,value):
+        self.collection.columns[key][self.index] = value
+
+    return property(get,set)
+
+def collection_code(key):
+
+    def get(self):
+        return subject_codes[key][self.collection.columns[key][self.index]]
+
+    def set(self,value):
+        self.collection.columns[key][self.index] = subject_codes[key].index(value)
+
+    return property(get,set)
+
+def collection_list(key):
+
+    def get(self):
+        return self.collection.lists[key][self.index]
+
+    def set(self,value):
+        self.collection.lists[key][self.index] = value
+
+    return property(get,set)
+
+# ======================================================================
+
+class SubjectView(Subject):
+    """
+    NAME
+        SubjectView
+
+    PURPOSE
+        A Subject whose state is stored in the columns of an
+        ArrayCollection.
+
+    COMMENTS
+        A SubjectView behaves just like a Subject, but its probability
+        ensemble is row `index` of its collection's 2-D probability
+        array, its kind, category, status and state are integer codes,
+        and its other attributes and histories are kept in the
+        collection's lists. Note that self.probability is a view onto
+        the collection's array, so modifying it in place modifies the
+        collection.
+
+        The columns hold probabilities, not log-odds (the batch engine
+        works on them), so a SubjectView multiplies the odds in
+        probability space, converts its log-odds to and from them, and
+        has its median probability worked out straight away by
+        update_state().
+
+    INITIALISATION
+        collection, index
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------
+
+    def __init__(self,collection,index):
+        self.collection = collection
+        self.index = index
+        return None
+
+    mean_probability = collection_column('mean_probability')
+    exposure = collection_column('exposure')
+    retirement_age = collection_column('retirement_age')
+    detection_threshold = collection_column('detection_threshold')
+    rejection_threshold = collection_column('rejection_threshold')
+
+    kind = collection_code('kind')
+    category = collection_code('category')
+    status = collection_code('status')
+    state = collection_code('state')
+
+    ZooID = collection_list('ZooID')
+    flavor = collection_list('flavor')
+    truth = collection_list('truth')
+    location = collection_list('location')
+    retirement_time = collection_list('retirement_time')
+    trajectoryhistory = collection_list('trajectoryhistory')
+    annotationhistory = collection_list('annotationhistory')
+
+    @property
+    def ID(self):
+        return self.collection.names[self.index]
+
+    @property
+    def transitions(self):
+        return self.collection.transitions
+
+    @property
+    def probability(self):
+        return self.collection.columns['probability'][self.index]
+
+    @probability.setter
+    def probability(self,value):
+        self.collection.columns['probability'][self.index] = value
+
+    @property
+    def logodds(self):
+        return logit(self.probability)
+
+    @logodds.setter
+    def logodds(self,value):
+        self.probability = expit(value)
+
+    def multiply_odds(self,ratio):
+        p = ratio*self.probability
+        self.probability = np.maximum(p/(p + (1-self.probability)),swap.pmin)
+        return
+
+    def log_probability(self):
+        return np.log(self.probability)
+
+    # None (from update_state()) means: work it out from the ensemble.
+    @property
+    def median_probability(self):
+        return self.collection.columns['median_probability'][self.index]
+
+    @median_probability.setter
+    def median_probability(self,value):
+        if value is None: value = np.median(self.probability)
+        self.collection.columns['median_probability'][self.index] = value
+
+# ======================================================================
@@ -2,7 +2,9 @@
 
 import numpy as np
 
-import datetime,sys
+import datetime,time,sys
+
+from record import make_record
 
 # ======================================================================
 
@@ -16,12 +18,19 @@ class ToyDB(object):
         (except using standard dictionaries).
 
     COMMENTS
+        Each classification has an _id, its position in the table, so
+        that find() can hand them out in the same (updated_at, _id)
+        order as MongoDB.find(), and carry on from where the last batch
+        got to.
 
     INITIALISATION
         From scratch.
 
     METHODS AND VARIABLES
         ToyDB.get_classification()
+        ToyDB.find(word,t,after=None)
+        ToyDB.digest(classification,survey=None,method=False)
+        ToyDB.subject_of(classification)
 
     BUGS
 
@@ -32,6 +41,8 @@ class ToyDB(object):
 
     HISTORY
       2013-04-18  Started Marshall (Oxford)
+      2026-10-18  digest() returns a Record, like MongoDB.digest()
+      2026-10-18  find() sorts by (updated_at, _id), and resumes by key
     """
 
 # ----------------------------------------------------------------------------
@@ -59,6 +70,9 @@ class ToyDB(object):
         try: self.difficulty = int(pars['difficulty']) # Mean no. of classifications per person
         except: self.difficulty = 0.5
 
+        try: self.stage = int(pars['stage']) # Stage the classifications are made at
+        except: self.stage = 1
+
         self.classifiers = self.populate('classifiers')
 
         self.trainingset = self.populate('subjects',category='training')
@@ -112,13 +126,16 @@ class ToyDB(object):
                 if subject['category'] == 'training':
                     if np.random.rand() > 0.5:
                         subject['kind'] = 'sim'
+                        subject['flavor'] = 'lensed galaxy'
                         subject['truth'] = 'LENS'
                     else:
                         subject['kind'] = 'dud'
+                        subject['flavor'] = 'dud'
                         subject['truth'] = 'NOT'
 
                 elif subject['category'] == 'test':
                     subject['kind'] = 'test'
+                    subject['flavor'] = 'test'
                     subject['truth'] = 'UNKNOWN'
                     # But we do actually need to know what this is!
                     if np.random.rand() < self.prior:
@@ -145,10 +162,14 @@ class ToyDB(object):
 
                 subject = self.pick_one('subjects',classifier=classifier)
 
+                classification['_id'] = i
                 classification['updated_at'] = t
                 classification['ID'] = subject['ID']
+                classification['ZooID'] = subject['ZooID']
                 classification['category'] = subject['category']
                 classification['kind'] = subject['kind']
+                classification['flavor'] = subject['flavor']
+                classification['location'] = subject['location']
                 classification['truth'] = subject['truth']
                 classification['result'] = \
                   self.make_classification(subject=subject,classifier=classifier)
@@ -267,25 +288,50 @@ class ToyDB(object):
         return word
 
 # ----------------------------------------------------------------------------
-# Return a tuple of the key quantities:
+# Return a Record of the key quantities, just like MongoDB.digest:
+
+    def digest(self,C,survey=None,method=False):
+
+        # Toy classifications have no clicks, and are all made at the
+        # current stage. (Older Toy databases have no ZooIDs, flavors or
+        # locations either.)
+        ID = C['ID']
+        flavor = C.get('flavor',C['kind'])
+        location = C.get('location',None)
+        return make_record(C['updated_at'],C['Name'],ID,C.get('ZooID',ID),C['category'],C['kind'],flavor,C['result'],C['truth'],str(location),self.stage,[],[],key=(C['updated_at'],C['_id']))
 
-    def digest(self,C):
+# ----------------------------------------------------------------------------
+# Return the ID of a classification's subject, without digesting it:
 
-        return str(C['updated_at']),C['Name'],C['ID'],C['ZooID'],C['category'],C['kind'],C['result'],C['truth'],C['location']
+    def subject_of(self,C):
+        return C['ID']
 
 # ----------------------------------------------------------------------------
 # Return a batch of classifications, defined by a time range - either
-# claasifications made 'since' t, or classifications made 'before' t:
+# claasifications made 'since' t, or classifications made 'before' t -
+# in order of time, and then _id (their position in the table), as Mongo
+# does. Given the key of the last classification done, (time, _id) as
+# from swap.read_key(), 'since' carries on straight after it instead.
+
+    def find(self,word,t,after=None):
 
-    def find(self,word,t):
+       # Old Toy databases' classifications have no _id:
+       for k,classification in enumerate(self.classifications):
+           classification.setdefault('_id',k)
 
        batch = []
 
        if word == 'since':
 
-            for classification in self.classifications:
-                if classification['updated_at'] > t:
-                    batch.append(classification)
+            if after is None:
+                for classification in self.classifications:
+                    if classification['updated_at'] > t:
+                        batch.append(classification)
+            else:
+                after = (after[0],int(after[1]))
+                for classification in self.classifications:
+                    if (classification['updated_at'],classification['_id']) > after:
+                        batch.append(classification)
 
        elif word == 'before':
 
@@ -296,6 +342,8 @@ class ToyDB(object):
        else:
            print "ToyDB: error, cannot find classifications '"+word+"' "+str(t)
 
+       batch.sort(key=lambda classification: (classification['updated_at'],classification['_id']))
+
        return batch
 
 # ----------------------------------------------------------------------------
@@ -331,6 +379,112 @@ class ToyDB(object):
 
 # ======================================================================
 
+class ToyStream(ToyDB):
+    """
+    NAME
+        ToyStream
+
+    PURPOSE
+        Stand in for a live database: serve up a Toy database's
+        classifications a few at a time, as if they were being made
+        now.
+
+    COMMENTS
+        The Toy classifications are made, in order, rate per second
+        from when find() is first called: each one only turns up in
+        find() once it has been made, with its updated_at set to when
+        that was. So SWAPD.py can tail it just as it tails the Mongo,
+        and the time from updated_at to a subject being published is
+        the real latency.
+
+        The classifications made so far are the stream's table, so
+        digest(), subject_of() and find() work just as they do for the
+        ToyDB - and a pickled ToyStream carries on where it left off.
+
+    INITIALISATION
+        db          The ToyDB to take the classifications from
+        rate        No. of classifications made per second
+
+    METHODS AND VARIABLES
+        ToyStream.find(word,t,after=None)
+        ToyStream.release()          Make the classifications due by now
+        ToyStream.backlog()          No. still to be made
+
+    BUGS
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,db,rate=100.0):
+
+        # Everything about the Toy database but its classifications,
+        # which are only made as time goes on:
+        self.__dict__.update(db.__dict__)
+        for k,classification in enumerate(db.classifications):
+            classification.setdefault('_id',k)
+        self.unmade = sorted(db.classifications,key=lambda classification: (classification['updated_at'],classification['_id']))
+        self.classifications = []
+
+        self.rate = float(rate)
+        self.started = None
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'stream of %d Toy classifications, at %g per second' % (self.size()+self.backlog(),self.rate)
+
+    def backlog(self):
+        return len(self.unmade)
+
+# ----------------------------------------------------------------------------
+# Make the classifications that are due by now:
+
+    def release(self):
+
+        now = time.time()
+        if self.started is None:
+            self.started,self.N_started = now,len(self.classifications)
+
+        N = min(int((now-self.started)*self.rate) + self.N_started - len(self.classifications),len(self.unmade))
+        N = max(N,0)
+        for classification in self.unmade[:N]:
+            classification = dict(classification)
+            k = len(self.classifications) - self.N_started
+            classification['updated_at'] = datetime.datetime.utcfromtimestamp(self.started + k/self.rate)
+            self.classifications.append(classification)
+        del self.unmade[:N]
+
+        return N
+
+# ----------------------------------------------------------------------------
+# Return a batch of the classifications made so far, as ToyDB.find():
+
+    def find(self,word,t,after=None):
+
+        self.release()
+
+        return ToyDB.find(self,word,t,after=after)
+
+# ----------------------------------------------------------------------------
+# The clock starts again when a pickled stream is read back in:
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['started'] = None
+        return state
+
+# ======================================================================
+
 if __name__ == '__main__':
 
     db = ToyDB()
@@ -351,9 +505,9 @@ if __name__ == '__main__':
 
         items = db.digest(classification)
 
-        # Check we got all 7 items:
+        # Check we got all 14 items:
         if items is not None:
-            if len(items) != 7:
+            if len(items) != 14:
                 print "oops! ",items[:]
             else:
                 # Count classifications
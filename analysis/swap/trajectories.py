@@ -0,0 +1,354 @@
+# ======================================================================
+
+import swap
+
+import os,json,zipfile,zlib,numpy as np
+
+from history import Buffer, History
+
+# ======================================================================
+
+"""
+    NAME
+        trajectories
+
+    PURPOSE
+        Record subjects' trajectories - their probability ensembles,
+        one after each classification - as compactly as the reports
+        need them, and keep the full ensembles, if they are wanted at
+        all, out of the collection.
+
+    COMMENTS
+        Each subject has a trajectory history with two fields: the
+        summary, which is the 16th, 50th and 84th percentiles of each
+        ensemble (3 numbers per classification - all that
+        Subject.plot_trajectory() draws), and the ensembles themselves
+        (Ntrajectory = 50 numbers, 400 bytes, per classification). How
+        much is recorded is set by the trajectory mode:
+
+          off       Nothing
+          summary   Just the summary
+          full      The ensembles
+
+        The ensembles field holds the latest part of the trajectory, and
+        the summary everything before it: in full mode, the ensembles are
+        only summarised when they are folded into the summary, which
+        saves sorting every ensemble as it is recorded. They are folded
+        when they are moved out of the collection into a TrajectoryStore
+        (which can happen whenever the collection is written, so that
+        the collection only ever holds the ensembles recorded since
+        then), and when a subject with ensembles is next classified in
+        summary mode (which drops them). The store is a directory of zip
+        archives, with each subject in one of them (by a hash of its
+        ID), and each flush of a subject's ensembles a separate
+        compressed member, so writing only ever appends. Reading a
+        subject's trajectory only opens (and decompresses) what that
+        subject needs.
+
+        The collection, not the store, says how much of a trajectory
+        there is: each member is named by where its ensembles start in
+        the trajectory (the length of the subject's summary when it was
+        flushed) and how many there are, so flushing the same ensembles
+        again writes nothing, and when the store is read, only the
+        ensembles before the ones still in the collection are used.
+        Ensembles flushed from a collection that was then never saved
+        (or was rolled back) are just ignored, and flushed again, with
+        whatever has been added to them, from the collection that was.
+
+    FUNCTIONS
+        summarise_ensembles(ensembles):
+
+        record_trajectory(history,ensembles,trajectory='full'):
+
+        fold_trajectory(history):
+
+        trajectory_summary(history):
+
+        migrate_trajectory(old):
+
+        TrajectoryStore(dirname,N_archives=64)
+
+    BUGS
+        Archives are appended to in place, so a store is left broken if
+        the process dies part way through a flush. Ensembles flushed
+        from a collection that was never saved stay in the store, unused.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+"""
+
+#=========================================================================
+
+trajectory_modes = ['off', 'summary', 'full']
+
+# The fields of each subject's trajectory history, both flattened, one
+# summary (or ensemble) after another:
+trajectory_fields = [('summary',float), ('ensembles',float)]
+
+# The percentiles in each summary, and which elements of a sorted
+# ensemble of N they are, by N:
+trajectory_percentiles = [0.16, 0.50, 0.84]
+trajectory_ranks = {}
+
+#=========================================================================
+# The summary of one ensemble, or of each row of a 2-D array of them:
+# the same elements of the sorted ensemble that the trajectory plots
+# have always used, as an array of shape (Nensembles, 3).
+
+def summarise_ensembles(ensembles):
+
+    N = np.shape(ensembles)[-1]
+    if N not in trajectory_ranks:
+        trajectory_ranks[N] = [int(fraction*N) for fraction in trajectory_percentiles]
+
+    return np.sort(ensembles,axis=-1).take(trajectory_ranks[N],axis=-1).reshape(-1,3)
+
+# ----------------------------------------------------------------------------
+# Add one ensemble, or a 2-D array of them, to a trajectory history, as
+# much of them as the trajectory mode asks for. (This happens after
+# every classification, so the buffers are extended directly.)
+
+def record_trajectory(history,ensembles,trajectory='full'):
+
+    if trajectory == 'full':
+        history.buffers['ensembles'].extend(np.ravel(ensembles))
+
+    elif trajectory == 'summary':
+        if len(history.buffers['ensembles']) > 0:
+            fold_trajectory(history)
+        history.buffers['summary'].extend(summarise_ensembles(ensembles).ravel())
+
+    return
+
+# ----------------------------------------------------------------------------
+# Summarise a trajectory history's ensembles, and drop them:
+
+def fold_trajectory(history):
+
+    ensembles = history['ensembles']
+    if len(ensembles) > 0:
+        history.buffers['summary'].extend(summarise_ensembles(ensembles.reshape(-1,swap.Ntrajectory)).ravel())
+        history['ensembles'] = []
+
+    return
+
+# ----------------------------------------------------------------------------
+# The summaries of the whole of a trajectory history, as an array of
+# shape (Nrecorded, 3):
+
+def trajectory_summary(history):
+
+    summary = history['summary'].reshape(-1,3)
+    ensembles = history['ensembles']
+    if len(ensembles) > 0:
+        summary = np.concatenate([summary,summarise_ensembles(ensembles.reshape(-1,swap.Ntrajectory))])
+
+    return summary
+
+# ----------------------------------------------------------------------------
+# Old pickles and snapshots have a trajectory that is just the
+# ensembles, as an array or a Buffer: make a trajectory history from
+# them.
+
+def migrate_trajectory(old):
+
+    if old is None or isinstance(old,History):
+        return old
+    if isinstance(old,Buffer):
+        old = old.view()
+
+    return History(trajectory_fields,values={'ensembles':old})
+
+# ======================================================================
+
+class TrajectoryStore(object):
+    """
+    NAME
+        TrajectoryStore
+
+    PURPOSE
+        Keep subjects' full trajectories on disk, compressed, out of the
+        collection.
+
+    COMMENTS
+        The store is a directory holding store.json (the format, and
+        the number of archives), and N_archives zip archives. Subject
+        ID's ensembles are in archive crc32(ID) % N_archives, as
+        members ID/start+N, one per flush, each the raw float64
+        ensembles (N of them, from the start'th classification on),
+        deflated. Archives are only opened for reading when a trajectory
+        in them is asked for.
+
+    INITIALISATION
+        dirname      The store's directory (made if need be)
+        N_archives   No. of archives, for a new store
+
+    METHODS
+        TrajectoryStore.flush(sample)         Move the sample's ensembles in
+        TrajectoryStore.write(ensembles)      Add {ID: (start,ensembles)} to the store
+        TrajectoryStore.read(ID,upto=None)    A subject's stored ensembles
+        TrajectoryStore.trajectory(subject)   A subject's full trajectory
+        TrajectoryStore.close()               Close any open archives
+
+    BUGS
+        See the module docstring.
+
+    AUTHORS
+      This file is part of the Space Warps project, and is distributed
+      under the MIT license by the Space Warps Science Team.
+      http://spacewarps.org/
+
+    HISTORY
+      2026-10-18  Started.
+    """
+
+# ----------------------------------------------------------------------------
+
+    def __init__(self,dirname,N_archives=64):
+
+        self.dirname = dirname
+        manifest = os.path.join(dirname,'store.json')
+        if os.path.isfile(manifest):
+            F = open(manifest,'r')
+            self.N_archives = json.load(F)['archives']
+            F.close()
+        else:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self.N_archives = N_archives
+            F = open(manifest,'w')
+            json.dump({'format': 'SWAP trajectory store', 'version': 2, 'archives': N_archives},F,indent=1,sort_keys=True)
+            F.close()
+
+        # Archives open for reading, and their members, by subject ID:
+        self.archives = {}
+        self.members = {}
+
+        return None
+
+# ----------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'trajectory store in %s' % self.dirname
+
+# ----------------------------------------------------------------------------
+# Which archive is a subject in?
+
+    def archive_of(self,ID):
+        return (zlib.crc32(str(ID)) & 0xffffffff) % self.N_archives
+
+    def path(self,k):
+        return os.path.join(self.dirname,'%03d.zip' % k)
+
+# ----------------------------------------------------------------------------
+# The members of an open archive, by subject ID, as (start, N, name), in
+# order of where they start:
+
+    def index(self,archive):
+
+        members = {}
+        for name in archive.namelist():
+            ID,extent = name.rsplit('/',1)
+            start,N = extent.split('+')
+            members.setdefault(ID,[]).append((int(start),int(N),name))
+        for ID in members:
+            members[ID].sort()
+
+        return members
+
+# ----------------------------------------------------------------------------
+# Add a dictionary of {ID: (start, ensembles)} to the store, one archive
+# at a time. Ensembles that are already there are not written again.
+# (Archives can hold more than 65535 members, so they need ZIP64.)
+
+    def write(self,ensembles):
+
+        archives = {}
+        for ID in ensembles:
+            archives.setdefault(self.archive_of(ID),[]).append(ID)
+
+        for k,IDs in archives.items():
+            self.close(k)
+            archive = zipfile.ZipFile(self.path(k),'a',zipfile.ZIP_DEFLATED,allowZip64=True)
+            for ID in IDs:
+                start,these = ensembles[ID]
+                these = np.ascontiguousarray(these,dtype=float)
+                name = '%s/%d+%d' % (ID,start,len(these)/swap.Ntrajectory)
+                if name not in archive.NameToInfo:
+                    archive.writestr(name,these.tostring())
+            archive.close()
+
+        return
+
+# ----------------------------------------------------------------------------
+# Move the ensembles recorded in a sample's trajectory histories into the
+# store, leaving just their summaries. Returns the number of subjects
+# whose ensembles were moved:
+
+    def flush(self,sample):
+
+        histories = {}
+        for ID in sample.list():
+            history = sample.member[ID].trajectoryhistory
+            if history is not None and len(history['ensembles']) > 0:
+                histories[ID] = history
+
+        self.write(dict([(ID,(len(history['summary'])/3,history['ensembles'])) for ID,history in histories.items()]))
+        for history in histories.values():
+            fold_trajectory(history)
+
+        return len(histories)
+
+# ----------------------------------------------------------------------------
+# Read a subject's ensembles from the store, flattened, in order, each
+# classification's once, and only those before the upto'th if given:
+
+    def read(self,ID,upto=None):
+
+        k = self.archive_of(ID)
+        if k not in self.archives:
+            if not os.path.isfile(self.path(k)):
+                return np.zeros(0)
+            self.archives[k] = zipfile.ZipFile(self.path(k),'r',allowZip64=True)
+            self.members[k] = self.index(self.archives[k])
+
+        pieces,end = [],0
+        for start,N,name in self.members[k].get(str(ID),[]):
+            if upto is not None:
+                N = min(N,upto-start)
+            if start+N <= end:
+                continue
+            piece = np.frombuffer(self.archives[k].read(name),dtype=float)
+            pieces.append(piece[(max(end,start)-start)*swap.Ntrajectory:N*swap.Ntrajectory])
+            end = start+N
+        if len(pieces) == 0:
+            return np.zeros(0)
+
+        return np.concatenate(pieces)
+
+# A subject's whole trajectory: what is in the store, followed by what
+# is still in the collection (which starts after the summary).
+
+    def trajectory(self,subject):
+        upto = len(subject.trajectoryhistory['summary'])/3
+        return np.concatenate([self.read(subject.ID,upto),subject.trajectory])
+
+# ----------------------------------------------------------------------------
+
+    def close(self,k=None):
+
+        if k is None:
+            for k in self.archives.keys():
+                self.close(k)
+        elif k in self.archives:
+            self.archives.pop(k).close()
+            self.members.pop(k)
+
+        return
+
+# ======================================================================
@@ -0,0 +1,9 @@
+# ======================================================================
+# Tests of the swap package, and of SWAP.py. Run them from the analysis
+# directory, with
+#
+#   python -m unittest discover -s tests -t .
+#
+# They make a small Toy database, and run SWAP on it, in temporary
+# directories.
+# ======================================================================
@@ -0,0 +1,50 @@
+# ======================================================================
+
+import unittest
+
+import numpy as np
+
+from tests.toy import Workspace
+
+# ======================================================================
+# The batch engine gives the same answers as the sequential one, as
+# long as each classification's confusion matrix realizations come from
+# its own stream (random_seed):
+
+class BatchEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = Workspace()
+
+    def tearDown(self):
+        self.workspace.remove()
+
+    def test_seeded_batch_matches_sequential(self):
+
+        self.workspace.run('sequential',engine='sequential',random_seed=5)
+        self.workspace.run('batch',engine='batch',N_per_chunk=200,random_seed=5)
+
+        bureau,sample = self.workspace.state('sequential')
+        batch_bureau,batch_sample = self.workspace.state('batch')
+
+        self.assertEqual(sorted(sample.list()),sorted(batch_sample.list()))
+        for ID in sample.list():
+            subject,other = sample.member[ID],batch_sample.member[ID]
+            self.assertTrue(np.allclose(np.log(subject.probability),np.log(other.probability),rtol=0,atol=1e-10))
+            self.assertEqual((subject.state,subject.status,subject.exposure),(other.state,other.status,other.exposure))
+
+        self.assertEqual(sorted(bureau.list()),sorted(batch_bureau.list()))
+        for Name in bureau.list():
+            agent,other = bureau.member[Name],batch_bureau.member[Name]
+            self.assertAlmostEqual(agent.PL,other.PL,places=12)
+            self.assertAlmostEqual(agent.PD,other.PD,places=12)
+            self.assertEqual((agent.N,agent.NT),(other.N,other.NT))
+
+        return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ======================================================================
@@ -0,0 +1,108 @@
+# ======================================================================
+
+import unittest,os,shutil,tempfile,datetime
+
+import numpy as np
+
+import swap
+
+# ======================================================================
+# An event log reads back the classifications written to it, and after
+# a write that was cut short, or being cut back, carries on appending in
+# the right places:
+
+class EventLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = os.path.join(tempfile.mkdtemp(prefix='swaptest'),'log')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.dirname))
+
+    def record(self,i,Name,ID):
+        t = datetime.datetime(2013,5,6,12,0,0) + datetime.timedelta(seconds=i)
+        clicks = np.arange(i % 3,dtype=float)
+        return swap.make_record(t,Name,ID,'Zoo'+ID,'test','test','test','LENS' if i % 2 else 'NOT','UNKNOWN','nowhere',1,clicks,clicks+0.5)
+
+    def append(self,records):
+        log = swap.EventLog(self.dirname)
+        for record in records:
+            log.append(record)
+        log.flush()
+        return
+
+    def assertReplays(self,records):
+        log = swap.EventLog(self.dirname)
+        events = list(log.find('since',datetime.datetime(2000,1,1)))
+        self.assertEqual(len(events),len(records))
+        for event,record in zip(events,records):
+            other = log.digest(event,'TEST')
+            self.assertEqual(tuple(other[:11]),tuple(record[:11]))
+            self.assertTrue(np.all(other.at_x == record.at_x))
+            self.assertTrue(np.all(other.at_y == record.at_y))
+        return
+
+    def test_replay(self):
+
+        records = [self.record(i,'agent%d' % (i % 3),'subject%d' % (i % 4)) for i in range(10)]
+        self.append(records[:6])
+        self.append(records[6:])
+        self.assertReplays(records)
+
+        return
+
+    def test_repair(self):
+
+        records = [self.record(i,'agent%d' % (i % 3),'subject%d' % (i % 4)) for i in range(10)]
+        self.append(records)
+
+        # A flush that got as far as the tables and the clicks, but not
+        # the events, and then stopped part way through each file:
+        F = open(os.path.join(self.dirname,'names.txt'),'a')
+        F.write('lost\nhalf a na')
+        F.close()
+        F = open(os.path.join(self.dirname,'subjects.txt'),'a')
+        F.write('["half a subj')
+        F.close()
+        F = open(os.path.join(self.dirname,'clicks.bin'),'ab')
+        np.arange(5.0).tofile(F)
+        F.close()
+        F = open(os.path.join(self.dirname,'events.bin'),'ab')
+        F.write('\0'*(swap.event_dtype.itemsize/2))
+        F.close()
+
+        self.assertReplays(records)
+
+        # New names, subjects and clicks go after the complete ones:
+        more = [self.record(i,'agent%d' % (i % 5),'subject%d' % (i % 6)) for i in range(10,20)]
+        self.append(more)
+        self.assertReplays(records+more)
+
+        log = swap.EventLog(self.dirname)
+        self.assertEqual(log.names[-3:],['lost','agent3','agent4'])
+        self.assertEqual(os.path.getsize(os.path.join(self.dirname,'events.bin')),20*swap.event_dtype.itemsize)
+
+        return
+
+    def test_truncate(self):
+
+        records = [self.record(i,'agent%d' % (i % 3),'subject%d' % (i % 4)) for i in range(10)]
+        self.append(records)
+
+        log = swap.EventLog(self.dirname)
+        log.truncate(6)
+        self.assertEqual(log.size(),6)
+        self.assertReplays(records[:6])
+
+        # What was cut can be logged again:
+        self.append(records[6:])
+        self.assertReplays(records)
+
+        return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ======================================================================
@@ -0,0 +1,191 @@
+# ======================================================================
+
+import unittest,copy
+
+import numpy as np
+
+import swap
+from tests.toy import Workspace
+
+# ======================================================================
+# The offline EM loops that SWAP.py used to run, one E and one M step
+# per subject and agent, for N steps:
+
+def old_em(bureau,sample,N,supervised=False,supervised_and_unsupervised=False):
+
+    for step in range(N):
+
+        for ID in sample.list():
+            annotationhistory = sample.member[ID].annotationhistory
+            if len(annotationhistory['Name']) > 0:
+                sample.member[ID].was_described_many_times(bureau,annotationhistory['Name'],annotationhistory['ItWas'],realize_confusion=False,laplace_smoothing=0)
+
+        for Name in bureau.list():
+            agent = bureau.member[Name]
+            if supervised_and_unsupervised:
+                classifications = np.append(agent.traininghistory['ItWas'],agent.testhistory['ItWas'])
+                probabilities = []
+                for ID in agent.traininghistory['ID']:
+                    subject = sample.member[ID]
+                    if subject.kind == 'test':
+                        probabilities.append(subject.mean_probability)
+                    else:
+                        probabilities.append(1.0 if subject.kind == 'sim' else 0.0)
+                probabilities += [sample.member[ID].mean_probability for ID in agent.testhistory['ID']]
+            elif supervised:
+                classifications = agent.traininghistory['ItWas']
+                probabilities = agent.traininghistory['ActuallyItWas']
+            else:
+                classifications = agent.testhistory['ItWas']
+                probabilities = [sample.member[ID].mean_probability for ID in agent.testhistory['ID']]
+            agent.heard_many_times(np.array(probabilities,dtype=float),classifications)
+
+    return
+
+# ======================================================================
+# Offline EM, supervised: the log-likelihood in the trace never goes
+# down, with or without acceleration, and the accelerated runs get to
+# the same answer in far fewer steps. Warm-started from a previous
+# state, it gets to the same answer as from scratch.
+
+class OfflineEMTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        workspace = Workspace(population=200,enthusiasm=30)
+        try:
+            workspace.run('online')
+            cls.bureau,cls.sample = workspace.state('online')
+        finally:
+            workspace.remove()
+
+    settings = dict(supervised=True,supervised_and_unsupervised=False,initialPL=0.5,initialPD=0.5,prior=swap.prior)
+
+    # Run EM from scratch, as SWAP.py does, on a copy of the online
+    # run's agents and subjects:
+    def offline_em(self,acceleration,epsilon_min=1e-6,keep=None):
+
+        bureau,sample = copy.deepcopy(self.bureau),copy.deepcopy(self.sample)
+        for ID in sample.list():
+            sample.member[ID].probability = swap.prior
+            sample.member[ID].update_state()
+        for Name in bureau.list():
+            bureau.member[Name].PL = 0.5
+            bureau.member[Name].PD = 0.5
+
+        trace = swap.offline_em(bureau,sample,supervised=True,N_min=2,N_max=1000,epsilon_min=epsilon_min,acceleration=acceleration)
+        if keep is not None:
+            keep.extend([bureau,sample])
+
+        return trace
+
+    def test_same_as_the_old_loops(self):
+
+        for mode in [dict(supervised=True),dict(supervised=False),dict(supervised=True,supervised_and_unsupervised=True)]:
+            old,new = [],[]
+            self.offline_em(None,keep=old)
+            self.offline_em(None,keep=new)
+            old_em(old[0],old[1],5,**mode)
+            swap.offline_em(new[0],new[1],N_min=5,N_max=5,**mode)
+
+            for Name in self.bureau.list():
+                self.assertAlmostEqual(old[0].member[Name].PL,new[0].member[Name].PL,places=10)
+                self.assertAlmostEqual(old[0].member[Name].PD,new[0].member[Name].PD,places=10)
+            for ID in self.sample.list():
+                subject,other = old[1].member[ID],new[1].member[ID]
+                if np.all(np.isfinite(subject.probability)):
+                    self.assertTrue(np.allclose(subject.probability,other.probability,rtol=1e-8,atol=0),(mode,ID))
+                    self.assertEqual((subject.state,subject.status),(other.state,other.status),(mode,ID))
+
+        return
+
+    def test_likelihood_never_goes_down(self):
+
+        for acceleration in [None,'squarem','aitken']:
+            loglikelihood = np.array([iteration[3] for iteration in self.offline_em(acceleration)])
+            self.assertTrue(np.all(np.diff(loglikelihood) >= -1e-9*np.abs(loglikelihood[1:])),acceleration)
+
+        return
+
+    def test_acceleration_takes_fewer_steps(self):
+
+        plain = self.offline_em(None)
+        for acceleration in ['squarem','aitken']:
+            trace = self.offline_em(acceleration)
+            self.assertTrue(trace[-1][2] <= 1e-6)
+            self.assertTrue(trace[-1][1] < plain[-1][1]/2,acceleration)
+            self.assertTrue(abs(trace[-1][3] - plain[-1][3]) < 1e-2,acceleration)
+            self.assertTrue(acceleration in [iteration[5] for iteration in trace])
+
+        return
+
+    def test_warm_start_gets_the_cold_start_answer(self):
+
+        cold = []
+        self.offline_em('squarem',epsilon_min=1e-7,keep=cold)
+        state = swap.em_state(cold[0],cold[1],self.settings)
+
+        # Pretend that last time, one agent had one training subject
+        # fewer, and some subjects one annotation fewer, and that they
+        # had all ended up somewhere else:
+        Name = self.bureau.list()[0]
+        state['N_agent'][Name] -= 1
+        state['PL'][Name] = 0.9
+        IDs = [ID for ID in self.sample.list() if len(self.sample.member[ID].annotationhistory['Name']) > 0][:20]
+        for ID in IDs:
+            state['N_subject'][ID] -= 1
+            state['probability'][ID] = 0.5
+
+        bureau,sample = copy.deepcopy(self.bureau),copy.deepcopy(self.sample)
+        self.assertEqual(swap.warm_start(bureau,sample,state,dict(self.settings,supervised=False)),None)
+        active = swap.warm_start(bureau,sample,state,self.settings)
+        self.assertEqual(active[0],[Name])
+        self.assertTrue(set(IDs) < set(active[1]))
+        self.assertTrue(len(active[1]) < len(sample.list())/2)
+
+        trace = swap.offline_em(bureau,sample,supervised=True,N_min=2,N_max=1000,epsilon_min=1e-7,acceleration='squarem',active=active)
+        self.assertTrue(trace[0][5].startswith('local_'))
+        self.assertFalse(trace[-1][5].startswith('local_'))
+
+        for ID in sample.list():
+            self.assertEqual(sample.member[ID].status,cold[1].member[ID].status,ID)
+            self.assertTrue(abs(sample.member[ID].mean_probability - cold[1].member[ID].mean_probability) < 1e-2,ID)
+
+        return
+
+# ======================================================================
+# Batches kept in memory, hasty and with offline EM: after each batch,
+# the index of retired subjects kept for the next one has just the
+# subjects that EM left retired.
+
+class OfflineBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = Workspace()
+
+    def tearDown(self):
+        self.workspace.remove()
+
+    def test_retired_subjects_follow_offline_em(self):
+
+        self.workspace.run('batches',offline=True,hasty=True,N_per_batch=400)
+
+        resident = {'checkpoint':True}
+        for k in range(3):
+            self.workspace.swap('batches','test.config',resident=resident)
+            sample,retired = resident['sample'],resident['retired']
+            inactive = [ID for ID in sample.list() if sample.member[ID].state == 'inactive']
+            self.assertTrue(len(inactive) > 0)
+            self.assertEqual(retired.size(),len(inactive))
+            self.assertTrue(all([ID in retired for ID in inactive]))
+
+        self.assertTrue(retired.skipped > 0)
+
+        return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ======================================================================
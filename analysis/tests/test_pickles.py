@@ -0,0 +1,109 @@
+# ======================================================================
+
+import unittest,cPickle
+
+import numpy as np
+
+import swap
+
+# ======================================================================
+# Pickles written by the old code, with plain dictionaries for
+# histories, an array for a trajectory, and plain probability
+# attributes, still read in, and carry on working:
+
+def old_subject(ID,kind,probability,names,results):
+
+    subject = object.__new__(swap.Subject)
+    subject.__dict__ = {'ID':ID, 'ZooID':'Zoo'+ID, 'category':'training', 'kind':kind,
+                        'flavor':kind, 'truth':('LENS' if kind == 'sim' else 'NOT'),
+                        'state':'active', 'status':'undecided',
+                        'retirement_time':'not yet', 'retirement_age':0.0,
+                        'probability':np.zeros(swap.Ntrajectory)+probability,
+                        'mean_probability':probability, 'median_probability':probability,
+                        'trajectory':np.concatenate([np.zeros(swap.Ntrajectory)+2e-4,np.zeros(swap.Ntrajectory)+probability]),
+                        'exposure':len(names),
+                        'detection_threshold':0.95, 'rejection_threshold':1e-7,
+                        'location':'nowhere',
+                        'annotationhistory':{'Name':np.array(names),
+                                             'ItWas':np.array(results,dtype=int),
+                                             'PL':np.zeros(len(names))+0.6,
+                                             'PD':np.zeros(len(names))+0.7,
+                                             'At_X':[[]]*len(names),
+                                             'At_Y':[[]]*len(names),
+                                             'At_Time':['2013-05-06_12:00:00']*len(names)}}
+
+    return subject
+
+def old_agent(Name,IDs,results,truths):
+
+    agent = object.__new__(swap.Agent)
+    agent.__dict__ = {'name':Name, 'kind':'normal', 'PL':0.6, 'PD':0.7,
+                      'ND':4, 'NL':4, 'N':len(IDs), 'NT':len(IDs),
+                      'contribution':0.0, 'skill':0.1,
+                      'traininghistory':{'ID':np.array(IDs),
+                                         'Skill':np.zeros(len(IDs)+1)+0.1,
+                                         'PL':np.zeros(len(IDs)+1)+0.6,
+                                         'PD':np.zeros(len(IDs)+1)+0.7,
+                                         'ItWas':np.array(results,dtype=int),
+                                         'ActuallyItWas':np.array(truths,dtype=int),
+                                         'At_Time':np.array(['2013-05-06_12:00:00']*len(IDs))},
+                      'testhistory':{'ID':[], 'I':np.array([]), 'Skill':np.array([]),
+                                     'ItWas':np.array([],dtype=int), 'At_Time':np.array([])}}
+
+    return agent
+
+def round_trip(thing):
+    return cPickle.loads(cPickle.dumps(thing,protocol=2))
+
+class OldPickleTest(unittest.TestCase):
+
+    def test_old_collection(self):
+
+        collection = object.__new__(swap.Collection)
+        collection.__dict__ = {'member':{'a':old_subject('a','sim',0.3,['x','y'],[1,0]),
+                                         'b':old_subject('b','dud',1e-3,['x'],[0])},
+                               'probabilities':{'sim':np.array([]), 'dud':np.array([]), 'test':np.array([])},
+                               'exposure':{'sim':np.array([]), 'dud':np.array([]), 'test':np.array([])}}
+
+        collection = round_trip(collection)
+        self.assertEqual(sorted(collection.list()),['a','b'])
+
+        subject = collection.member['a']
+        self.assertTrue(np.all(subject.probability == 0.3))
+        self.assertEqual(subject.median_probability,0.3)
+        self.assertEqual(len(subject.trajectory),2*swap.Ntrajectory)
+        self.assertTrue(np.all(subject.trajectory[swap.Ntrajectory:] == 0.3))
+        self.assertTrue(isinstance(subject.annotationhistory,swap.History))
+        self.assertEqual(list(subject.annotationhistory['Name']),['x','y'])
+        self.assertEqual(list(subject.annotationhistory['ItWas']),[1,0])
+
+        # Changes of state are noted in the collection again:
+        subject.probability = np.zeros(swap.Ntrajectory)+0.99
+        subject.update_state()
+        self.assertEqual(subject.status,'detected')
+        self.assertEqual(collection.transitions.changes(collection)['detected'],['a'])
+
+        return
+
+    def test_old_agent(self):
+
+        agent = round_trip(old_agent('x',['a','b'],[1,0],[1,0]))
+
+        self.assertTrue(isinstance(agent.traininghistory,swap.History))
+        self.assertTrue(isinstance(agent.testhistory,swap.History))
+        self.assertEqual(list(agent.traininghistory['ID']),['a','b'])
+        self.assertEqual(list(agent.traininghistory['ActuallyItWas']),[1,0])
+        self.assertEqual(len(agent.testhistory['ID']),0)
+
+        agent.heard_many_times(agent.traininghistory['ActuallyItWas'].astype(float),agent.traininghistory['ItWas'])
+        self.assertAlmostEqual(agent.PL,2.0/3.0)
+        self.assertAlmostEqual(agent.PD,2.0/3.0)
+
+        return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ======================================================================
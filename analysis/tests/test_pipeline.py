@@ -0,0 +1,87 @@
+# ======================================================================
+
+import unittest,datetime
+
+import swap
+
+try:
+    from bson.objectid import ObjectId
+except ImportError:
+    ObjectId = None
+
+# ======================================================================
+# A MongoDB with its classifications and subjects in memory, for
+# swap.digested() to read on its other processes:
+
+class MemoryMongo(swap.MongoDB):
+
+    def __init__(self,classifications,subjects):
+        self.classifications = classifications
+        self.subjects = subjects
+        self.cachefile = None
+        self.subject_cache = {}
+        self.N_lookup = 1000
+        self.batch_size = 1000
+        return None
+
+    def connect(self):
+        return
+
+    def find(self,word,t,after=None):
+        return iter(self.classifications)
+
+    def fetch_subjects(self,IDs):
+        for ID in IDs:
+            self.subject_cache[ID] = self.subjects.get(ID)
+        return
+
+# ======================================================================
+# Digested on a Reader and Digesters, classifications of retired
+# subjects are dropped by the Reader, before their subjects are looked
+# up, and counted; the rest come out in order:
+
+@unittest.skipIf(ObjectId is None,"needs bson")
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+
+        IDs = [ObjectId() for k in range(4)]
+        subjects = dict([(ID,{'_id':ID, 'group_id':swap.mongodb.testGroup, 'location':{'standard':'nowhere'}}) for ID in IDs])
+        t = datetime.datetime(2013,5,6,12,0,0)
+        classifications = []
+        for i in range(20):
+            annotations = [{'project':'TEST'}] + ([{'x':'1.0','y':'2.0'}] if i % 3 == 0 else [])
+            classifications.append({'_id':i, 'updated_at':t+datetime.timedelta(seconds=i),
+                                    'user_id':'agent%d' % (i % 5),
+                                    'subjects':[{'id':IDs[i % 4], 'zooniverse_id':'ASW%d' % (i % 4)}],
+                                    'annotations':annotations})
+
+        self.IDs = IDs
+        self.db = MemoryMongo(classifications,subjects)
+
+        return
+
+    def test_retired_subjects_are_dropped_by_the_reader(self):
+
+        retired = swap.RetiredSubjects()
+        retired.add(str(self.IDs[0]))
+
+        query = ('since',datetime.datetime(2000,1,1),None)
+        records = list(swap.digested(self.db,query,'TEST',N_workers=2,N_per_chunk=3,retired=retired))
+
+        self.assertEqual([record.key[1] for record in records],[i for i in range(20) if i % 4 != 0])
+        self.assertEqual([record.ID for record in records],[str(self.IDs[i % 4]) for i in range(20) if i % 4 != 0])
+        self.assertEqual(retired.skipped,5)
+
+        # The retired subject was never looked up:
+        self.assertFalse(self.IDs[0] in self.db.subject_cache)
+        self.assertTrue(all([ID in self.db.subject_cache for ID in self.IDs[1:]]))
+
+        return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ======================================================================
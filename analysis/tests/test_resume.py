@@ -0,0 +1,81 @@
+# ======================================================================
+
+import unittest,re,shutil
+
+import swap
+from tests.toy import Workspace
+
+# ======================================================================
+# A run that stops at its end time, carried on from there, sees every
+# classification once - including the first one after the end time. And
+# if the second run dies just before its checkpoint is made, carrying on
+# again from the first checkpoint does not log its classifications
+# twice:
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = Workspace()
+
+    def tearDown(self):
+        self.workspace.remove()
+
+    # Total number of classifications that a run's subjects have had:
+    def exposure(self,name):
+        bureau,sample = self.workspace.state(name)
+        return sum([sample.member[ID].exposure for ID in sample.list()])
+
+    # Carry on to the end, from update.config:
+    def carry_on_to_the_end(self,name):
+
+        config = self.workspace.path(name,'update.config')
+        F = open(config,'r')
+        lines = F.read()
+        F.close()
+        F = open(config,'w')
+        F.write(re.sub(r'^end: .*$','end: the_end_of_time',lines,flags=re.M))
+        F.close()
+
+        self.workspace.carry_on(name)
+
+        return lines
+
+    def test_carry_on_after_the_end_time(self):
+
+        self.workspace.run('whole')
+
+        self.workspace.run('split',end='2013-04-07_00:00:00')
+        first = self.exposure('split')
+        lines = self.carry_on_to_the_end('split')
+        self.assertTrue(re.search(r'^start_key: 2013-04-06_',lines,re.M) is not None)
+
+        self.assertTrue(0 < first < self.exposure('whole'))
+        self.assertEqual(self.exposure('split'),self.exposure('whole'))
+
+        return
+
+    def test_carry_on_from_a_checkpoint_with_an_event_log(self):
+
+        self.workspace.run('whole',eventlog='log')
+        N = swap.EventLog(self.workspace.path('whole','log')).size()
+
+        self.workspace.run('split',end='2013-04-07_00:00:00',checkpoints='checkpoints',eventlog='log')
+        manifest = self.workspace.path('split','checkpoints','manifest.json')
+        shutil.copy(manifest,manifest+'.first')
+        self.carry_on_to_the_end('split')
+        self.assertEqual(swap.EventLog(self.workspace.path('split','log')).size(),N)
+
+        # Die before the second checkpoint:
+        shutil.copy(manifest+'.first',manifest)
+        self.workspace.carry_on('split')
+        self.assertEqual(swap.EventLog(self.workspace.path('split','log')).size(),N)
+        self.assertEqual(self.exposure('split'),self.exposure('whole'))
+
+        return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ======================================================================
@@ -0,0 +1,112 @@
+# ======================================================================
+
+import unittest,os,shutil,tempfile
+
+import numpy as np
+
+import swap
+from tests.toy import Workspace
+
+# ======================================================================
+# Snapshots read back what was written, and writing one over itself
+# only writes the files that have changed. One that was only partly
+# written is not read at all:
+
+class SnapshotTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        workspace = Workspace()
+        try:
+            workspace.run('online')
+            cls.bureau,cls.sample = workspace.state('online')
+        finally:
+            workspace.remove()
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp(prefix='swaptest')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_round_trip(self):
+
+        swap.write_snapshot(self.bureau,os.path.join(self.dirname,'bureau'))
+        swap.write_snapshot(self.sample,os.path.join(self.dirname,'sample'))
+        bureau = swap.read_snapshot(os.path.join(self.dirname,'bureau'),'bureau')
+        sample = swap.read_snapshot(os.path.join(self.dirname,'sample'),'collection')
+
+        self.assertEqual(sorted(bureau.list()),sorted(self.bureau.list()))
+        for Name in self.bureau.list():
+            agent,other = self.bureau.member[Name],bureau.member[Name]
+            self.assertEqual((agent.PL,agent.PD,agent.N,agent.NT,agent.kind),(other.PL,other.PD,other.N,other.NT,other.kind))
+            for key,kind in swap.traininghistory_fields:
+                self.assertEqual(list(agent.traininghistory[key]),list(other.traininghistory[key]))
+
+        self.assertEqual(sorted(sample.list()),sorted(self.sample.list()))
+        for ID in self.sample.list():
+            subject,other = self.sample.member[ID],sample.member[ID]
+            self.assertTrue(np.all(subject.probability == other.probability))
+            self.assertEqual((subject.status,subject.state,subject.exposure),(other.status,other.state,other.exposure))
+            self.assertTrue(np.all(subject.trajectory == other.trajectory))
+            self.assertEqual(list(subject.annotationhistory['Name']),list(other.annotationhistory['Name']))
+            self.assertEqual(list(subject.annotationhistory['ItWas']),list(other.annotationhistory['ItWas']))
+
+        return
+
+    def test_only_changes_are_written(self):
+
+        dirname = os.path.join(self.dirname,'sample')
+        swap.write_snapshot(self.sample,dirname)
+        sample = swap.read_snapshot(dirname,'collection')
+        self.assertEqual(swap.write_snapshot(sample,dirname),0)
+
+        # Changing a subject's probability in memory changes neither the
+        # files nor the other subjects:
+        ID = sample.list()[0]
+        sample.member[ID].probability = np.zeros(swap.Ntrajectory)+0.5
+        self.assertEqual(swap.read_snapshot(dirname,'collection').member[ID].probability[0],self.sample.member[ID].probability[0])
+        self.assertEqual(swap.write_snapshot(sample,dirname),1)
+
+        again = swap.read_snapshot(dirname,'collection')
+        self.assertTrue(np.all(again.member[ID].probability == 0.5))
+        for other in sample.list()[1:]:
+            self.assertTrue(np.all(again.member[other].probability == self.sample.member[other].probability))
+
+        return
+
+    def test_partly_written(self):
+
+        dirname = os.path.join(self.dirname,'sample')
+        swap.write_snapshot(self.sample,dirname)
+        sample = swap.read_snapshot(dirname,'collection')
+
+        # A write that dies after its first new file:
+        ID = sample.list()[0]
+        sample.member[ID].probability = np.zeros(swap.Ntrajectory)+0.5
+        sample.member[ID].annotationhistory.append(**dict([(key,0) for key,kind in swap.annotationhistory_fields]))
+        save_array = swap.snapshot.save_array
+        def save_one_array(*args):
+            save_array(*args)
+            swap.snapshot.save_array = None
+        swap.snapshot.save_array = save_one_array
+        try:
+            self.assertRaises(TypeError,swap.write_snapshot,sample,dirname)
+        finally:
+            swap.snapshot.save_array = save_array
+        self.assertRaises(Exception,swap.read_snapshot,dirname,'collection')
+
+        # Writing it again mends it, even if it is the old contents:
+        self.assertTrue(swap.write_snapshot(self.sample,dirname) > 0)
+        again = swap.read_snapshot(dirname,'collection')
+        self.assertTrue(np.all(again.member[ID].probability == self.sample.member[ID].probability))
+        self.assertEqual(len(again.member[ID].annotationhistory['Name']),len(self.sample.member[ID].annotationhistory['Name']))
+
+        return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ======================================================================
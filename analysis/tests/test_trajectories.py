@@ -0,0 +1,64 @@
+# ======================================================================
+
+import unittest,os,shutil,tempfile
+
+import numpy as np
+
+import swap
+
+# ======================================================================
+# Subjects' ensembles moved into a TrajectoryStore read back in full,
+# straight after each flush, and from the directory later on:
+
+class TrajectoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp(prefix='swaptest')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_read_after_flush(self):
+
+        thresholds = {'detection':0.95, 'rejection':1e-7}
+        sample = swap.Collection()
+        for ID in ['a','b','c']:
+            sample.member[ID] = swap.Subject(ID,'Zoo'+ID,'test','test','test','UNKNOWN',thresholds,'nowhere')
+        expected = dict([(ID,[sample.member[ID].trajectory.copy()]) for ID in sample.list()])
+
+        # Each flush writes a new member after the last, and has to be
+        # read back straight away, from archives that are already open:
+        store = swap.TrajectoryStore(os.path.join(self.dirname,'store'),N_archives=2)
+        np.random.seed(3)
+        for flush in range(3):
+            for ID in sample.list()[:flush+1]:
+                ensembles = np.random.uniform(size=(flush+1,swap.Ntrajectory))
+                swap.record_trajectory(sample.member[ID].trajectoryhistory,ensembles)
+                expected[ID].append(ensembles.ravel())
+            store.flush(sample)
+            for ID in sample.list():
+                subject = sample.member[ID]
+                self.assertEqual(len(subject.trajectory),0)
+                self.assertTrue(np.all(store.trajectory(subject) == np.concatenate(expected[ID])),(flush,ID))
+                self.assertEqual(len(subject.trajectory_summary),len(np.concatenate(expected[ID]))/swap.Ntrajectory)
+        store.close()
+
+        # Ensembles still in the collection come after the stored ones:
+        ensembles = np.random.uniform(size=(1,swap.Ntrajectory))
+        swap.record_trajectory(sample.member['a'].trajectoryhistory,ensembles)
+        expected['a'].append(ensembles.ravel())
+
+        store = swap.TrajectoryStore(os.path.join(self.dirname,'store'))
+        self.assertEqual(store.N_archives,2)
+        for ID in sample.list():
+            self.assertTrue(np.all(store.trajectory(sample.member[ID]) == np.concatenate(expected[ID])),ID)
+        store.close()
+
+        return
+
+# ======================================================================
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ======================================================================
@@ -0,0 +1,102 @@
+# ======================================================================
+
+import swap
+
+import os,sys,shutil,tempfile,cPickle
+import numpy as np
+
+from SWAP import SWAP
+
+# ======================================================================
+# Things the tests have in common: a workspace with a small Toy
+# database in it, and SWAP runs on it with a given configuration.
+
+class Workspace(object):
+
+    def __init__(self,population=60,enthusiasm=15,seed=1):
+
+        self.dirname = tempfile.mkdtemp(prefix='swaptest')
+
+        np.random.seed(seed)
+        self.db = quietly(swap.ToyDB,pars={'population': population, 'enthusiasm': enthusiasm})
+        swap.write_pickle(self.db,self.path('toy.pickle'))
+
+        return None
+
+    def path(self,*filenames):
+        return os.path.join(self.dirname,*filenames)
+
+    def remove(self):
+        shutil.rmtree(self.dirname)
+
+# ----------------------------------------------------------------------------
+# Run SWAP in a new subdirectory, on the standard startup config with
+# the given parameters changed, and a random state from the seed:
+
+    def run(self,name,seed=2,**parameters):
+
+        here = self.path(name)
+        os.makedirs(here)
+
+        config = dict(dbspecies='Toy', dbfile=self.path('toy.pickle'), report=False)
+        config.update(parameters)
+        F = open(os.path.join(os.path.dirname(swap.__file__),'startup.config'),'r')
+        lines = F.read().replace('SURVEY','TEST').replace('STAGE','1')
+        F.close()
+        F = open(os.path.join(here,'test.config'),'w')
+        F.write(lines)
+        for key in sorted(config):
+            F.write('%s: %s\n' % (key,config[key]))
+        F.close()
+
+        np.random.seed(seed)
+        F = open(os.path.join(here,'random_state.pickle'),'w')
+        cPickle.dump(np.random.get_state(),F)
+        F.close()
+
+        self.swap(name,'test.config')
+
+        return here
+
+# Run SWAP again, in the same subdirectory, carrying on from update.config
+# (or, as SWAPSHOP.py does, from the state kept in resident):
+
+    def carry_on(self,name):
+        self.swap(name,'update.config')
+
+    def swap(self,name,configfile,resident=None):
+
+        cwd = os.getcwd()
+        os.chdir(self.path(name))
+        try:
+            quietly(SWAP,[configfile],resident=resident)
+        finally:
+            os.chdir(cwd)
+
+        return
+
+# ----------------------------------------------------------------------------
+# The bureau and sample that a run saved:
+
+    def state(self,name):
+
+        pars = swap.Configuration(self.path(name,'update.config')).parameters
+        bureau = quietly(swap.read_pickle,self.path(name,pars['bureaufile']),'bureau')
+        sample = quietly(swap.read_pickle,self.path(name,pars['samplefile']),'collection')
+
+        return bureau,sample
+
+# ======================================================================
+# Call a function without letting it print anything:
+
+def quietly(function,*args,**kwargs):
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull,'w')
+    try:
+        return function(*args,**kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+# ======================================================================
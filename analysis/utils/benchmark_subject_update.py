@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import os,sys,time
+# The swap package lives one level up from here, in $SWAP_DIR:
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import swap
+import numpy as np
+
+# Time Subject.was_described(), the sequential engine's update of one
+# subject by one classification, eg:
+#   benchmark_subject_update.py 20000
+# classifies 100 test subjects 200 times each (record=False, so the
+# agent's histories don't grow), with each trajectory mode, and as
+# SubjectViews of an ArrayCollection, and prints the best of 5 times
+# per call.
+
+N = 20000
+if len(sys.argv) > 1:
+    N = int(sys.argv[1])
+Nsubjects = 100
+
+pars = {'initialPL':0.5, 'initialPD':0.5, 'skepticism':0}
+thresholds = {'detection':0.95, 'rejection':1e-7}
+
+# A fairly good agent, classifying LENS and NOT at random:
+agent = swap.Agent('benchmark',pars)
+agent.PL,agent.PD,agent.NT = 0.9,0.8,10
+np.random.seed(1)
+words = np.where(np.random.rand(N) < 0.5,'LENS','NOT')
+
+def subjects(trajectory,views=False):
+    sample = [swap.Subject('subject%d' % i,'ASW%d' % i,'test','test','test','UNKNOWN',thresholds,'nowhere',trajectory=trajectory) for i in range(Nsubjects)]
+    if views:
+        collection = swap.ArrayCollection()
+        for subject in sample:
+            collection.add(subject.ID,subject)
+        sample = [collection.member[subject.ID] for subject in sample]
+    return sample
+
+def benchmark(trajectory,views=False):
+    best = None
+    for attempt in range(5):
+        sample = subjects(trajectory,views)
+        start = time.time()
+        for k in range(N):
+            sample[k % Nsubjects].was_described(by=agent,as_being=words[k],at_time='2013-05-06_12:00:00',record=False,trajectory=trajectory)
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+    return 1e6*best/N
+
+for trajectory in ['full','summary','off']:
+    print "benchmark_subject_update: Subject, trajectory "+trajectory+": %.1f us per classification" % benchmark(trajectory)
+print "benchmark_subject_update: SubjectView, trajectory full: %.1f us per classification" % benchmark('full',views=True)
+
+# That's it.
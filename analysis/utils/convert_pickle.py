@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+
+import os,sys
+# The swap package lives one level up from here, in $SWAP_DIR:
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import swap
+
+# Convert bureau and collection pickles into snapshot directories, eg:
+#   convert_pickle.py CFHTLS_bureau.pickle CFHTLS_collection.pickle
+# makes CFHTLS_bureau.snapshot and CFHTLS_collection.snapshot. To carry
+# on from them, set "state_format: snapshot" in the config file, and
+# point bureaufile and samplefile at the snapshots.
+
+for picklefile in sys.argv[1:]:
+    dirname = swap.convert_pickle(picklefile)
+    print "convert_pickle: wrote "+picklefile+" to "+dirname
+
+# That's it.
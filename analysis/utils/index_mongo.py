@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+
+import os,sys
+# The swap package lives one level up from here, in $SWAP_DIR:
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import swap
+
+# Index the classifications in the Mongo by updated_at and _id, the
+# order in which SWAP reads them (see swap.MongoDB.find). Run this once
+# after each mongorestore (SWIPE.csh does), with the server running, eg:
+#   index_mongo.py
+# Building the index can take a while, on a big database - SWAP does
+# not make it for itself, but just warns if it is not there.
+
+db = swap.MongoDB()
+db.create_index()
+
+# That's it.